@@ -0,0 +1,263 @@
+"""
+Archive ingestion for MyEarth.app
+Reads the member list of zip, 7z and rar archives without unpacking them,
+groups members into assets (3D Tiles tilesets, glTF files with their
+external resources, standalone models) and streams only those members to
+disk, within size limits
+"""
+
+import json
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import unquote
+
+CHUNK_SIZE = 1024 * 1024
+
+MAX_MEMBERS = 10000
+MAX_MEMBER_BYTES = int(os.getenv("ARCHIVE_MAX_MEMBER_BYTES", str(2 * 1024 ** 3)))
+MAX_EXTRACT_BYTES = int(os.getenv("ARCHIVE_MAX_EXTRACT_BYTES", str(4 * 1024 ** 3)))
+MAX_COMPRESSION_RATIO = 200  # larger ratios are treated as zip bombs
+MAX_JSON_SNIFF_BYTES = 16 * 1024 * 1024  # JSON members read to detect tilesets
+
+SEVEN_ZIP_BINARY = os.getenv("SEVEN_ZIP_BINARY", "7z")
+
+
+class ArchiveError(ValueError):
+    """The archive cannot be read or exceeds the extraction limits"""
+
+
+@dataclass
+class Member:
+    name: str  # normalized relative POSIX path
+    size: int
+    compressed_size: int
+
+
+@dataclass
+class Asset:
+    kind: str  # "tileset", "gltf" or "model"
+    entry: str  # member the viewer loads
+    members: List[str] = field(default_factory=list)  # everything extracted for it
+
+
+def safe_member_name(name: str) -> Optional[str]:
+    """Normalized relative path, or None for absolute, parent-relative and metadata entries"""
+    name = name.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        return None
+    normalized = posixpath.normpath(name)
+    parts = normalized.split("/")
+    if normalized in (".", "") or ".." in parts or parts[0] == "__MACOSX":
+        return None
+    if any(part.startswith(".") for part in parts):
+        return None
+    return normalized
+
+
+# --------------------
+# Readers
+# --------------------
+class _ZipReader:
+    def __init__(self, path: Path):
+        try:
+            self.zip = zipfile.ZipFile(path)
+        except zipfile.BadZipFile as e:
+            raise ArchiveError(f"Invalid zip archive: {e}")
+        # ZipFile only reads the central directory here
+        self.infos = {}
+        for info in self.zip.infolist():
+            name = None if info.is_dir() else safe_member_name(info.filename)
+            if name:
+                self.infos[name] = info
+
+    def members(self) -> List[Member]:
+        return [Member(name, info.file_size, info.compress_size) for name, info in self.infos.items()]
+
+    def read(self, name: str) -> bytes:
+        with self.zip.open(self.infos[name]) as f:
+            return f.read(MAX_JSON_SNIFF_BYTES + 1)
+
+    def extract(self, names: Iterable[str], dest: Path) -> None:
+        for name in names:
+            info = self.infos[name]
+            target = dest / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            written = 0
+            with self.zip.open(info) as src, open(target, "wb") as out:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    # Never trust the declared size alone
+                    if written > info.file_size:
+                        raise ArchiveError(f"{name} is larger than its directory entry")
+                    out.write(chunk)
+
+    def close(self) -> None:
+        self.zip.close()
+
+
+class _SevenZipReader:
+    """7z and rar archives through the 7z command line tool"""
+
+    def __init__(self, path: Path):
+        if shutil.which(SEVEN_ZIP_BINARY) is None:
+            raise ArchiveError(f"{path.suffix} archives need the {SEVEN_ZIP_BINARY} tool")
+        self.path = path
+        result = subprocess.run([SEVEN_ZIP_BINARY, "l", "-slt", str(path)],
+                                capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise ArchiveError(f"Invalid archive: {result.stderr.strip() or result.stdout.strip()}")
+        self.entries: Dict[str, Member] = {}
+        self.originals: Dict[str, str] = {}
+        # Technical listing: "Key = value" blocks separated by blank lines, after a dashed line
+        listing = result.stdout.split("\n----------\n", 1)[-1]
+        for block in listing.split("\n\n"):
+            fields = dict(line.split(" = ", 1) for line in block.splitlines() if " = " in line)
+            if "Path" not in fields or fields.get("Folder") == "+" or "D" in fields.get("Attributes", "")[:1]:
+                continue
+            name = safe_member_name(fields["Path"])
+            if name:
+                size = int(fields.get("Size") or 0)
+                packed = int(fields.get("Packed Size") or 0)
+                self.entries[name] = Member(name, size, packed or size)
+                self.originals[name] = fields["Path"]
+
+    def members(self) -> List[Member]:
+        return list(self.entries.values())
+
+    def read(self, name: str) -> bytes:
+        result = subprocess.run([SEVEN_ZIP_BINARY, "x", "-so", str(self.path), self.originals[name]],
+                                capture_output=True, timeout=120)
+        return result.stdout[:MAX_JSON_SNIFF_BYTES + 1]
+
+    def extract(self, names: Iterable[str], dest: Path) -> None:
+        names = list(names)
+        if not names:
+            return
+        # One 7z run for all members; the list file avoids command line limits
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+            list_file.write("\n".join(self.originals[n] for n in names))
+        try:
+            result = subprocess.run([SEVEN_ZIP_BINARY, "x", "-y", f"-o{dest}", str(self.path), f"@{list_file.name}"],
+                                    capture_output=True, text=True, timeout=3600)
+        finally:
+            os.unlink(list_file.name)
+        if result.returncode != 0:
+            raise ArchiveError(f"Extraction failed: {result.stderr.strip()}")
+        for name in names:
+            path = dest / name
+            if not path.is_file() or path.stat().st_size > self.entries[name].size:
+                raise ArchiveError(f"{name} was not extracted as listed")
+
+    def close(self) -> None:
+        pass
+
+
+class Archive:
+    """Read-only view of an archive: members, small reads and selective extraction"""
+
+    def __init__(self, path: Path):
+        self.reader = _ZipReader(path) if zipfile.is_zipfile(path) else _SevenZipReader(path)
+        self.members = {m.name: m for m in self.reader.members()}
+        if len(self.members) > MAX_MEMBERS:
+            self.close()
+            raise ArchiveError(f"Archive has more than {MAX_MEMBERS} files")
+
+    def __enter__(self) -> "Archive":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.reader.close()
+
+    def read_json(self, name: str) -> Optional[dict]:
+        if self.members[name].size > MAX_JSON_SNIFF_BYTES:
+            return None
+        try:
+            data = json.loads(self.reader.read(name))
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def extract(self, names: Iterable[str], dest: Path) -> None:
+        """Extract members below dest, keeping their relative paths"""
+        names = sorted(set(names))
+        total = 0
+        for name in names:
+            member = self.members[name]
+            if member.size > MAX_MEMBER_BYTES:
+                raise ArchiveError(f"{name} exceeds the {MAX_MEMBER_BYTES} byte member limit")
+            if member.size > MAX_COMPRESSION_RATIO * max(member.compressed_size, 1024):
+                raise ArchiveError(f"{name} has a suspicious compression ratio")
+            total += member.size
+        if total > MAX_EXTRACT_BYTES:
+            raise ArchiveError(f"Archive contents exceed the {MAX_EXTRACT_BYTES} byte limit")
+        self.reader.extract(names, dest)
+
+
+# --------------------
+# Planning
+# --------------------
+def _is_under(name: str, directory: str) -> bool:
+    return directory == "" or name.startswith(directory + "/")
+
+
+def _gltf_resources(gltf: dict, directory: str) -> List[str]:
+    uris = [item.get("uri") for key in ("buffers", "images") for item in gltf.get(key, [])]
+    return [posixpath.normpath(posixpath.join(directory, unquote(uri)))
+            for uri in uris if uri and not uri.startswith("data:") and "://" not in uri]
+
+
+def plan_assets(archive: Archive, model_extensions: Iterable[str]) -> List[Asset]:
+    """Group the members that need extracting into loadable assets.
+
+    A tileset JSON claims every file below its directory, so multi-file
+    tilesets keep their structure; a .gltf claims the buffers and images it
+    references. Every other member with a model extension stands alone.
+    """
+    names = sorted(archive.members)
+    model_extensions = set(model_extensions)
+    assets: List[Asset] = []
+    claimed = set()
+
+    # Shallowest tileset first, so nested (external) tilesets stay part of their parent,
+    tileset_dirs = []
+    # and a tileset.json wins over other tilesets in the same directory
+    json_names = sorted((n for n in names if n.lower().endswith(".json")),
+                        key=lambda n: (n.count("/"), posixpath.basename(n).lower() != "tileset.json", n))
+    for name in json_names:
+        directory = posixpath.dirname(name)
+        if any(_is_under(name, d) for d in tileset_dirs):
+            continue
+        data = archive.read_json(name)
+        if data and "asset" in data and "root" in data:
+            tileset_dirs.append(directory)
+            assets.append(Asset("tileset", name, [n for n in names if _is_under(n, directory)]))
+    for asset in assets:
+        claimed.update(asset.members)
+
+    for name in names:
+        if name in claimed or not name.lower().endswith(".gltf"):
+            continue
+        gltf = archive.read_json(name)
+        if gltf is None:
+            continue
+        resources = [r for r in _gltf_resources(gltf, posixpath.dirname(name)) if r in archive.members]
+        assets.append(Asset("gltf", name, [name] + resources))
+        claimed.update(assets[-1].members)
+
+    for name in names:
+        if name not in claimed and posixpath.splitext(name)[1].lower() in model_extensions:
+            assets.append(Asset("model", name, [name]))
+    return assets
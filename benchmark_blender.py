@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold vs warm Blender conversions for MyEarth.app
+
+Cold: a fresh `blender --background` process per file (the old behaviour)
+Warm: the persistent BlenderPool used by convert_to_gltf
+Both run the same number of conversions at a time, so the speedup is the
+startup saved per file, not extra parallelism
+
+Usage:
+    python benchmark_blender.py model.obj other.stl --repeat 4 --workers 2
+"""
+
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from blender_pool import BlenderPool, BlenderWorker
+
+
+async def run_cold(inputs, out_dir: Path, workers: int) -> float:
+    """Convert each file in its own short-lived Blender process, `workers` at a time"""
+    slots = asyncio.Semaphore(workers)
+
+    async def convert(i: int, input_path: Path):
+        async with slots:
+            worker = BlenderWorker()
+            try:
+                await worker.start()
+                await worker.convert(input_path, out_dir / f"cold_{i}.glb")
+            finally:
+                await worker.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[convert(i, input_path) for i, input_path in enumerate(inputs)])
+    return time.perf_counter() - start
+
+
+async def run_warm(inputs, out_dir: Path, workers: int) -> float:
+    """Convert all files on a pool of already started Blender workers"""
+    pool = BlenderPool(size=workers)
+    # Warm the pool up front; startup is paid once per server, not per file
+    await asyncio.gather(*[
+        pool.convert(inputs[0], out_dir / f"warmup_{i}.glb") for i in range(workers)
+    ])
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        pool.convert(input_path, out_dir / f"warm_{i}.glb")
+        for i, input_path in enumerate(inputs)
+    ])
+    elapsed = time.perf_counter() - start
+
+    await pool.shutdown()
+    failed = sum(1 for r in results if r is None)
+    if failed:
+        print(f"⚠️  {failed} warm conversions failed")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold and warm Blender conversion throughput")
+    parser.add_argument("models", nargs="+", type=Path, help="Models to convert (.obj/.fbx/.dae/.3ds/.stl/.ply)")
+    parser.add_argument("--repeat", type=int, default=3, help="How many times to convert each model")
+    parser.add_argument("--workers", type=int, default=2, help="Conversions at a time (warm pool size)")
+    args = parser.parse_args()
+
+    if not BlenderPool.available():
+        print("❌ Blender not found (set BLENDER_BINARY)")
+        sys.exit(1)
+
+    inputs = [m.resolve() for m in args.models for _ in range(args.repeat)]
+    out_dir = Path(tempfile.mkdtemp(prefix="blender_bench_"))
+    try:
+        cold = asyncio.run(run_cold(inputs, out_dir, args.workers))
+        warm = asyncio.run(run_warm(inputs, out_dir, args.workers))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    count = len(inputs)
+    print(f"Conversions: {count}")
+    print(f"Cold ({args.workers} at a time): {cold:.2f}s total, {count / cold:.2f} files/s")
+    print(f"Warm ({args.workers} workers): {warm:.2f}s total, {count / warm:.2f} files/s")
+    print(f"Speedup: {cold / warm:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Warm Blender worker pool for MyEarth.app
+Keeps a few `blender --background` processes running and hands them
+conversion jobs over stdin/stdout, so each file skips Blender's startup
+"""
+
+import asyncio
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+BLENDER_BINARY = os.getenv("BLENDER_BINARY", "blender")
+
+# Number of long-lived Blender processes
+BLENDER_POOL_SIZE = int(os.getenv("BLENDER_POOL_SIZE", "2"))
+
+# Restart a worker after this many jobs to bound Blender's memory growth
+BLENDER_MAX_JOBS_PER_WORKER = int(os.getenv("BLENDER_MAX_JOBS_PER_WORKER", "50"))
+
+CONVERSION_TIMEOUT = 120
+STARTUP_TIMEOUT = 60
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "blender_worker.py"
+
+# Must match RESPONSE_MARKER in blender_worker.py (which only runs inside Blender)
+RESPONSE_MARKER = "@@MYEARTH@@"
+
+
+class ConversionError(Exception):
+    """Blender ran the job but could not convert the file; the worker stays usable"""
+
+
+class BlenderWorker:
+    """A single Blender process speaking the blender_worker.py line protocol"""
+
+    def __init__(self):
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.jobs_done = 0
+
+    async def start(self) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            BLENDER_BINARY, "--background", "--factory-startup", "--python", str(WORKER_SCRIPT),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        # The worker announces itself once Blender has finished loading
+        await asyncio.wait_for(self._read_response(), timeout=STARTUP_TIMEOUT)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def _read_response(self) -> dict:
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise RuntimeError("Blender worker exited unexpectedly")
+            text = line.decode("utf-8", errors="ignore").strip()
+            # Blender logs freely to stdout; only our marked lines are responses
+            if text.startswith(RESPONSE_MARKER):
+                return json.loads(text[len(RESPONSE_MARKER):])
+
+    async def convert(self, input_path: Path, output_path: Path) -> None:
+        request = {"input": str(input_path.absolute()), "output": str(output_path.absolute())}
+        self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+        response = await asyncio.wait_for(self._read_response(), timeout=CONVERSION_TIMEOUT)
+        self.jobs_done += 1
+        if not response.get("ok"):
+            raise ConversionError(response.get("error", "Blender conversion failed"))
+
+    async def close(self) -> None:
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout=5)
+        except Exception:
+            self.process.kill()
+            await self.process.wait()
+
+
+class BlenderPool:
+    """Fixed-size pool of warm Blender workers, started on first use"""
+
+    def __init__(self, size: int = BLENDER_POOL_SIZE):
+        self.size = size
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: List[BlenderWorker] = []
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which(BLENDER_BINARY) is not None
+
+    def _queue(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                self._idle.put_nowait(None)  # None = slot without a started worker
+        return self._idle
+
+    async def _ensure_worker(self, worker: Optional[BlenderWorker]) -> BlenderWorker:
+        if worker is not None and worker.alive and worker.jobs_done < BLENDER_MAX_JOBS_PER_WORKER:
+            return worker
+        if worker is not None:
+            await self._retire(worker)
+        worker = BlenderWorker()
+        try:
+            await worker.start()
+        except Exception:
+            await worker.close()
+            raise
+        self._workers.append(worker)
+        return worker
+
+    async def _retire(self, worker: BlenderWorker) -> None:
+        if worker in self._workers:
+            self._workers.remove(worker)
+        await worker.close()
+
+    async def convert(self, input_path: Path, output_path: Path) -> Optional[Path]:
+        """Convert input_path to a GLB at output_path on the next free worker"""
+        if not self.available():
+            return None
+
+        idle = self._queue()
+        worker = await idle.get()
+        try:
+            worker = await self._ensure_worker(worker)
+            await worker.convert(input_path, output_path)
+        except ConversionError as e:
+            print(f"Blender conversion failed: {e}")
+            return None
+        except Exception as e:
+            print(f"Blender conversion failed: {e}")
+            if worker is not None:
+                # A timed-out or crashed worker is in an unknown state; replace it next time
+                await self._retire(worker)
+                worker = None
+            return None
+        finally:
+            idle.put_nowait(worker)
+
+        return output_path if output_path.exists() else None
+
+    async def shutdown(self) -> None:
+        for worker in list(self._workers):
+            await self._retire(worker)
+
+
+blender_pool = BlenderPool()
@@ -0,0 +1,89 @@
+"""
+Long-lived Blender conversion worker for MyEarth.app
+Runs inside `blender --background --python blender_worker.py` and converts
+models to GLB for every JSON request it reads from stdin
+
+Request (one line):  {"input": "/abs/model.obj", "output": "/abs/model.glb"}
+Response (one line): @@MYEARTH@@ {"ok": true} or @@MYEARTH@@ {"ok": false, "error": "..."}
+"""
+
+import json
+import sys
+import traceback
+
+import bpy
+
+RESPONSE_MARKER = "@@MYEARTH@@"
+
+
+def _import_model(filepath, file_ext):
+    """Import a model, preferring the Blender 4.x operators when present"""
+    if file_ext == '.obj':
+        if hasattr(bpy.ops.wm, "obj_import"):
+            bpy.ops.wm.obj_import(filepath=filepath)
+        else:
+            bpy.ops.import_scene.obj(filepath=filepath)
+    elif file_ext == '.fbx':
+        bpy.ops.import_scene.fbx(filepath=filepath)
+    elif file_ext == '.dae':
+        bpy.ops.wm.collada_import(filepath=filepath)
+    elif file_ext == '.3ds':
+        bpy.ops.import_scene.autodesk_3ds(filepath=filepath)
+    elif file_ext == '.stl':
+        if hasattr(bpy.ops.wm, "stl_import"):
+            bpy.ops.wm.stl_import(filepath=filepath)
+        else:
+            bpy.ops.import_mesh.stl(filepath=filepath)
+    elif file_ext == '.ply':
+        if hasattr(bpy.ops.wm, "ply_import"):
+            bpy.ops.wm.ply_import(filepath=filepath)
+        else:
+            bpy.ops.import_mesh.ply(filepath=filepath)
+    else:
+        raise ValueError(f"Unsupported format: {file_ext}")
+
+
+def convert(request):
+    """Convert one model to GLB in a freshly reset scene"""
+    # Start every job from an empty scene so jobs cannot leak into each other
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+    filepath = request["input"]
+    file_ext = "." + filepath.rsplit(".", 1)[-1].lower()
+    _import_model(filepath, file_ext)
+
+    # Apply all modifiers
+    for obj in bpy.context.scene.objects:
+        if obj.type == 'MESH':
+            bpy.context.view_layer.objects.active = obj
+            for modifier in obj.modifiers:
+                bpy.ops.object.modifier_apply(modifier=modifier.name)
+
+    # Export as GLB
+    bpy.ops.export_scene.gltf(
+        filepath=request["output"],
+        export_format='GLB',
+        export_animations=False,
+        export_apply=True
+    )
+
+
+def respond(payload):
+    print(f"{RESPONSE_MARKER} {json.dumps(payload)}", flush=True)
+
+
+def main():
+    respond({"ok": True, "ready": True})
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            convert(json.loads(line))
+            respond({"ok": True})
+        except Exception as e:
+            traceback.print_exc()
+            respond({"ok": False, "error": str(e)})
+
+
+main()
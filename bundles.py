@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Frontend bundles for MyEarth.app
+Moves the inline scripts and styles of index.html into content-hashed files,
+fingerprints the local scripts and stylesheets it links, and writes a
+rewritten index.html that references them. Bundle names change with their
+content, so they can be cached for a year while only the HTML shell revalidates.
+
+Run at server startup (BUNDLE_FRONTEND) or by hand:
+    python bundles.py [index.html] [output_dir]
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from http_files import precompress
+
+BUNDLE_URL = "/bundles/"
+HASH_LENGTH = 12
+# Superseded bundles stay this long for pages still open from an earlier deploy
+KEEP_OLD_SECONDS = 7 * 24 * 3600
+MANIFEST = "manifest.json"
+BUNDLED_INDEX = "index.html"
+
+# Bundle names look like "app.1.3f2a9c0d1b7e.js" or "CesiumGizmo.3f2a9c0d1b7e.js"
+BUNDLE_NAME = re.compile(rf"^[\w.-]+\.[0-9a-f]{{{HASH_LENGTH}}}\.(js|css)$")
+
+INLINE_SCRIPT = re.compile(r"<script(\s[^>]*)?>(.*?)</script\s*>", re.IGNORECASE | re.DOTALL)
+INLINE_STYLE = re.compile(r"<style(\s[^>]*)?>(.*?)</style\s*>", re.IGNORECASE | re.DOTALL)
+SCRIPT_SRC = re.compile(r"(<script\b[^>]*\bsrc=)([\"'])([^\"']+)\2", re.IGNORECASE)
+STYLESHEET_HREF = re.compile(r"(<link\b[^>]*\bhref=)([\"'])([^\"']+)\2", re.IGNORECASE)
+ATTRIBUTE = re.compile(r"([\w-]+)(?:=([\"'])(.*?)\2)?", re.DOTALL)
+JAVASCRIPT_TYPES = {"", "text/javascript", "application/javascript", "module"}
+
+
+def _attributes(text: Optional[str]) -> Dict[str, str]:
+    return {m.group(1).lower(): m.group(3) or "" for m in ATTRIBUTE.finditer(text or "")}
+
+
+def _write(output_dir: Path, name: str, data: bytes) -> None:
+    path = output_dir / name
+    if path.exists():
+        return
+    fd, tmp_name = tempfile.mkstemp(dir=output_dir, prefix=f".{name}")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_name, path)
+
+
+class BundleBuilder:
+    """One build of index.html into output_dir"""
+
+    def __init__(self, index_path: Path, output_dir: Path, ui_dir: Path, static_dir: Optional[Path]):
+        self.index_path = index_path
+        self.output_dir = output_dir
+        self.ui_dir = ui_dir
+        self.static_dir = static_dir
+        self.files: List[str] = []
+        self.sources: Dict[str, int] = {str(index_path): index_path.stat().st_mtime_ns}
+
+    def add(self, stem: str, suffix: str, data: bytes) -> str:
+        name = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{suffix}"
+        _write(self.output_dir, name, data)
+        self.files.append(name)
+        return BUNDLE_URL + name
+
+    def local_file(self, url: str) -> Optional[Path]:
+        """File a same-origin script or stylesheet URL is served from"""
+        if "://" in url or url.startswith(("//", BUNDLE_URL)) or "?" in url or "#" in url:
+            return None
+        if url.startswith("/static/"):
+            root, relative = self.static_dir, url[len("/static/"):]
+        else:
+            root, relative = self.ui_dir, url.lstrip("/")
+        if root is None:
+            return None
+        path = (root / relative).resolve()
+        if not path.is_relative_to(root.resolve()) or not path.is_file():
+            return None
+        return path
+
+    def fingerprint(self, match: re.Match) -> str:
+        prefix, quote, url = match.groups()
+        path = self.local_file(url)
+        if path is None or path.suffix not in (".js", ".css"):
+            return match.group(0)
+        self.sources[str(path)] = path.stat().st_mtime_ns
+        return f"{prefix}{quote}{self.add(path.stem, path.suffix, path.read_bytes())}{quote}"
+
+    def build(self) -> Path:
+        html = self.index_path.read_text(encoding="utf-8")
+        counter = iter(range(1, 1000))
+
+        def extract_script(match: re.Match) -> str:
+            attributes = _attributes(match.group(1))
+            if "src" in attributes or attributes.get("type", "").lower() not in JAVASCRIPT_TYPES:
+                return match.group(0)
+            # External classic scripts still run in document order, in the global scope
+            url = self.add(f"app.{next(counter)}", ".js", match.group(2).encode("utf-8"))
+            module = ' type="module"' if attributes.get("type", "").lower() == "module" else ""
+            return f'<script{module} src="{url}"></script>'
+
+        def extract_style(match: re.Match) -> str:
+            attributes = _attributes(match.group(1))
+            url = self.add(f"app.{next(counter)}", ".css", match.group(2).encode("utf-8"))
+            media = f' media="{attributes["media"]}"' if attributes.get("media") else ""
+            return f'<link rel="stylesheet" href="{url}"{media}>'
+
+        # Inline scripts go first, so markup inside their strings is never rewritten
+        html = INLINE_SCRIPT.sub(extract_script, html)
+        html = INLINE_STYLE.sub(extract_style, html)
+        html = SCRIPT_SRC.sub(self.fingerprint, html)
+        html = STYLESHEET_HREF.sub(
+            lambda m: self.fingerprint(m) if m.group(3).endswith(".css") else m.group(0), html)
+
+        for name in self.files:
+            precompress(self.output_dir / name)
+        index = self.output_dir / BUNDLED_INDEX
+        fd, tmp_name = tempfile.mkstemp(dir=self.output_dir, prefix=f".{BUNDLED_INDEX}")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp_name, index)
+        superseded = self._prune()
+        (self.output_dir / MANIFEST).write_text(json.dumps(
+            {"sources": self.sources, "files": self.files, "superseded": superseded}, indent=2))
+        return index
+
+    def _prune(self) -> Dict[str, float]:
+        """Delete bundles superseded over KEEP_OLD_SECONDS ago; returns when the rest were superseded"""
+        # File times tell when a bundle was first built, not when it stopped being current
+        try:
+            previous = json.loads((self.output_dir / MANIFEST).read_text()).get("superseded", {})
+        except (OSError, ValueError):
+            previous = {}
+        current = set(self.files)
+        now = time.time()
+        superseded = {}
+        for path in self.output_dir.iterdir():
+            name = path.name.removesuffix(".br").removesuffix(".gz")
+            if not BUNDLE_NAME.match(name) or name in current:
+                continue
+            superseded[name] = previous.get(name, now)
+            if superseded[name] < now - KEEP_OLD_SECONDS:
+                path.unlink()
+        return {name: at for name, at in superseded.items() if at >= now - KEEP_OLD_SECONDS}
+
+
+def build_bundles(index_path: Path, output_dir: Path, ui_dir: Path, static_dir: Optional[Path] = None) -> Path:
+    """Write bundles and the rewritten index.html to output_dir; returns the HTML path"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return BundleBuilder(index_path, output_dir, ui_dir, static_dir).build()
+
+
+# index.html path -> (source mtimes, bundled HTML path) of its last build
+_builds: Dict[str, Tuple[Dict[str, int], Path]] = {}
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def current_bundled_index(index_path: Path) -> Optional[Path]:
+    """Bundled HTML of the last build of index_path if none of its sources changed since"""
+    build = _builds.get(str(index_path))
+    if build is None or any(_mtime(path) != mtime for path, mtime in build[0].items()):
+        return None
+    return build[1]
+
+
+def bundled_index(index_path: Path, output_dir: Path, ui_dir: Path, static_dir: Optional[Path] = None) -> Path:
+    """Bundled HTML for index_path, rebuilt when index.html or a linked file changes"""
+    build = _builds.get(str(index_path))
+    if build is None:
+        # Reuse a build left by an earlier run or the CLI when it is still current
+        try:
+            manifest = json.loads((output_dir / MANIFEST).read_text())
+            if str(index_path) in manifest["sources"] and (output_dir / BUNDLED_INDEX).exists():
+                build = (manifest["sources"], output_dir / BUNDLED_INDEX)
+        except (OSError, ValueError, KeyError):
+            pass
+    if build is None or any(_mtime(path) != mtime for path, mtime in build[0].items()):
+        builder = BundleBuilder(index_path, output_dir, ui_dir, static_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        build = (builder.sources, builder.build())
+    _builds[str(index_path)] = build
+    return build[1]
+
+
+if __name__ == "__main__":
+    index = Path(sys.argv[1] if len(sys.argv) > 1 else "index.html").resolve()
+    output = Path(sys.argv[2] if len(sys.argv) > 2 else index.parent / "bundles").resolve()
+    static = index.parent / "static"
+    html_path = build_bundles(index, output, index.parent, static if static.is_dir() else None)
+    manifest = json.loads((output / MANIFEST).read_text())
+    print(f"✅ Bundled {index.name}: {len(manifest['files'])} files in {output}")
+    print(f"   HTML shell: {html_path} ({html_path.stat().st_size} bytes, was {index.stat().st_size})")
@@ -0,0 +1,470 @@
+"""
+CityGML conversion for MyEarth.app
+Streams CityGML with iterparse so memory stays flat on city-scale files,
+triangulates LoD1/LoD2 building surfaces and writes a quadtree tileset of
+batched b3dm tiles whose batch tables carry the building attributes
+"""
+
+import json
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from glb import GLBBuilder, MODE_TRIANGLES, TARGET_ARRAY_BUFFER
+import tiles3d
+
+MAX_TILE_BUILDINGS = 1000  # buildings per leaf tile
+NODE_BUILDINGS = 250  # largest buildings kept by inner tiles
+MAX_DEPTH = 12
+
+# Vertex colours by boundary surface type; everything else is drawn as wall
+SURFACE_COLORS = [
+    (228, 224, 214, 255),  # wall / unknown
+    (178, 72, 54, 255),  # roof
+    (110, 110, 110, 255),  # ground
+]
+SURFACE_TYPES = {"RoofSurface": 1, "GroundSurface": 2}
+
+# Simple building properties copied into the batch table
+BUILDING_PROPERTIES = {
+    "name", "class", "function", "usage", "roofType", "measuredHeight",
+    "yearOfConstruction", "yearOfDemolition", "storeysAboveGround", "storeysBelowGround",
+}
+
+Polygon = Tuple[int, int, np.ndarray, List[np.ndarray]]  # (LoD, surface type, exterior ring (N, 3), interior rings)
+
+
+@lru_cache(maxsize=None)
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _value(text: str):
+    text = text.strip()
+    try:
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    except ValueError:
+        return text
+
+
+def _points(coordinates: np.ndarray) -> np.ndarray:
+    """(N, 3) points from 2D or 3D coordinate rows"""
+    if coordinates.shape[1] == 3:
+        return coordinates
+    if coordinates.shape[1] > 3:
+        return coordinates[:, :3]
+    return np.concatenate([coordinates, np.zeros((len(coordinates), 1))], axis=1)
+
+
+# --------------------
+# Streaming reader
+# --------------------
+def iter_buildings(path: Path) -> Iterator[Tuple[dict, List[Polygon]]]:
+    """Yield (attributes, polygons) per top-level Building, discarding parsed XML as it goes"""
+    names: List[str] = []
+    elements: List[ET.Element] = []
+    lods: List[int] = []
+    surfaces: List[int] = []
+    building_depth = None
+    attributes: dict = {}
+    polygons: List[Polygon] = []
+    ring: List[np.ndarray] = []
+    root = None
+
+    for event, element in ET.iterparse(str(path), events=("start", "end")):
+        name = _local(element.tag)
+        if event == "start":
+            if root is None:
+                root = element
+            names.append(name)
+            elements.append(element)
+            if building_depth is None:
+                if name == "Building":
+                    building_depth = len(names)
+                    gml_id = next((v for k, v in element.attrib.items() if _local(k) == "id"), None)
+                    attributes = {"id": gml_id}
+                    polygons = []
+                continue
+            if name.startswith("lod") and name[3:4].isdigit():
+                lods.append(int(name[3]))
+            if len(names) > 1 and names[-2] == "boundedBy":
+                surfaces.append(SURFACE_TYPES.get(name, 0))
+            continue
+
+        # end event
+        if building_depth is not None:
+            if name == "posList":
+                dimension = int(element.get("srsDimension", 3))
+                ring.append(_points(np.array(element.text.split(), dtype=np.float64).reshape(-1, dimension)))
+            elif name == "pos":
+                ring.append(_points(np.array(element.text.split(), dtype=np.float64).reshape(1, -1)))
+            elif name == "LinearRing":
+                if len(names) >= 3 and names[-3] in ("Polygon", "Triangle") and ring:
+                    points = ring[0] if len(ring) == 1 else np.concatenate(ring)
+                    if len(points) > 1 and np.array_equal(points[0], points[-1]):
+                        points = points[:-1]
+                    if names[-2] == "exterior":
+                        polygons.append((lods[-1] if lods else 0, surfaces[-1] if surfaces else 0, points, []))
+                    elif names[-2] == "interior" and polygons and len(points) >= 3:
+                        # gml:exterior always comes first, so holes belong to the last polygon
+                        polygons[-1][3].append(points)
+                ring = []
+            elif len(names) == building_depth + 1 and name in BUILDING_PROPERTIES and element.text and element.text.strip():
+                attributes[name] = _value(element.text)
+            elif name == "value" and len(elements) > 1 and names[-2].endswith("Attribute") and element.text:
+                # Generic attributes: <gen:stringAttribute name="..."><gen:value>...</gen:value>
+                attribute_name = elements[-2].get("name")
+                if attribute_name:
+                    attributes[attribute_name] = _value(element.text)
+
+            if name.startswith("lod") and name[3:4].isdigit() and lods:
+                lods.pop()
+            if len(names) > 1 and names[-2] == "boundedBy" and surfaces:
+                surfaces.pop()
+            if len(names) == building_depth:
+                yield attributes, polygons
+                building_depth = None
+                element.clear()
+                # Drop everything parsed so far; the next building starts from an empty tree
+                root.clear()
+
+        names.pop()
+        elements.pop()
+
+
+def best_lod(polygons: List[Polygon]) -> List[Polygon]:
+    """Prefer LoD2 surfaces, then LoD1, then whatever the building has"""
+    available = {p[0] for p in polygons}
+    for lod in (2, 1):
+        if lod in available:
+            return [p for p in polygons if p[0] == lod]
+    return polygons
+
+
+# --------------------
+# Triangulation
+# --------------------
+def _ear_clip(points: np.ndarray) -> List[Tuple[int, int, int]]:
+    """Ear clipping for a simple 2D polygon; keeps the input winding"""
+    sign = 1.0 if np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1]) >= 0 else -1.0
+
+    def cross(a, b, c):
+        return sign * ((points[b, 0] - points[a, 0]) * (points[c, 1] - points[a, 1])
+                       - (points[b, 1] - points[a, 1]) * (points[c, 0] - points[a, 0]))
+
+    # Bridged holes repeat vertices; copies of an ear's corners never block it
+    key = [tuple(point) for point in points]
+    remaining = list(range(len(points)))
+    triangles = []
+    while len(remaining) > 3:
+        count = len(remaining)
+        for k in range(count):
+            a, b, c = remaining[k - 1], remaining[k], remaining[(k + 1) % count]
+            if cross(a, b, c) <= 0:
+                continue
+            if any(cross(a, b, p) >= 0 and cross(b, c, p) >= 0 and cross(c, a, p) >= 0
+                   for p in remaining if key[p] not in (key[a], key[b], key[c])):
+                continue
+            triangles.append((a, b, c))
+            remaining.pop(k)
+            break
+        else:
+            # Self-intersecting or degenerate ring: fan the rest
+            break
+    triangles.extend((remaining[0], remaining[i], remaining[i + 1]) for i in range(1, len(remaining) - 1))
+    return triangles
+
+
+def _plane_axes(rings: np.ndarray) -> np.ndarray:
+    """(K, 2) axes kept when dropping the one each (K, N, 3) ring faces most (Newell normal)"""
+    following = np.roll(rings, -1, axis=1)
+    normals = np.stack([
+        np.sum((rings[..., 1] - following[..., 1]) * (rings[..., 2] + following[..., 2]), axis=1),
+        np.sum((rings[..., 2] - following[..., 2]) * (rings[..., 0] + following[..., 0]), axis=1),
+        np.sum((rings[..., 0] - following[..., 0]) * (rings[..., 1] + following[..., 1]), axis=1),
+    ], axis=1)
+    dropped = np.argmax(np.abs(normals), axis=1)
+    return np.array([[1, 2], [0, 2], [0, 1]])[dropped]
+
+
+def _projected(rings: np.ndarray) -> np.ndarray:
+    """Drop the axis each (K, N, 3) ring faces most; returns (K, N, 2)"""
+    return np.take_along_axis(rings, _plane_axes(rings)[:, None, :], axis=2)
+
+
+def triangulate_rings(rings: np.ndarray) -> List[np.ndarray]:
+    """Triangulate (K, N, 3) planar rings of equal length; returns (T, 3) vertex indices per ring"""
+    count, size = rings.shape[:2]
+    fan = np.array([[0, i, i + 1] for i in range(1, size - 1)], dtype=np.int64)
+    if size <= 3:
+        return [fan] * count
+    flat = _projected(rings)
+    edges = np.roll(flat, -1, axis=1) - flat
+    following = np.roll(edges, -1, axis=1)
+    turns = edges[..., 0] * following[..., 1] - edges[..., 1] * following[..., 0]
+    # Convex rings (most walls and roofs) are fanned; the rest are ear clipped
+    convex = np.all(turns >= 0, axis=1) | np.all(turns <= 0, axis=1)
+    return [fan if convex[k] else np.array(_ear_clip(flat[k]), dtype=np.int64).reshape(-1, 3)
+            for k in range(count)]
+
+
+def _crosses(p, q, a, b) -> bool:
+    """Whether segment ab blocks segment pq: they cross, or a or b lies inside pq (shared endpoints do not count)"""
+    def side(u, v, w):
+        return np.sign((v[0] - u[0]) * (w[1] - u[1]) - (v[1] - u[1]) * (w[0] - u[0]))
+
+    def inside(w):
+        return side(p, q, w) == 0 and 0 < np.dot(w - p, q - p) < np.dot(q - p, q - p)
+    return (side(p, q, a) * side(p, q, b) < 0 and side(a, b, p) * side(a, b, q) < 0) or inside(a) or inside(b)
+
+
+def _bridge_holes(flat: np.ndarray, sizes: List[int]) -> List[int]:
+    """Join holes into the exterior ring with zero-width bridges; returns one ring of indices into flat.
+
+    flat holds the exterior followed by each hole, holes wound against the exterior.
+    """
+    exterior = flat[:sizes[0]]
+    sign = np.sign(np.sum(exterior[:, 0] * np.roll(exterior[:, 1], -1) - np.roll(exterior[:, 0], -1) * exterior[:, 1]))
+
+    def left(u, v, w):
+        return sign * ((flat[v, 0] - flat[u, 0]) * (flat[w, 1] - flat[u, 1])
+                       - (flat[v, 1] - flat[u, 1]) * (flat[w, 0] - flat[u, 0])) > 0
+
+    def opens_towards(position, target):
+        # A bridge must leave through the interior angle at its ring vertex; this also picks
+        # the right copy of a vertex that earlier bridges already repeated
+        previous, vertex, following = ring[position - 1], ring[position], ring[(position + 1) % len(ring)]
+        if left(previous, vertex, following):
+            return left(previous, vertex, target) and left(vertex, following, target)
+        return left(previous, vertex, target) or left(vertex, following, target)
+
+    starts = np.cumsum([0] + sizes)
+    ring = list(range(sizes[0]))
+    holes = [list(range(starts[h], starts[h + 1])) for h in range(1, len(sizes))]
+    # Rightmost holes first, as in Eberly's hole-bridging order
+    holes.sort(key=lambda hole: -flat[hole, 0].max())
+    for h, hole in enumerate(holes):
+        first = hole.index(max(hole, key=lambda i: flat[i, 0]))
+        hole = hole[first:] + hole[:first]
+        edges = [(ring[i - 1], ring[i]) for i in range(len(ring))]
+        edges += [(other[i - 1], other[i]) for other in holes[h:] for i in range(len(other))]
+        distances = np.linalg.norm(flat[ring] - flat[hole[0]], axis=1)
+        for position in np.argsort(distances, kind="stable"):
+            bridge = ring[position]
+            if opens_towards(position, hole[0]) and not any(
+                    _crosses(flat[bridge], flat[hole[0]], flat[a], flat[b]) for a, b in edges):
+                break
+        else:
+            position = int(np.argmin(distances))
+        ring[position + 1:position + 1] = hole + [hole[0], ring[position]]
+    return ring
+
+
+def triangulate_with_holes(ring: np.ndarray, holes: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Triangulate a planar ring with interior rings (e.g. courtyards); returns (N, 3) points and (T, 3) indices"""
+    points = np.concatenate([ring] + holes)
+    sizes = [len(ring)] + [len(hole) for hole in holes]
+    # Project everything onto the plane the exterior faces most
+    flat = points[:, _plane_axes(ring[None])[0]]
+
+    def area(start, size):
+        section = flat[start:start + size]
+        return np.sum(section[:, 0] * np.roll(section[:, 1], -1) - np.roll(section[:, 0], -1) * section[:, 1])
+
+    exterior = area(0, sizes[0])
+    start = sizes[0]
+    for size in sizes[1:]:
+        # Holes must wind against the exterior for the bridged ring to stay simple
+        if area(start, size) * exterior > 0:
+            flat[start:start + size] = flat[start:start + size][::-1]
+            points[start:start + size] = points[start:start + size][::-1]
+        start += size
+
+    order = _bridge_holes(flat, sizes)
+    triangles = np.array(_ear_clip(flat[order]), dtype=np.int64).reshape(-1, 3)
+    return points, np.array(order, dtype=np.int64)[triangles]
+
+
+def triangulate_building(polygons: List[Polygon]) -> Tuple[np.ndarray, np.ndarray]:
+    """(T, 3, 3) triangle corners and (T,) surface types for a building"""
+    by_size = defaultdict(list)
+    corners, types = [], []
+    for _, surface, ring, holes in polygons:
+        if len(ring) < 3:
+            continue
+        if holes:
+            points, triangles = triangulate_with_holes(ring, holes)
+            corners.append(points[triangles])
+            types.append(np.full(len(triangles), surface, dtype=np.uint8))
+        else:
+            by_size[len(ring)].append((surface, ring))
+    for group in by_size.values():
+        rings = np.stack([ring for _, ring in group])
+        for (surface, ring), triangles in zip(group, triangulate_rings(rings)):
+            corners.append(ring[triangles])
+            types.append(np.full(len(triangles), surface, dtype=np.uint8))
+    if not corners:
+        return np.empty((0, 3, 3)), np.empty(0, dtype=np.uint8)
+    return np.concatenate(corners), np.concatenate(types)
+
+
+# --------------------
+# Tiles
+# --------------------
+class _BuildingStore:
+    """Spills triangulated buildings to disk so only small per-building summaries stay in memory"""
+
+    def __init__(self, work_dir: Path):
+        self.geometry_path = work_dir / "geometry.bin"
+        self.surface_path = work_dir / "surfaces.bin"
+        self.attributes_path = work_dir / "attributes.jsonl"
+        self._geometry = open(self.geometry_path, "wb")
+        self._surfaces = open(self.surface_path, "wb")
+        self._attributes = open(self.attributes_path, "wb")
+        self.offsets: List[int] = []  # first triangle
+        self.counts: List[int] = []
+        self.attribute_offsets: List[int] = []
+        self.lower: List[np.ndarray] = []
+        self.upper: List[np.ndarray] = []
+        self._triangles = 0
+
+    def add(self, attributes: dict, corners: np.ndarray, surfaces: np.ndarray) -> None:
+        self.offsets.append(self._triangles)
+        self.counts.append(len(corners))
+        self.attribute_offsets.append(self._attributes.tell())
+        self.lower.append(corners.reshape(-1, 3).min(axis=0))
+        self.upper.append(corners.reshape(-1, 3).max(axis=0))
+        corners.astype("<f8").tofile(self._geometry)
+        surfaces.tofile(self._surfaces)
+        self._attributes.write(json.dumps(attributes).encode("utf-8") + b"\n")
+        self._triangles += len(corners)
+
+    def close(self) -> None:
+        for f in (self._geometry, self._surfaces, self._attributes):
+            f.close()
+        self.lower = np.array(self.lower)
+        self.upper = np.array(self.upper)
+        self.geometry = np.memmap(self.geometry_path, dtype="<f8", mode="r").reshape(-1, 3, 3)
+        self.surfaces = np.memmap(self.surface_path, dtype=np.uint8, mode="r")
+
+    def attributes(self, buildings: np.ndarray) -> List[dict]:
+        records = []
+        with open(self.attributes_path, "rb") as f:
+            for building in buildings:
+                f.seek(self.attribute_offsets[building])
+                records.append(json.loads(f.readline()))
+        return records
+
+
+def _z_up_to_y_up(points: np.ndarray) -> np.ndarray:
+    return np.stack([points[:, 0], points[:, 2], -points[:, 1]], axis=1)
+
+
+def write_building_tile(path: Path, store: _BuildingStore, buildings: np.ndarray, origin: np.ndarray) -> int:
+    """Write one b3dm tile; every building becomes a batch feature"""
+    corners, surfaces, batch_ids = [], [], []
+    # Leaves at MAX_DEPTH can hold more buildings than uint16 ids can number. glTF allows
+    # UNSIGNED_INT only for indices, so larger ids go to float32 (exact up to 2**24)
+    batch_dtype = np.uint16 if len(buildings) < 65536 else np.float32
+    for batch_id, building in enumerate(buildings):
+        start, count = store.offsets[building], store.counts[building]
+        corners.append(store.geometry[start:start + count] - origin)
+        surfaces.append(store.surfaces[start:start + count])
+        batch_ids.append(np.full(count * 3, batch_id, dtype=batch_dtype))
+    corners = np.concatenate(corners)
+    positions = _z_up_to_y_up(corners.reshape(-1, 3)).astype(np.float32)
+
+    faces = positions.reshape(-1, 3, 3)
+    normals = np.cross(faces[:, 1] - faces[:, 0], faces[:, 2] - faces[:, 0])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    colors = np.array(SURFACE_COLORS, dtype=np.uint8)[np.concatenate(surfaces)]
+
+    builder = GLBBuilder()
+    attributes = {
+        "POSITION": builder.add_accessor(positions, TARGET_ARRAY_BUFFER, with_bounds=True),
+        "NORMAL": builder.add_accessor(np.repeat(normals, 3, axis=0).astype(np.float32), TARGET_ARRAY_BUFFER),
+        "COLOR_0": builder.add_accessor(np.repeat(colors, 3, axis=0), TARGET_ARRAY_BUFFER, normalized=True),
+        "_BATCHID": builder.add_accessor(np.concatenate(batch_ids), TARGET_ARRAY_BUFFER),
+    }
+    material = builder.add_default_material()
+    builder.gltf["materials"][material]["pbrMetallicRoughness"]["baseColorFactor"] = [1.0, 1.0, 1.0, 1.0]
+    builder.gltf["meshes"] = [{"primitives": [{"attributes": attributes, "mode": MODE_TRIANGLES, "material": material}]}]
+    builder.add_scene([0])
+
+    records = store.attributes(buildings)
+    keys = sorted({key for record in records for key in record})
+    batch_table = {key: [record.get(key) for record in records] for key in keys}
+    return tiles3d.write_b3dm(path, builder.to_bytes(alignment=8), len(buildings), batch_table)
+
+
+def _build_tile(store: _BuildingStore, buildings: np.ndarray, lower: np.ndarray, size: float, depth: int,
+                key: str, name: str, output_dir: Path, origin: np.ndarray, files: List[Path]) -> dict:
+    """Quadtree tile: inner tiles keep the largest buildings, the rest go to quadrants (ADD refinement)"""
+    extent = store.upper[buildings] - store.lower[buildings]
+    children = []
+    content = buildings
+    error = 0.0
+    if len(buildings) > MAX_TILE_BUILDINGS and depth < MAX_DEPTH:
+        prominent = np.zeros(len(buildings), dtype=bool)
+        prominent[np.argpartition(-np.prod(np.maximum(extent, 1e-3), axis=1), NODE_BUILDINGS)[:NODE_BUILDINGS]] = True
+        content, rest = buildings[prominent], buildings[~prominent]
+        # Leaving out the children hides at most their biggest building
+        error = float(np.linalg.norm(extent[~prominent], axis=1).max())
+        centres = (store.lower[rest, :2] + store.upper[rest, :2]) / 2 - origin[:2]
+        half = size / 2
+        quadrants = (centres[:, 0] >= lower[0] + half).astype(int) + 2 * (centres[:, 1] >= lower[1] + half)
+        for quadrant in range(4):
+            members = rest[quadrants == quadrant]
+            if len(members):
+                child_lower = lower + half * np.array([quadrant & 1, quadrant >> 1])
+                children.append(_build_tile(store, members, child_lower, half, depth + 1, key + str(quadrant),
+                                            name, output_dir, origin, files))
+
+    tile_path = output_dir / f"{name}_{key}.b3dm"
+    write_building_tile(tile_path, store, content, origin)
+    files.append(tile_path)
+    volume = tiles3d.box_volume(store.lower[buildings].min(axis=0) - origin, store.upper[buildings].max(axis=0) - origin)
+    return tiles3d.tile(volume, error, content_uri=tile_path.name, children=children,
+                        refine="ADD" if key == "r" else None)
+
+
+def convert_citygml(input_path: Path, output_dir: Path, name: str) -> dict:
+    """Convert CityGML buildings into {name}.json plus {name}_r*.b3dm tiles in output_dir
+
+    Coordinates are taken as metres (projected CRS). Tiles use a local
+    frame around the bottom centre of the city, which the viewer places.
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{name}_", dir=output_dir))
+    try:
+        store = _BuildingStore(work_dir)
+        for attributes, polygons in iter_buildings(input_path):
+            corners, surfaces = triangulate_building(best_lod(polygons))
+            if len(corners):
+                store.add(attributes, corners, surfaces)
+        store.close()
+        if not store.counts:
+            raise ValueError("No building geometry found")
+
+        lower, upper = store.lower.min(axis=0), store.upper.max(axis=0)
+        origin = np.array([(lower[0] + upper[0]) / 2, (lower[1] + upper[1]) / 2, lower[2]])
+        size = float(max(upper[0] - lower[0], upper[1] - lower[1], 1e-3))
+        files: List[Path] = []
+        root = _build_tile(store, np.arange(len(store.counts)), lower[:2] - origin[:2], size, 0, "r",
+                           name, output_dir, origin, files)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    tileset_path = output_dir / f"{name}.json"
+    tiles3d.write_tileset(tileset_path, root, geometric_error=tiles3d.diagonal(lower, upper))
+    return {
+        "tileset": tileset_path.name,
+        "building_count": len(store.counts),
+        "triangle_count": int(sum(store.counts)),
+        "tile_count": len(files),
+    }
@@ -0,0 +1,407 @@
+"""
+Binary glTF (GLB) helpers for MyEarth.app
+Reads and writes GLB containers and builds single-mesh GLBs from NumPy arrays
+"""
+
+import hashlib
+import io
+import json
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+GLB_MAGIC = b"glTF"
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+GLB_HEADER_SIZE = 12
+CHUNK_HEADER_SIZE = 8
+
+# glTF accessor componentType values
+COMPONENT_TYPES = {
+    np.dtype(np.int8): 5120,
+    np.dtype(np.uint8): 5121,
+    np.dtype(np.int16): 5122,
+    np.dtype(np.uint16): 5123,
+    np.dtype(np.uint32): 5125,
+    np.dtype(np.float32): 5126,
+}
+COMPONENT_DTYPES = {code: dtype for dtype, code in COMPONENT_TYPES.items()}
+ACCESSOR_TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4"}
+ACCESSOR_WIDTHS = {name: width for width, name in ACCESSOR_TYPES.items()}
+ACCESSOR_WIDTHS.update({"MAT2": 4, "MAT3": 9, "MAT4": 16})
+
+TARGET_ARRAY_BUFFER = 34962
+TARGET_ELEMENT_ARRAY_BUFFER = 34963
+
+MODE_POINTS = 0
+MODE_TRIANGLES = 4
+
+
+@dataclass
+class Mesh:
+    """Indexed triangle mesh held as NumPy arrays"""
+    positions: np.ndarray                 # (N, 3) float32
+    indices: np.ndarray                   # (M, 3) uint32
+    normals: Optional[np.ndarray] = None  # (N, 3) float32
+    uvs: Optional[np.ndarray] = None      # (N, 2) float32, glTF orientation (v down)
+    colors: Optional[np.ndarray] = None   # (N, 3|4) float32 in 0..1
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.positions)
+
+    @property
+    def triangle_count(self) -> int:
+        return len(self.indices)
+
+
+def _pad4(data_len: int) -> int:
+    return (4 - data_len % 4) % 4
+
+
+def read_glb(path: Path) -> Tuple[dict, bytes]:
+    """Return the JSON document and BIN chunk of a GLB file"""
+    data = Path(path).read_bytes()
+    if len(data) < GLB_HEADER_SIZE or data[:4] != GLB_MAGIC:
+        raise ValueError("Not a GLB file")
+    _, version, length = struct.unpack_from("<4sII", data, 0)
+    if version != GLB_VERSION:
+        raise ValueError(f"Unsupported GLB version: {version}")
+
+    gltf, binary = None, b""
+    offset = GLB_HEADER_SIZE
+    while offset + CHUNK_HEADER_SIZE <= min(length, len(data)):
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + CHUNK_HEADER_SIZE: offset + CHUNK_HEADER_SIZE + chunk_length]
+        if chunk_type == CHUNK_JSON:
+            gltf = json.loads(chunk.decode("utf-8"))
+        elif chunk_type == CHUNK_BIN:
+            binary = chunk
+        offset += CHUNK_HEADER_SIZE + chunk_length
+    if gltf is None:
+        raise ValueError("GLB has no JSON chunk")
+    return gltf, binary
+
+
+def read_accessor(gltf: dict, binary: bytes, index: int) -> np.ndarray:
+    """Decode an accessor of a single-buffer GLB into a (count, width) array"""
+    accessor = gltf["accessors"][index]
+    if "sparse" in accessor or "bufferView" not in accessor:
+        raise ValueError("Sparse or buffer-less accessors are not supported")
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    if view.get("buffer", 0) != 0:
+        raise ValueError("Only single-buffer GLBs are supported")
+
+    dtype = np.dtype(COMPONENT_DTYPES[accessor["componentType"]]).newbyteorder("<")
+    width = ACCESSOR_WIDTHS[accessor["type"]]
+    count = accessor["count"]
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    stride = view.get("byteStride", dtype.itemsize * width)
+    if count and offset + stride * (count - 1) + dtype.itemsize * width > len(binary):
+        raise ValueError("Accessor points outside the binary chunk")
+
+    array = np.ndarray(shape=(count, width), dtype=dtype, buffer=binary,
+                       offset=offset, strides=(stride, dtype.itemsize))
+    return array.astype(dtype.newbyteorder("="))
+
+
+def read_accessor_float(gltf: dict, binary: bytes, index: int) -> np.ndarray:
+    """Decode an accessor as float64, undoing normalized integer encoding"""
+    accessor = gltf["accessors"][index]
+    array = read_accessor(gltf, binary, index)
+    if accessor.get("normalized") and array.dtype.kind in "ui":
+        info = np.iinfo(array.dtype)
+        return np.maximum(array.astype(np.float64) / info.max, -1.0)
+    return array.astype(np.float64)
+
+
+def triangle_count(gltf: dict) -> int:
+    """Number of triangles across all triangle-list primitives"""
+    total = 0
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh.get("primitives", []):
+            if primitive.get("mode", MODE_TRIANGLES) != MODE_TRIANGLES:
+                continue
+            if "indices" in primitive:
+                total += gltf["accessors"][primitive["indices"]]["count"] // 3
+            elif "POSITION" in primitive.get("attributes", {}):
+                total += gltf["accessors"][primitive["attributes"]["POSITION"]]["count"] // 3
+    return total
+
+
+def node_matrix(node: dict) -> np.ndarray:
+    """Local 4x4 transform of a glTF node"""
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4).T  # glTF is column-major
+    x, y, z, w = node.get("rotation", [0.0, 0.0, 0.0, 1.0])
+    rotation = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get("scale", [1.0, 1.0, 1.0]))
+    matrix[:3, 3] = node.get("translation", [0.0, 0.0, 0.0])
+    return matrix
+
+
+def scene_bounds(gltf: dict, binary: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Axis-aligned bounds of the default scene in glTF (y-up) world space"""
+    scenes = gltf.get("scenes") or [{"nodes": list(range(len(gltf.get("nodes", []))))}]
+    nodes = gltf.get("nodes", [])
+    lower, upper = np.full(3, np.inf), np.full(3, -np.inf)
+
+    stack = [(index, np.eye(4)) for index in scenes[gltf.get("scene", 0)].get("nodes", [])]
+    while stack:
+        index, parent = stack.pop()
+        node = nodes[index]
+        world = parent @ node_matrix(node)
+        if "mesh" in node:
+            for primitive in gltf["meshes"][node["mesh"]]["primitives"]:
+                positions = read_accessor_float(gltf, binary, primitive["attributes"]["POSITION"])
+                if not len(positions):
+                    continue
+                corners = np.array([[x, y, z, 1.0]
+                                    for x in (positions[:, 0].min(), positions[:, 0].max())
+                                    for y in (positions[:, 1].min(), positions[:, 1].max())
+                                    for z in (positions[:, 2].min(), positions[:, 2].max())])
+                transformed = (world @ corners.T).T[:, :3]
+                lower = np.minimum(lower, transformed.min(axis=0))
+                upper = np.maximum(upper, transformed.max(axis=0))
+        stack.extend((child, world) for child in node.get("children", []))
+
+    if not np.isfinite(lower).all():
+        raise ValueError("Scene has no geometry")
+    return lower, upper
+
+
+def _write_glb_to(f, gltf: dict, chunks: List[bytes], alignment: int = 4) -> int:
+    json_bytes = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_bytes += b" " * _pad4(len(json_bytes))
+    bin_length = sum(len(c) for c in chunks)
+
+    total = GLB_HEADER_SIZE + CHUNK_HEADER_SIZE + len(json_bytes)
+    if bin_length:
+        total += CHUNK_HEADER_SIZE + bin_length
+    # Trailing spaces in the JSON chunk are the one place extra padding is allowed
+    extra = -total % alignment
+    json_bytes += b" " * extra
+    total += extra
+
+    f.write(struct.pack("<4sII", GLB_MAGIC, GLB_VERSION, total))
+    f.write(struct.pack("<II", len(json_bytes), CHUNK_JSON))
+    f.write(json_bytes)
+    if bin_length:
+        f.write(struct.pack("<II", bin_length, CHUNK_BIN))
+        for chunk in chunks:
+            f.write(chunk)
+    return total
+
+
+def write_glb(path: Path, gltf: dict, chunks: List[bytes]) -> int:
+    """Write a GLB whose BIN chunk is the concatenation of chunks; returns file size.
+
+    Every chunk must already be 4-byte aligned so bufferView offsets stay valid.
+    """
+    with open(path, "wb") as f:
+        return _write_glb_to(f, gltf, chunks)
+
+
+def glb_bytes(gltf: dict, chunks: List[bytes], alignment: int = 4) -> bytes:
+    """Same as write_glb, for GLBs embedded in other containers (b3dm needs alignment=8)"""
+    buffer = io.BytesIO()
+    _write_glb_to(buffer, gltf, chunks, alignment)
+    return buffer.getvalue()
+
+
+class GLBBuilder:
+    """Accumulates buffer views and accessors for a GLB with a single buffer"""
+
+    def __init__(self, generator: str = "MyEarth"):
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": generator},
+            "buffers": [{"byteLength": 0}],
+            "bufferViews": [],
+            "accessors": [],
+        }
+        self.chunks: List[bytes] = []
+        self._offset = 0
+        # Identical data is stored once: content hash -> existing index
+        self._view_cache = {}
+        self._accessor_cache = {}
+
+    def add_buffer_view(self, data: bytes, target: Optional[int] = None, byte_stride: Optional[int] = None) -> int:
+        key = (hashlib.sha1(data).hexdigest(), len(data), target, byte_stride)
+        if key in self._view_cache:
+            return self._view_cache[key]
+
+        view = {"buffer": 0, "byteOffset": self._offset, "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        self.gltf["bufferViews"].append(view)
+
+        padding = _pad4(len(data))
+        self.chunks.append(data)
+        if padding:
+            self.chunks.append(b"\x00" * padding)
+        self._offset += len(data) + padding
+        self.gltf["buffers"][0]["byteLength"] = self._offset
+        self._view_cache[key] = len(self.gltf["bufferViews"]) - 1
+        return self._view_cache[key]
+
+    def add_accessor(self, array: np.ndarray, target: Optional[int] = None,
+                     normalized: bool = False, with_bounds: bool = False,
+                     accessor_type: Optional[str] = None) -> int:
+        array = np.ascontiguousarray(array)
+        width = 1 if array.ndim == 1 else array.shape[1]
+        accessor_type = accessor_type or ACCESSOR_TYPES[width]
+
+        # Vertex attribute elements must start on 4-byte boundaries: pad rows when needed
+        stride = None
+        row_bytes = width * array.dtype.itemsize
+        if target == TARGET_ARRAY_BUFFER and row_bytes % 4:
+            padded_width = width + (4 - row_bytes % 4) // array.dtype.itemsize
+            padded = np.zeros((array.shape[0], padded_width), dtype=array.dtype)
+            padded[:, :width] = array.reshape(array.shape[0], width)
+            data, stride = padded.tobytes(), padded_width * array.dtype.itemsize
+        else:
+            data = array.tobytes()
+
+        key = (hashlib.sha1(data).hexdigest(), array.dtype.str, accessor_type, normalized, target, with_bounds)
+        if key in self._accessor_cache:
+            return self._accessor_cache[key]
+
+        view = self.add_buffer_view(data, target=target, byte_stride=stride)
+        accessor = {
+            "bufferView": view,
+            "componentType": COMPONENT_TYPES[array.dtype],
+            "count": int(array.shape[0]),
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if with_bounds and len(array):
+            accessor["min"] = np.atleast_1d(array.min(axis=0)).tolist()
+            accessor["max"] = np.atleast_1d(array.max(axis=0)).tolist()
+        self.gltf["accessors"].append(accessor)
+        self._accessor_cache[key] = len(self.gltf["accessors"]) - 1
+        return self._accessor_cache[key]
+
+    def add_mesh(self, mesh: Mesh, material: Optional[int] = None) -> int:
+        """Add a mesh as a single triangle primitive; returns the mesh index"""
+        attributes = {
+            "POSITION": self.add_accessor(mesh.positions.astype(np.float32, copy=False),
+                                          TARGET_ARRAY_BUFFER, with_bounds=True)
+        }
+        if mesh.normals is not None:
+            attributes["NORMAL"] = self.add_accessor(mesh.normals.astype(np.float32, copy=False),
+                                                     TARGET_ARRAY_BUFFER)
+        if mesh.uvs is not None:
+            attributes["TEXCOORD_0"] = self.add_accessor(mesh.uvs.astype(np.float32, copy=False),
+                                                         TARGET_ARRAY_BUFFER)
+        if mesh.colors is not None:
+            attributes["COLOR_0"] = self.add_accessor(mesh.colors.astype(np.float32, copy=False),
+                                                      TARGET_ARRAY_BUFFER)
+
+        index_dtype = np.uint16 if mesh.vertex_count < 65536 else np.uint32
+        primitive = {
+            "attributes": attributes,
+            "indices": self.add_accessor(mesh.indices.reshape(-1).astype(index_dtype),
+                                         TARGET_ELEMENT_ARRAY_BUFFER),
+            "mode": 4,
+        }
+        if material is not None:
+            primitive["material"] = material
+        self.gltf.setdefault("meshes", []).append({"primitives": [primitive]})
+        return len(self.gltf["meshes"]) - 1
+
+    def add_default_material(self) -> int:
+        self.gltf.setdefault("materials", []).append({
+            "pbrMetallicRoughness": {"baseColorFactor": [0.8, 0.8, 0.8, 1.0], "metallicFactor": 0.0, "roughnessFactor": 0.9},
+            "doubleSided": True,
+        })
+        return len(self.gltf["materials"]) - 1
+
+    def add_scene(self, mesh_indices: List[int]) -> None:
+        nodes = self.gltf.setdefault("nodes", [])
+        first = len(nodes)
+        nodes.extend({"mesh": m} for m in mesh_indices)
+        self.gltf["scenes"] = [{"nodes": list(range(first, len(nodes)))}]
+        self.gltf["scene"] = 0
+
+    def write(self, path: Path) -> int:
+        return write_glb(path, self.gltf, self.chunks)
+
+    def to_bytes(self, alignment: int = 4) -> bytes:
+        return glb_bytes(self.gltf, self.chunks, alignment)
+
+
+def write_mesh_glb(path: Path, mesh: Mesh, generator: str = "MyEarth") -> int:
+    """Write a mesh as a standalone GLB; returns the file size"""
+    builder = GLBBuilder(generator)
+    mesh_index = builder.add_mesh(mesh, material=builder.add_default_material())
+    builder.add_scene([mesh_index])
+    return builder.write(path)
+
+
+class GLBRewriter:
+    """Copies a parsed single-buffer GLB into a fresh, deduplicated buffer.
+
+    Subclasses rewrite mesh primitives through self.builder; finish() carries
+    over everything else that lives in the binary chunk.
+    """
+
+    def __init__(self, gltf: dict, binary: bytes):
+        self.src = gltf
+        self.binary = binary
+        self.builder = GLBBuilder(gltf.get("asset", {}).get("generator", "MyEarth"))
+        self._copied: Dict[int, int] = {}
+        self._views: Dict[int, int] = {}
+
+    def accessor(self, index: int) -> np.ndarray:
+        return read_accessor(self.src, self.binary, index)
+
+    def copy_accessor(self, index: int) -> int:
+        """Carry an accessor over unchanged (apart from deduplication)"""
+        if index not in self._copied:
+            acc = self.src["accessors"][index]
+            target = self.src["bufferViews"][acc["bufferView"]].get("target")
+            data = self.accessor(index)
+            if ACCESSOR_WIDTHS[acc["type"]] == 1:
+                data = data.reshape(-1)
+            self._copied[index] = self.builder.add_accessor(
+                data, target=target, normalized=acc.get("normalized", False),
+                with_bounds="min" in acc, accessor_type=acc["type"])
+        return self._copied[index]
+
+    def copy_view(self, index: int) -> int:
+        """Carry a raw buffer view (e.g. an embedded image) over"""
+        if index not in self._views:
+            view = self.src["bufferViews"][index]
+            start = view.get("byteOffset", 0)
+            self._views[index] = self.builder.add_buffer_view(self.binary[start:start + view["byteLength"]])
+        return self._views[index]
+
+    def finish(self, gltf: dict) -> List[bytes]:
+        """Copy images, skins and animations into gltf and attach the new buffer; returns BIN chunks"""
+        for image in gltf.get("images", []):
+            if "bufferView" in image:
+                image["bufferView"] = self.copy_view(image["bufferView"])
+        for skin in gltf.get("skins", []):
+            if "inverseBindMatrices" in skin:
+                skin["inverseBindMatrices"] = self.copy_accessor(skin["inverseBindMatrices"])
+        for animation in gltf.get("animations", []):
+            for sampler in animation.get("samplers", []):
+                sampler["input"] = self.copy_accessor(sampler["input"])
+                sampler["output"] = self.copy_accessor(sampler["output"])
+
+        gltf["buffers"] = self.builder.gltf["buffers"]
+        gltf["bufferViews"] = self.builder.gltf["bufferViews"]
+        gltf["accessors"] = self.builder.gltf["accessors"]
+        return self.builder.chunks
@@ -0,0 +1,338 @@
+"""
+GLB optimization stage for MyEarth.app
+Rewrites GLBs to be smaller and faster to render in CesiumJS:
+- KHR_mesh_quantization for positions, normals and texture coordinates
+- Tipsify triangle reordering for the post-transform vertex cache,
+  vertices renumbered by first use for fetch locality
+- merging of duplicate buffer views, accessors and materials
+- removal of unreachable and empty nodes
+"""
+
+import copy
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from glb import (GLBBuilder, GLBRewriter, read_glb, triangle_count, MODE_TRIANGLES,
+                 TARGET_ARRAY_BUFFER, TARGET_ELEMENT_ARRAY_BUFFER)
+from spatial import morton_order
+
+QUANTIZATION_EXTENSION = "KHR_mesh_quantization"
+
+# Post-transform vertex cache entries the triangle order is tuned for
+VERTEX_CACHE_SIZE = 16
+
+# Extensions whose data we either carry over untouched or that carry no buffer references
+SAFE_EXTENSIONS = {
+    QUANTIZATION_EXTENSION,
+    "KHR_materials_emissive_strength",
+    "KHR_materials_unlit",
+    "KHR_materials_clearcoat",
+    "KHR_materials_ior",
+    "KHR_materials_specular",
+    "KHR_materials_transmission",
+    "KHR_materials_volume",
+    "KHR_materials_sheen",
+    "KHR_materials_pbrSpecularGlossiness",
+    "KHR_texture_transform",
+    "KHR_lights_punctual",
+    "KHR_texture_basisu",
+    "EXT_texture_webp",
+}
+
+def can_optimize(gltf: dict) -> bool:
+    """Only rewrite GLBs whose every feature we understand"""
+    if gltf.get("extensionsRequired"):
+        return False
+    if not set(gltf.get("extensionsUsed", [])) <= SAFE_EXTENSIONS:
+        return False
+    if len(gltf.get("buffers", [])) != 1 or "uri" in gltf["buffers"][0]:
+        return False
+    return not any("sparse" in a or "bufferView" not in a for a in gltf.get("accessors", []))
+
+
+# --------------------
+# Nodes and materials
+# --------------------
+def prune_nodes(gltf: dict) -> None:
+    """Drop nodes that no scene reaches and empty leaf nodes, renumbering the rest"""
+    nodes = gltf.get("nodes", [])
+    # Skins and animations address nodes by index; leave such files alone
+    if not nodes or gltf.get("skins") or gltf.get("animations"):
+        return
+
+    def is_empty(node: dict) -> bool:
+        return not any(key in node for key in ("mesh", "camera", "children", "extensions"))
+
+    roots = [n for scene in gltf.get("scenes", []) for n in scene.get("nodes", [])]
+    keep = set()
+    stack = list(roots)
+    while stack:
+        index = stack.pop()
+        if index in keep:
+            continue
+        keep.add(index)
+        stack.extend(nodes[index].get("children", []))
+    keep = {i for i in keep if not is_empty(nodes[i])}
+
+    remap = {old: new for new, old in enumerate(sorted(keep))}
+    new_nodes = []
+    for old in sorted(keep):
+        node = nodes[old]
+        if "children" in node:
+            children = [remap[c] for c in node["children"] if c in remap]
+            if children:
+                node["children"] = children
+            else:
+                del node["children"]
+        new_nodes.append(node)
+    gltf["nodes"] = new_nodes
+    for scene in gltf.get("scenes", []):
+        scene["nodes"] = [remap[n] for n in scene.get("nodes", []) if n in remap]
+
+
+def merge_materials(gltf: dict) -> Dict[int, int]:
+    """Merge materials that only differ by name; returns old -> new index"""
+    unique: Dict[str, int] = {}
+    materials: List[dict] = []
+    remap: Dict[int, int] = {}
+    for index, material in enumerate(gltf.get("materials", [])):
+        key = json.dumps({k: v for k, v in material.items() if k != "name"}, sort_keys=True)
+        if key not in unique:
+            unique[key] = len(materials)
+            materials.append(material)
+        remap[index] = unique[key]
+    if materials:
+        gltf["materials"] = materials
+    return remap
+
+
+# --------------------
+# Geometry
+# --------------------
+def reorder_triangles(indices: np.ndarray, positions: np.ndarray, cache_size: int = VERTEX_CACHE_SIZE) -> np.ndarray:
+    """Order triangles for a post-transform vertex cache of cache_size (Tipsify, Sander et al. 2007).
+
+    Triangles are emitted in fans around one vertex at a time; the next fan
+    vertex is the neighbour that stays in the cache longest without being
+    evicted before its remaining triangles are drawn. A Z-order sort first
+    makes dead-end jumps land near the last fan.
+    """
+    triangles = indices.reshape(-1, 3)
+    triangles = triangles[morton_order(positions[triangles].mean(axis=1))]
+    vertex_count = int(triangles.max()) + 1
+    # Vertex -> triangles adjacency as CSR arrays
+    flat = triangles.reshape(-1)
+    by_vertex = np.argsort(flat, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(np.bincount(flat, minlength=vertex_count))]).tolist()
+    adjacent = (by_vertex // 3).tolist()
+    corners = triangles.tolist()
+    live = np.bincount(flat, minlength=vertex_count).tolist()  # triangles still to emit per vertex
+    cache_time = [0] * vertex_count
+    emitted = [False] * len(corners)
+    order = []
+    dead_ends = []
+    time = cache_size + 1
+    cursor = 0
+    fan = int(flat[0])
+    while fan >= 0:
+        candidates = []
+        for t in adjacent[starts[fan]:starts[fan + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in corners[t]:
+                dead_ends.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - cache_time[v] > cache_size:
+                    cache_time[v] = time
+                    time += 1
+        
+        # Next fan: the candidate with the highest cache position that all its triangles can still use
+        fan, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = time - cache_time[v] if time - cache_time[v] + 2 * live[v] <= cache_size else 0
+                if priority > best:
+                    fan, best = v, priority
+        if fan < 0:
+            # Dead end: a recently used vertex with triangles left, else the next such vertex in order
+            while dead_ends and fan < 0:
+                v = dead_ends.pop()
+                if live[v] > 0:
+                    fan = v
+            while fan < 0 and cursor < vertex_count:
+                if live[cursor] > 0:
+                    fan = cursor
+                cursor += 1
+    return triangles[order]
+
+
+def vertex_fetch_order(triangles: np.ndarray, vertex_count: int):
+    """Number vertices by first use; returns (old vertex ids in new order, remapped triangles)"""
+    flat = triangles.reshape(-1)
+    used, first_use = np.unique(flat, return_index=True)
+    order = used[np.argsort(first_use, kind="stable")]
+    remap = np.zeros(vertex_count, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return order, remap[triangles]
+
+
+def quantize_unit(values: np.ndarray, dtype) -> np.ndarray:
+    """Encode values in [-1, 1] (signed) or [0, 1] (unsigned) as normalized integers"""
+    info = np.iinfo(dtype)
+    lower = -1.0 if info.min < 0 else 0.0
+    return np.round(np.clip(values, lower, 1.0) * info.max).astype(dtype)
+
+
+class _QuantizingRewriter(GLBRewriter):
+    """Rewrites mesh primitives with reordered, quantized vertex data"""
+
+    def __init__(self, gltf: dict, binary: bytes, quantize: bool):
+        super().__init__(gltf, binary)
+        self.quantize = quantize
+        self.quantized = False
+
+    def rewrite_mesh(self, mesh: dict, shared: set, quantize: bool) -> Optional[List[float]]:
+        """Rewrite a mesh's primitives; returns [offset xyz, scale] if positions were quantized"""
+        transform = None
+        if quantize:
+            positions = [self.accessor(p["attributes"]["POSITION"]) for p in mesh["primitives"]]
+            lower = np.min([p.min(axis=0) for p in positions], axis=0)
+            upper = np.max([p.max(axis=0) for p in positions], axis=0)
+            # Uniform scale keeps normals valid under the dequantization transform
+            scale = float(max((upper - lower).max(), 1e-9))
+            transform = lower.tolist() + [scale]
+
+        for primitive in mesh["primitives"]:
+            attributes = {name: self.accessor(index) for name, index in primitive["attributes"].items()}
+            indices = None
+            if "indices" in primitive:
+                indices = self.accessor(primitive["indices"]).reshape(-1).astype(np.int64)
+
+            if indices is not None and primitive.get("mode", MODE_TRIANGLES) == MODE_TRIANGLES and len(indices) >= 3:
+                triangles = reorder_triangles(indices, attributes["POSITION"])
+                own_vertices = not (set(primitive["attributes"].values()) & shared) and "targets" not in primitive
+                if own_vertices:
+                    order, triangles = vertex_fetch_order(triangles, len(attributes["POSITION"]))
+                    attributes = {name: data[order] for name, data in attributes.items()}
+                indices = triangles.reshape(-1)
+
+            new_attributes = {}
+            for name, data in attributes.items():
+                src_acc = self.src["accessors"][primitive["attributes"][name]]
+                is_float = src_acc["componentType"] == 5126
+                if transform is not None and name == "POSITION":
+                    offset, scale = np.array(transform[:3]), transform[3]
+                    encoded = quantize_unit((data - offset) / scale, np.uint16)
+                    new_attributes[name] = self.builder.add_accessor(
+                        encoded, TARGET_ARRAY_BUFFER, normalized=True, with_bounds=True)
+                elif self.quantize and is_float and name == "NORMAL":
+                    new_attributes[name] = self.builder.add_accessor(
+                        quantize_unit(data, np.int8), TARGET_ARRAY_BUFFER, normalized=True)
+                    self.quantized = True
+                elif self.quantize and is_float and name.startswith("TEXCOORD_") and data.min() >= 0 and data.max() <= 1:
+                    new_attributes[name] = self.builder.add_accessor(
+                        quantize_unit(data, np.uint16), TARGET_ARRAY_BUFFER, normalized=True)
+                    self.quantized = True
+                else:
+                    new_attributes[name] = self.builder.add_accessor(
+                        data, TARGET_ARRAY_BUFFER, normalized=src_acc.get("normalized", False),
+                        with_bounds="min" in src_acc or name == "POSITION", accessor_type=src_acc["type"])
+            primitive["attributes"] = new_attributes
+
+            if indices is not None:
+                index_dtype = np.uint16 if len(attributes["POSITION"]) < 65536 else np.uint32
+                primitive["indices"] = self.builder.add_accessor(
+                    indices.astype(index_dtype), TARGET_ELEMENT_ARRAY_BUFFER)
+            if "targets" in primitive:
+                primitive["targets"] = [
+                    {name: self.copy_accessor(index) for name, index in target.items()}
+                    for target in primitive["targets"]
+                ]
+        if transform is not None:
+            self.quantized = True
+        return transform
+
+
+def _shared_accessors(gltf: dict) -> set:
+    """Vertex accessors referenced by more than one primitive"""
+    seen, shared = set(), set()
+    for mesh in gltf.get("meshes", []):
+        for primitive in mesh["primitives"]:
+            for index in set(primitive["attributes"].values()):
+                (shared if index in seen else seen).add(index)
+    return shared
+
+
+def optimize_gltf(gltf: dict, binary: bytes, quantize: bool = True):
+    """Return (optimized gltf, BIN chunks) for a parsed single-buffer GLB"""
+    gltf = copy.deepcopy(gltf)
+    prune_nodes(gltf)
+    material_remap = merge_materials(gltf)
+    rewriter = _QuantizingRewriter(gltf, binary, quantize)
+
+    # Meshes drawn by skinned or morphed nodes ignore/complicate node transforms: no position quantization
+    skinned = {n["mesh"] for n in gltf.get("nodes", []) if "mesh" in n and ("skin" in n or "weights" in n)}
+    shared = _shared_accessors(gltf)
+    transforms = {}
+    for mesh_index, mesh in enumerate(gltf.get("meshes", [])):
+        for primitive in mesh["primitives"]:
+            if "material" in primitive:
+                primitive["material"] = material_remap[primitive["material"]]
+        quantize_positions = (
+            quantize
+            and mesh_index not in skinned
+            and all("POSITION" in p["attributes"] and "targets" not in p for p in mesh["primitives"])
+            and all(gltf["accessors"][p["attributes"]["POSITION"]]["componentType"] == 5126 for p in mesh["primitives"])
+        )
+        transform = rewriter.rewrite_mesh(mesh, shared, quantize_positions)
+        if transform is not None:
+            transforms[mesh_index] = transform
+
+    # Dequantize positions through a child node carrying offset and uniform scale
+    nodes = gltf.get("nodes", [])
+    for node in list(nodes):
+        mesh_index = node.get("mesh")
+        if mesh_index in transforms:
+            offset_scale = transforms[mesh_index]
+            nodes.append({
+                "mesh": mesh_index,
+                "translation": offset_scale[:3],
+                "scale": [offset_scale[3]] * 3,
+            })
+            del node["mesh"]
+            node.setdefault("children", []).append(len(nodes) - 1)
+
+    chunks = rewriter.finish(gltf)
+    if rewriter.quantized:
+        used = gltf.setdefault("extensionsUsed", [])
+        required = gltf.setdefault("extensionsRequired", [])
+        for extensions in (used, required):
+            if QUANTIZATION_EXTENSION not in extensions:
+                extensions.append(QUANTIZATION_EXTENSION)
+    return gltf, chunks
+
+
+def optimize_glb(input_path: Path, output_path: Path, quantize: bool = True) -> Optional[dict]:
+    """Optimize a GLB file into output_path; returns before/after statistics or None if skipped"""
+    gltf, binary = read_glb(input_path)
+    if not can_optimize(gltf):
+        return None
+
+    optimized, chunks = optimize_gltf(gltf, binary, quantize)
+    builder = GLBBuilder()
+    builder.gltf, builder.chunks = optimized, chunks
+    size = builder.write(output_path)
+    return {
+        "original_size": os.path.getsize(input_path),
+        "optimized_size": size,
+        "original_triangles": triangle_count(gltf),
+        "optimized_triangles": triangle_count(optimized),
+        "quantized": QUANTIZATION_EXTENSION in optimized.get("extensionsUsed", []),
+    }
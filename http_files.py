@@ -0,0 +1,382 @@
+"""
+HTTP file serving for MyEarth.app
+Adds what FileResponse lacks for large model files: strong content-hash
+ETags, conditional requests answered with 304, single byte ranges (206),
+long-lived caching for files that never change, precompressed
+brotli/gzip variants chosen by Accept-Encoding and an in-memory cache for
+the small files every page load fetches
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # gzip variants only
+    brotli = None
+
+# Files up to this size get a SHA-256 ETag (computed once per file version);
+# larger ones use inode, size and mtime, which is equally strong for write-once files
+ETAG_HASH_MAX_BYTES = 64 * 1024 * 1024
+ETAG_CACHE_ENTRIES = 10000
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+_etags: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+def file_etag(path: Path, stat_result: os.stat_result) -> str:
+    """Strong ETag for a file version, memoized by inode, size and mtime"""
+    key = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+    etag = _etags.get(key)
+    if etag is None:
+        if stat_result.st_size <= ETAG_HASH_MAX_BYTES:
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    hasher.update(block)
+            etag = f'"{hasher.hexdigest()}"'
+        else:
+            etag = f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+        _etags[key] = etag
+        if len(_etags) > ETAG_CACHE_ENTRIES:
+            _etags.popitem(last=False)
+    else:
+        _etags.move_to_end(key)
+    return etag
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """RFC 9110 conditional GET: If-None-Match wins over If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single "bytes=" range; None when unsatisfiable.
+
+    Raises ValueError for headers we do not handle (several ranges, other
+    units, malformed), which are answered with the whole file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("Unsupported range")
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if start >= size:
+        return None
+    end = int(last) if last else size - 1
+    if start > end:
+        raise ValueError("Malformed range")
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(FileResponse):
+    """FileResponse for the bytes start..end (inclusive) of a file"""
+
+    def __init__(self, path: Path, start: int, end: int, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        size = kwargs["stat_result"].st_size
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        super().__init__(path, status_code=206, headers=headers, **kwargs)
+        self.start, self.end = start, end
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        with open(self.path, "rb") as file:
+            file.seek(self.start)
+            while remaining > 0:
+                chunk = await run_in_threadpool(file.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# --------------------
+# Precompressed variants
+# --------------------
+# Text formats worth compressing; binary models (GLB, b3dm, pnts) barely shrink
+COMPRESSIBLE_SUFFIXES = {
+    ".gltf", ".json", ".geojson", ".czml", ".kml", ".gml", ".citygml", ".obj", ".dae",
+    ".html", ".js", ".css", ".svg", ".txt", ".md",
+}
+MIN_COMPRESS_BYTES = 1024
+# (Content-Encoding, sidecar suffix), best first
+ENCODINGS = ([("br", ".br")] if brotli else []) + [("gzip", ".gz")]
+
+
+def is_compressible(path: Path) -> bool:
+    return path.suffix.lower() in COMPRESSIBLE_SUFFIXES
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(path: Path) -> List[Path]:
+    """Write (or refresh) path.br and path.gz next to path; returns the sidecars written"""
+    if not is_compressible(path) or not path.is_file():
+        return []
+    stat_result = path.stat()
+    if stat_result.st_size < MIN_COMPRESS_BYTES:
+        return []
+    data = None
+    written = []
+    for encoding, suffix in ENCODINGS:
+        sidecar = path.with_name(path.name + suffix)
+        if sidecar.exists() and sidecar.stat().st_mtime_ns >= stat_result.st_mtime_ns:
+            continue
+        data = path.read_bytes() if data is None else data
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}")
+        # mkstemp creates 0600 files; a front-end nginx must be able to read variants too
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(_compress(data, encoding))
+        os.replace(tmp_name, sidecar)
+        written.append(sidecar)
+    return written
+
+
+def precompress_tree(paths: Iterable[Path]) -> int:
+    """Precompress files and everything below directories; returns the number of sidecars written"""
+    count = 0
+    for path in paths:
+        files = path.rglob("*") if path.is_dir() else [path]
+        for file in files:
+            if not file.name.startswith("."):
+                count += len(precompress(file))
+    return count
+
+
+def _accepted_encodings(header: str) -> dict:
+    accepted = {}
+    for item in header.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    return accepted
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    accepted = _accepted_encodings(accept_encoding)
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+
+def negotiate(path: Path, accept_encoding: str) -> Tuple[Path, Optional[str]]:
+    """Best up-to-date precompressed variant of path the client accepts, else path itself"""
+    for encoding, suffix in ENCODINGS:
+        if not accepts_encoding(accept_encoding, encoding):
+            continue
+        sidecar = path.with_name(path.name + suffix)
+        try:
+            if sidecar.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+                return sidecar, encoding
+        except FileNotFoundError:
+            continue
+    return path, None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that sends .br/.gz variants made by precompress_tree"""
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        path = Path(full_path)
+        if not is_compressible(path):
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        variant, encoding = negotiate(path, request_headers.get("accept-encoding", ""))
+        headers = {"vary": "Accept-Encoding"}
+        if encoding:
+            headers["content-encoding"] = encoding
+            stat_result = variant.stat()
+        response = FileResponse(variant, status_code=status_code, headers=headers, stat_result=stat_result,
+                                method=scope["method"], media_type=mimetypes.guess_type(path.name)[0])
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+# --------------------
+# In-memory assets
+# --------------------
+class CachedAsset:
+    """One version of a small file: its bytes, compressed variants and validators"""
+
+    def __init__(self, path: Path, stat_result: os.stat_result, media_type: Optional[str] = None):
+        self.path = path
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.bodies = {None: path.read_bytes()}
+        if is_compressible(path):
+            # Reuse the sidecars from precompress_tree rather than compressing again
+            precompress(path)
+            for encoding, suffix in ENCODINGS:
+                sidecar = path.with_name(path.name + suffix)
+                if sidecar.exists() and sidecar.stat().st_mtime_ns >= self.mtime_ns:
+                    self.bodies[encoding] = sidecar.read_bytes()
+        digest = hashlib.sha256(self.bodies[None]).hexdigest()
+        self.etags = {encoding: f'"{digest}{"-" + encoding if encoding else ""}"' for encoding in self.bodies}
+
+    def encoding_for(self, accept_encoding: str) -> Optional[str]:
+        for encoding, _ in ENCODINGS:
+            if encoding in self.bodies and accepts_encoding(accept_encoding, encoding):
+                return encoding
+        return None
+
+
+class AssetCache:
+    """Bootstrap files (index.html, scripts, styles) kept in memory.
+
+    Every request checks the file's mtime, so edits are picked up at once;
+    only a changed file is read (and compressed) again.
+    """
+
+    def __init__(self):
+        self._assets: dict = {}
+
+    async def get(self, path: Path) -> CachedAsset:
+        stat_result = path.stat()
+        asset = self._assets.get(path)
+        if asset is None or asset.mtime_ns != stat_result.st_mtime_ns or asset.size != stat_result.st_size:
+            asset = await run_in_threadpool(CachedAsset, path, stat_result)
+            self._assets[path] = asset
+        return asset
+
+    async def serve(self, request: Request, path: Path) -> Response:
+        """Serve path from memory with its ETag, 304s and the best compressed body"""
+        asset = await self.get(path)
+        encoding = asset.encoding_for(request.headers.get("accept-encoding", ""))
+        headers = {
+            "etag": asset.etags[encoding],
+            "last-modified": asset.last_modified,
+            "cache-control": REVALIDATE_CACHE_CONTROL,
+        }
+        if len(asset.bodies) > 1:
+            headers["vary"] = "Accept-Encoding"
+        if encoding:
+            headers["content-encoding"] = encoding
+        if is_not_modified(request, headers["etag"], asset.mtime_ns / 1e9):
+            return Response(status_code=304, headers=headers)
+        body = asset.bodies[encoding]
+        if request.method == "HEAD":
+            headers["content-length"] = str(len(body))
+            body = b""
+        return Response(body, headers=headers, media_type=asset.media_type)
+
+
+def accel_redirect(uri: str, headers: dict, media_type: Optional[str]) -> Response:
+    """Empty response telling nginx to send the file at its internal location uri.
+
+    nginx answers conditional and range requests itself and sends the bytes
+    with sendfile; the internal location re-adds Content-Encoding and Vary,
+    which it does not copy from the redirecting response.
+    """
+    return Response(headers={**headers, "x-accel-redirect": quote(uri)},
+                    media_type=media_type or "application/octet-stream")
+
+
+async def serve_file(request: Request, path: Path, immutable: bool = False,
+                     media_type: Optional[str] = None, accel_uri: Optional[str] = None) -> Response:
+    """Serve path with validators, 304s, byte ranges and precompressed variants.
+
+    With accel_uri (the file's internal nginx location) the bytes are left to
+    nginx via X-Accel-Redirect once the caller has checked the request.
+    """
+    headers = {}
+    original_name = path.name
+    if is_compressible(path):
+        media_type = media_type or mimetypes.guess_type(path.name)[0]
+        headers["vary"] = "Accept-Encoding"
+        path, encoding = negotiate(path, request.headers.get("accept-encoding", ""))
+        if encoding:
+            headers["content-encoding"] = encoding
+
+    if accel_uri:
+        headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        # Point at the negotiated variant (name.br / name.gz) next to the original
+        variant_uri = accel_uri + path.name[len(original_name):]
+        return accel_redirect(variant_uri, headers, media_type or mimetypes.guess_type(original_name)[0])
+
+    stat_result = await run_in_threadpool(os.stat, path)
+    # Each variant is its own file, so its ETag differs from the uncompressed one
+    etag = await run_in_threadpool(file_etag, path, stat_result)
+    headers.update({
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    })
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range: only honour the range while the client's copy is still current
+    if range_header and (if_range is None or if_range.strip() in (etag, headers["last-modified"])):
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except ValueError:
+            byte_range = ()  # not a range we serve partially: send the whole file
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{stat_result.st_size}"})
+        if byte_range:
+            return FileRangeResponse(path, *byte_range, headers=headers, stat_result=stat_result,
+                                     method=request.method, media_type=media_type)
+
+    return FileResponse(path, headers=headers, stat_result=stat_result, method=request.method,
+                        media_type=media_type)
@@ -0,0 +1,142 @@
+"""
+Background conversion jobs for MyEarth.app
+Runs model processing outside the upload request on a bounded worker pool
+and keeps job state for the status API
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Maximum number of conversions running at the same time
+MAX_CONVERSION_WORKERS = int(os.getenv("MAX_CONVERSION_WORKERS", "2"))
+
+# Finished jobs are forgotten after this many seconds
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Blocking work (subprocesses, CPU-bound converters) runs here instead of on the event loop
+_executor = ThreadPoolExecutor(max_workers=MAX_CONVERSION_WORKERS, thread_name_prefix="conversion")
+
+
+async def run_blocking(func: Callable, *args, **kwargs):
+    """Run a blocking callable on the conversion pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: func(*args, **kwargs))
+
+
+@dataclass
+class Job:
+    """State of a single background conversion"""
+    id: str
+    filename: str
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "url": self.result.get("url") if self.result else None,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """In-process job registry with a bounded number of concurrently running jobs.
+
+    Job state lives in this process only, so run the app with a single
+    uvicorn worker (the default for run.sh and myearth.service).
+    """
+
+    def __init__(self, max_workers: int = MAX_CONVERSION_WORKERS):
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._max_workers = max_workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_workers)
+        return self._semaphore
+
+    def submit(
+        self,
+        filename: str,
+        work: Callable[[], Awaitable[Dict[str, Any]]],
+        on_error: Optional[Callable[[], None]] = None,
+    ) -> Job:
+        """Queue work() and return its job immediately"""
+        self._prune()
+        job = Job(id=uuid.uuid4().hex, filename=filename)
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job, work, on_error))
+        return job
+
+    def completed(self, filename: str, result: Dict[str, Any]) -> Job:
+        """Register a job whose result is already known (e.g. a deduplicated upload)"""
+        self._prune()
+        now = time.time()
+        job = Job(
+            id=uuid.uuid4().hex,
+            filename=filename,
+            status=JOB_DONE,
+            started_at=now,
+            finished_at=now,
+            result=result,
+        )
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _run(self, job: Job, work, on_error) -> None:
+        try:
+            async with self._slots():
+                job.status = JOB_RUNNING
+                job.started_at = time.time()
+                job.result = await work()
+                job.status = JOB_DONE
+        except Exception as e:
+            print(f"❌ Conversion job {job.id} failed: {e}")
+            job.status = JOB_FAILED
+            job.error = str(e)
+            if on_error:
+                try:
+                    on_error()
+                except Exception as cleanup_error:
+                    print(f"⚠️  Cleanup for job {job.id} failed: {cleanup_error}")
+        finally:
+            job.finished_at = time.time()
+            self._tasks.pop(job.id, None)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_TTL_SECONDS
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
@@ -0,0 +1,404 @@
+"""
+KML/KMZ conversion for MyEarth.app
+Streams KML (KMZ members are read straight from the archive), follows
+NetworkLinks through a disk cache and writes the placemarks as spatially
+tiled GeoJSON plus an index, so the viewer only fetches tiles in view
+"""
+
+import hashlib
+import ipaddress
+import json
+import os
+import posixpath
+import shutil
+import socket
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import numpy as np
+import requests
+import urllib3
+
+MAX_TILE_FEATURES = 2000
+MAX_DEPTH = 16
+COORDINATE_DECIMALS = 6  # ~0.1 m
+
+FETCH_NETWORK_LINKS = os.getenv("KML_FETCH_NETWORK_LINKS", "true").lower() == "true"
+LINK_CACHE_SECONDS = int(os.getenv("KML_LINK_CACHE_SECONDS", "86400"))
+MAX_LINK_DEPTH = 4
+MAX_LINK_BYTES = 50 * 1024 * 1024
+LINK_TIMEOUT = 20
+
+GEOMETRY_TAGS = {"Point", "LineString", "LinearRing", "Polygon", "MultiGeometry", "Track"}
+
+
+@lru_cache(maxsize=None)
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _child(element: ET.Element, name: str) -> Optional[ET.Element]:
+    return next((c for c in element if _local(c.tag) == name), None)
+
+
+def _text(element: ET.Element, name: str) -> Optional[str]:
+    child = _child(element, name)
+    return child.text.strip() if child is not None and child.text else None
+
+
+# --------------------
+# Styles
+# --------------------
+def _kml_color(value: str) -> Tuple[str, float]:
+    """KML aabbggrr -> ('#rrggbb', opacity)"""
+    value = value.strip().lstrip("#").rjust(8, "f")
+    return f"#{value[6:8]}{value[4:6]}{value[2:4]}", round(int(value[0:2], 16) / 255, 3)
+
+
+def parse_style(style: ET.Element) -> dict:
+    """Translate a KML Style into simplestyle properties understood by Cesium's GeoJSON loader"""
+    properties = {}
+    line = _child(style, "LineStyle")
+    if line is not None:
+        if _text(line, "color"):
+            properties["stroke"], properties["stroke-opacity"] = _kml_color(_text(line, "color"))
+        if _text(line, "width"):
+            properties["stroke-width"] = float(_text(line, "width"))
+    poly = _child(style, "PolyStyle")
+    if poly is not None:
+        if _text(poly, "color"):
+            properties["fill"], properties["fill-opacity"] = _kml_color(_text(poly, "color"))
+        if _text(poly, "fill") == "0":
+            properties["fill-opacity"] = 0
+    icon = _child(style, "IconStyle")
+    if icon is not None and _text(icon, "color"):
+        properties["marker-color"] = _kml_color(_text(icon, "color"))[0]
+    return properties
+
+
+# --------------------
+# Geometry
+# --------------------
+def _coordinates(text: Optional[str]) -> List[List[float]]:
+    points = []
+    for item in (text or "").split():
+        values = item.split(",")
+        if len(values) >= 2:
+            points.append([round(float(v), COORDINATE_DECIMALS) for v in values[:3]])
+    return points
+
+
+def parse_geometry(element: ET.Element) -> Optional[dict]:
+    """GeoJSON geometry for a KML geometry element"""
+    name = _local(element.tag)
+    if name == "Point":
+        points = _coordinates(_text(element, "coordinates"))
+        return {"type": "Point", "coordinates": points[0]} if points else None
+    if name in ("LineString", "LinearRing"):
+        points = _coordinates(_text(element, "coordinates"))
+        return {"type": "LineString", "coordinates": points} if len(points) >= 2 else None
+    if name == "Track":
+        points = [[round(float(v), COORDINATE_DECIMALS) for v in c.text.split()[:3]]
+                  for c in element if _local(c.tag) == "coord" and c.text]
+        return {"type": "LineString", "coordinates": points} if len(points) >= 2 else None
+    if name == "Polygon":
+        rings = []
+        for boundary in element:
+            if _local(boundary.tag) in ("outerBoundaryIs", "innerBoundaryIs"):
+                ring = _child(boundary, "LinearRing")
+                points = _coordinates(_text(ring, "coordinates")) if ring is not None else []
+                if len(points) >= 4:
+                    # The outer ring goes first in GeoJSON
+                    rings.insert(0 if _local(boundary.tag) == "outerBoundaryIs" else len(rings), points)
+        return {"type": "Polygon", "coordinates": rings} if rings else None
+    if name == "MultiGeometry":
+        parts = [g for g in (parse_geometry(c) for c in element if _local(c.tag) in GEOMETRY_TAGS) if g]
+        return {"type": "GeometryCollection", "geometries": parts} if parts else None
+    return None
+
+
+def _positions(geometry: dict):
+    if geometry["type"] == "GeometryCollection":
+        for part in geometry["geometries"]:
+            yield from _positions(part)
+        return
+    coordinates = geometry["coordinates"]
+    while coordinates and isinstance(coordinates[0], list):
+        if isinstance(coordinates[0][0], list):
+            coordinates = [p for ring in coordinates for p in ring]
+        else:
+            break
+    if coordinates and not isinstance(coordinates[0], list):
+        coordinates = [coordinates]
+    for point in coordinates:
+        yield point
+
+
+def geometry_bbox(geometry: dict) -> List[float]:
+    points = np.array([p[:2] for p in _positions(geometry)])
+    return [*points.min(axis=0).tolist(), *points.max(axis=0).tolist()]
+
+
+# --------------------
+# Documents and NetworkLinks
+# --------------------
+class _Source:
+    """Where a KML document came from, for resolving relative links"""
+
+    def __init__(self, archive: Optional[zipfile.ZipFile] = None, member: str = "", url: str = ""):
+        self.archive, self.member, self.url = archive, member, url
+
+
+def _root_member(archive: zipfile.ZipFile) -> str:
+    names = [n for n in archive.namelist() if n.lower().endswith(".kml")]
+    if not names:
+        raise ValueError("KMZ archive contains no KML document")
+    return "doc.kml" if "doc.kml" in names else names[0]
+
+
+def _public_address(host: str, port: int) -> Optional[str]:
+    """An address for host, or None if any address it resolves to is loopback, private or link-local"""
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+    except socket.gaierror:
+        return None
+    if not addresses or not all(ipaddress.ip_address(a.split("%")[0]).is_global for a in addresses):
+        return None
+    return addresses[0]
+
+
+def fetch_link(url: str, cache_dir: Path) -> Optional[Path]:
+    """Download a NetworkLink target into the cache (reused for LINK_CACHE_SECONDS)"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return None
+    https = parsed.scheme == "https"
+    port = parsed.port or (443 if https else 80)
+    address = _public_address(parsed.hostname, port)
+    if address is None:
+        return None
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cached = cache_dir / hashlib.sha256(url.encode("utf-8")).hexdigest()
+    if cached.exists() and time.time() - cached.stat().st_mtime < LINK_CACHE_SECONDS:
+        return cached
+
+    # Connect to the address that was checked; resolving the name again could give a private one.
+    # TLS still verifies the certificate against the hostname
+    if https:
+        pool = urllib3.HTTPSConnectionPool(address, port, timeout=LINK_TIMEOUT, retries=False,
+                                           server_hostname=parsed.hostname, assert_hostname=parsed.hostname,
+                                           ca_certs=requests.certs.where())
+    else:
+        pool = urllib3.HTTPConnectionPool(address, port, timeout=LINK_TIMEOUT, retries=False)
+    target = parsed._replace(scheme="", netloc="", fragment="").geturl() or "/"
+    host = parsed.netloc.rsplit("@", 1)[-1]
+    # Redirects could lead to a private address, so they are not followed
+    with pool, pool.urlopen("GET", target, headers={"Host": host, "User-Agent": requests.utils.default_user_agent()},
+                            redirect=False, preload_content=False) as response:
+        if response.status != 200:
+            return cached if cached.exists() else None
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir)
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for block in response.stream(64 * 1024):
+                size += len(block)
+                if size > MAX_LINK_BYTES:
+                    break
+                f.write(block)
+    if size > MAX_LINK_BYTES:
+        os.unlink(tmp_name)
+        return None
+    os.replace(tmp_name, cached)
+    return cached
+
+
+def _detach_finished(elements: List[ET.Element]) -> None:
+    """Drop everything parsed so far except the open elements (elements[-1] has just ended)"""
+    elements[-1].clear()
+    # Documents and Folders stay open around their placemarks; each keeps only its open child
+    for parent, child in zip(elements[:-1], elements[1:-1] + [None]):
+        parent[:] = [child] if child is not None else []
+
+
+class _Reader:
+    """Streams placemarks out of a KML document and everything it links to"""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.visited = set()
+        self.archives: List[zipfile.ZipFile] = []
+
+    def close(self) -> None:
+        for archive in self.archives:
+            archive.close()
+
+    def open_file(self, path: Path, url: str = "", depth: int = 0) -> Iterator[dict]:
+        with open(path, "rb") as f:
+            is_zip = f.read(4) == b"PK\x03\x04"
+        if is_zip:
+            archive = zipfile.ZipFile(path)
+            self.archives.append(archive)
+            member = _root_member(archive)
+            self.visited.add((id(archive), member))
+            with archive.open(member) as stream:
+                yield from self.features(stream, _Source(archive, member, url), depth)
+        else:
+            with open(path, "rb") as stream:
+                yield from self.features(stream, _Source(url=url), depth)
+
+    def follow(self, href: str, source: _Source, depth: int) -> Iterator[dict]:
+        if depth > MAX_LINK_DEPTH:
+            return
+        parsed = urlparse(href)
+        if parsed.scheme in ("http", "https") or (source.url and not parsed.scheme):
+            url = urljoin(source.url, href) if source.url else href
+            if url in self.visited or not FETCH_NETWORK_LINKS:
+                return
+            self.visited.add(url)
+            try:
+                path = fetch_link(url, self.cache_dir)
+            except urllib3.exceptions.HTTPError as e:
+                print(f"NetworkLink fetch failed ({url}): {e}")
+                return
+            if path:
+                for feature in self.open_file(path, url, depth):
+                    yield feature
+        elif source.archive is not None and not parsed.scheme:
+            # Relative link to another document inside the same KMZ
+            member = posixpath.normpath(posixpath.join(posixpath.dirname(source.member), href))
+            key = (id(source.archive), member)
+            if key in self.visited or member not in source.archive.namelist():
+                return
+            self.visited.add(key)
+            with source.archive.open(member) as stream:
+                yield from self.features(stream, _Source(source.archive, member, source.url), depth)
+
+    def features(self, stream: IO[bytes], source: _Source, depth: int) -> Iterator[dict]:
+        """GeoJSON features for one document; XML is discarded as soon as it is used"""
+        styles, style_maps = {}, {}
+        elements: List[ET.Element] = []
+        open_placemarks = 0
+        for event, element in ET.iterparse(stream, events=("start", "end")):
+            name = _local(element.tag)
+            if event == "start":
+                elements.append(element)
+                open_placemarks += name == "Placemark"
+                continue
+
+            if name == "Style" and not open_placemarks and element.get("id"):
+                styles[element.get("id")] = parse_style(element)
+            elif name == "StyleMap" and element.get("id"):
+                for pair in element:
+                    if _text(pair, "key") == "normal" and _text(pair, "styleUrl"):
+                        style_maps[element.get("id")] = _text(pair, "styleUrl").lstrip("#")
+            elif name == "Placemark":
+                open_placemarks -= 1
+                feature = self.placemark(element, styles, style_maps)
+                if feature:
+                    yield feature
+                _detach_finished(elements)
+            elif name == "NetworkLink":
+                link = _child(element, "Link")
+                link = link if link is not None else _child(element, "Url")
+                href = _text(link, "href") if link is not None else None
+                if href:
+                    yield from self.follow(href, source, depth + 1)
+                _detach_finished(elements)
+            elements.pop()
+
+    @staticmethod
+    def placemark(element: ET.Element, styles: dict, style_maps: dict) -> Optional[dict]:
+        geometry = next((parse_geometry(c) for c in element if _local(c.tag) in GEOMETRY_TAGS), None)
+        if not geometry:
+            return None
+        properties = {}
+        style_url = (_text(element, "styleUrl") or "").lstrip("#")
+        properties.update(styles.get(style_maps.get(style_url, style_url), {}))
+        inline_style = _child(element, "Style")
+        if inline_style is not None:
+            properties.update(parse_style(inline_style))
+        for key in ("name", "description"):
+            if _text(element, key):
+                properties[key] = _text(element, key)
+        extended = _child(element, "ExtendedData")
+        if extended is not None:
+            for data in extended.iter():
+                if _local(data.tag) == "Data" and data.get("name"):
+                    properties[data.get("name")] = _text(data, "value")
+                elif _local(data.tag) == "SimpleData" and data.get("name"):
+                    properties[data.get("name")] = data.text
+        return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+# --------------------
+# Tiles
+# --------------------
+def _split(features: np.ndarray, centres: np.ndarray, lower: np.ndarray, size: np.ndarray,
+           depth: int, key: str, leaves: List[Tuple[str, np.ndarray]]) -> None:
+    """Quadtree over feature centres; leaves hold at most MAX_TILE_FEATURES"""
+    if len(features) <= MAX_TILE_FEATURES or depth >= MAX_DEPTH:
+        leaves.append((key, features))
+        return
+    half = size / 2
+    quadrants = (centres[features, 0] >= lower[0] + half[0]).astype(int) + 2 * (centres[features, 1] >= lower[1] + half[1])
+    for quadrant in range(4):
+        members = features[quadrants == quadrant]
+        if len(members):
+            child_lower = lower + half * np.array([quadrant & 1, quadrant >> 1])
+            _split(members, centres, child_lower, half, depth + 1, key + str(quadrant), leaves)
+
+
+def convert_kml(input_path: Path, output_dir: Path, name: str, cache_dir: Path) -> dict:
+    """Convert KML/KMZ into {name}.json (tile index) plus {name}_r*.geojson tiles in output_dir"""
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{name}_", dir=output_dir))
+    reader = _Reader(cache_dir)
+    try:
+        # Spill features to disk while streaming; only their bounds stay in memory
+        offsets, boxes = [], []
+        with open(work_dir / "features.jsonl", "wb") as spill:
+            for feature in reader.open_file(input_path):
+                offsets.append(spill.tell())
+                boxes.append(geometry_bbox(feature["geometry"]))
+                spill.write(json.dumps(feature, separators=(",", ":")).encode("utf-8") + b"\n")
+        if not boxes:
+            raise ValueError("No placemarks with geometry found")
+
+        boxes = np.array(boxes)
+        centres = (boxes[:, :2] + boxes[:, 2:]) / 2
+        lower = centres.min(axis=0)
+        size = np.maximum(centres.max(axis=0) - lower, 1e-9) * 1.000001
+        leaves: List[Tuple[str, np.ndarray]] = []
+        _split(np.arange(len(boxes)), centres, lower, size, 0, "r", leaves)
+
+        tiles = []
+        with open(work_dir / "features.jsonl", "rb") as spill:
+            for key, members in leaves:
+                tile_name = f"{name}_{key}.geojson"
+                with open(output_dir / tile_name, "wb") as f:
+                    f.write(b'{"type":"FeatureCollection","features":[')
+                    for i, feature in enumerate(members):
+                        spill.seek(offsets[feature])
+                        f.write((b"," if i else b"") + spill.readline().rstrip(b"\n"))
+                    f.write(b"]}")
+                bbox = np.concatenate([boxes[members, :2].min(axis=0), boxes[members, 2:].max(axis=0)])
+                tiles.append({"url": tile_name, "bbox": bbox.round(COORDINATE_DECIMALS).tolist(), "count": len(members)})
+    finally:
+        reader.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    bbox = np.concatenate([boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)])
+    index = {
+        "type": "FeatureTiles",
+        "bbox": bbox.round(COORDINATE_DECIMALS).tolist(),
+        "feature_count": len(boxes),
+        "tiles": tiles,
+    }
+    index_path = output_dir / f"{name}.json"
+    index_path.write_text(json.dumps(index, separators=(",", ":")))
+    return {"index": index_path.name, "feature_count": len(boxes), "tile_count": len(tiles)}
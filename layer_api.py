@@ -4,21 +4,25 @@ Handles layer CRUD operations, search, ratings, and file uploads
 """
 
 import os
+import re
+import math
+import base64
 import json
 import tempfile
 import shutil
 from pathlib import Path
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, func
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, or_, desc, func, literal, null, cast, tuple_, DateTime, Float
 from pydantic import BaseModel
 import uuid
 from datetime import datetime
 
-from models import User, Layer, LayerRating, LayerCategory, License
+from models import User, Layer, LayerRating, LayerCategory, License, SEARCH_CONFIG
 from auth import get_current_active_user, get_db
+from storage import UploadTooLarge, write_stream
 import geopandas as gpd
 import requests
 from urllib.parse import urlparse
@@ -81,9 +85,148 @@ class SearchFilters(BaseModel):
     tags: Optional[List[str]] = None
     min_rating: Optional[float] = None
     is_public: Optional[bool] = None
-    sort_by: str = "created_at"  # created_at, rating, popularity, title
+    bbox: Optional[List[float]] = None  # [min_lon, min_lat, max_lon, max_lat] of the view
+    sort_by: Optional[str] = None  # relevance (default with a query), created_at, rating, popularity, title, overlap, distance
     sort_order: str = "desc"  # asc, desc
 
+# Layer listing queries
+def _layer_rows(db: Session, current_user: Optional[User]):
+    """Query of (layer, owner, caller's rating) rows; rating aggregates are columns of Layer"""
+    if current_user:
+        own = aliased(LayerRating)
+        own_rating = own.rating
+    else:
+        own_rating = null()
+    query = db.query(Layer, User, own_rating).join(User, Layer.user_id == User.id)
+    if current_user:
+        query = query.outerjoin(own, and_(own.layer_id == Layer.id, own.user_id == current_user.id))
+    return query
+
+def _prefix_tsquery(text: str) -> Optional[str]:
+    """to_tsquery input matching every word of text as a prefix ("berl bui" -> "berl:* & bui:*")"""
+    # Only word characters reach the tsquery, so user input cannot break its syntax
+    words = re.findall(r"\w+", text)
+    return " & ".join(f"{word}:*" for word in words) if words else None
+
+def _text_search(query_builder, text: str):
+    """Filter on the full-text index, with trigram title matches for typos; returns (query, ordering)"""
+    ts_query = _prefix_tsquery(text)
+    # Titles that contain a word similar to the query (served by ix_layers_title_trgm)
+    fuzzy_match = literal(text).op("<%")(Layer.title)
+    # real in PostgreSQL; as double precision the value round-trips through a cursor exactly
+    similarity = cast(func.word_similarity(text, Layer.title), Float)
+    if ts_query is None:
+        return query_builder.filter(fuzzy_match), ([similarity], True)
+    
+    ts_query = func.to_tsquery(SEARCH_CONFIG, ts_query)
+    # Both conditions use their own GIN index (bitmap OR); full-text matches rank first
+    query_builder = query_builder.filter(or_(Layer.search_vector.op("@@")(ts_query), fuzzy_match))
+    rank = cast(func.coalesce(func.ts_rank_cd(Layer.search_vector, ts_query), 0), Float)
+    return query_builder, ([rank, similarity], True)
+
+def _parse_bbox(bbox: str):
+    """(west, south, east, north) of a "minx,miny,maxx,maxy" view, with west <= east.
+
+    minx > maxx means the view crosses the antimeridian; east then goes past 180.
+    """
+    try:
+        west, south, east, north = (float(value) for value in bbox.split(","))
+        if not all(map(math.isfinite, (west, south, east, north))):
+            raise ValueError(bbox)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minx,miny,maxx,maxy")
+    if not -90 <= south <= north <= 90:
+        raise HTTPException(status_code=400, detail="bbox latitudes must satisfy -90 <= miny <= maxy <= 90")
+    width = east - west
+    if width < 0:
+        width += 360
+    if width >= 360:
+        # Whole globe: one box covering every envelope, antimeridian-crossing ones included
+        return -180.0, south, 540.0, north
+    west = (west + 180) % 360 - 180
+    return west, south, west + width, north
+
+def _viewport_search(query_builder, bbox: str):
+    """Filter on layers whose envelope overlaps the view (ix_layers_envelope); returns (query, orderings)"""
+    west, south, east, north = _parse_bbox(bbox)
+    # Envelopes and the view both start in [-180, 180) and may end past 180; comparing
+    # against the view shifted a turn either way catches overlaps across the antimeridian
+    views = [func.box(func.point(west + shift, south), func.point(east + shift, north))
+             for shift in (-360, 0, 360)]
+    query_builder = query_builder.filter(or_(*(Layer.envelope.bool_op("&&")(view) for view in views)))
+    
+    # Largest area shared with the view, in square degrees
+    overlap = func.greatest(*(func.coalesce(func.area(Layer.envelope.op("#")(view), type_=Float), 0)
+                              for view in views))
+    # Envelope centre to view centre, longitude difference taken the short way round
+    delta_lon = func.abs((Layer.min_lon + Layer.max_lon) * 0.5 - (west + east) / 2)
+    delta_lon = func.least(delta_lon, func.abs(delta_lon - 360))
+    delta_lat = (Layer.min_lat + Layer.max_lat) * 0.5 - (south + north) / 2
+    distance = delta_lon * delta_lon + delta_lat * delta_lat
+    return query_builder, {"overlap": ([overlap], True), "distance": ([distance], False)}
+
+# sort_by -> (sort keys, descending by default) of the orders that need no filter; Layer.id breaks ties.
+# Keys must be NOT NULL: a NULL in a cursor would make the row comparison unknown
+SORT_ORDERINGS = {
+    "created_at": ([Layer.created_at], True),
+    "rating": ([Layer.average_rating], True),
+    "popularity": ([Layer.view_count], True),
+    "title": ([Layer.title], False),
+}
+
+def _encode_cursor(sort: str, values) -> str:
+    """Opaque cursor holding the sort keys of the last layer of a page"""
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps([sort, values]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, sort: str, keys) -> list:
+    """Sort key values from a cursor made by _encode_cursor for the same sort ("created_at desc")"""
+    try:
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if cursor_sort != sort or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(value) if isinstance(key.type, DateTime) else value
+                for key, value in zip(keys, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor for this sort_by and sort_order")
+
+def _layer_dict(layer: Layer, user: User, user_rating: Optional[int],
+                include_user_rating: bool = True) -> Dict[str, Any]:
+    """LayerResponse fields from one _layer_rows row, without touching relationships"""
+    layer_dict = {
+        "id": str(layer.id),
+        "title": layer.title,
+        "description": layer.description,
+        "tags": layer.tags,
+        "source_url": layer.source_url,
+        "license": layer.license,
+        "category": layer.category,
+        "is_public": layer.is_public,
+        "file_path": layer.file_path,
+        "file_size": layer.file_size,
+        "file_format": layer.file_format,
+        "processed_format": layer.processed_format,
+        "bbox": layer.bbox,
+        "center_lon": layer.center_lon,
+        "center_lat": layer.center_lat,
+        "zoom_level": layer.zoom_level,
+        "view_count": layer.view_count,
+        "download_count": layer.download_count,
+        "average_rating": layer.average_rating,
+        "rating_count": layer.rating_count,
+        "created_at": layer.created_at,
+        "updated_at": layer.updated_at,
+        "user": {
+            "id": str(user.id),
+            "username": user.username,
+            "full_name": user.full_name,
+            "avatar_url": user.avatar_url
+        }
+    }
+    if include_user_rating:
+        layer_dict["user_rating"] = user_rating
+    return layer_dict
+
 # Layer CRUD Operations
 @router.post("/", response_model=LayerResponse)
 async def create_layer(
@@ -111,36 +254,38 @@ async def create_layer(
 
 @router.get("/", response_model=List[LayerResponse])
 async def search_layers(
+    response: Response,
     query: Optional[str] = Query(None, description="Search query"),
     category: Optional[str] = Query(None, description="Filter by category"),
     license: Optional[str] = Query(None, description="Filter by license"),
     tags: Optional[str] = Query(None, description="Comma-separated tags"),
     min_rating: Optional[float] = Query(None, description="Minimum rating"),
     is_public: Optional[bool] = Query(True, description="Public layers only"),
-    sort_by: str = Query("created_at", description="Sort field"),
-    sort_order: str = Query("desc", description="Sort order"),
-    page: int = Query(1, ge=1, description="Page number"),
+    bbox: Optional[str] = Query(None, description="Layers overlapping the view minx,miny,maxx,maxy (minx > maxx crosses the antimeridian)"),
+    sort_by: Optional[str] = Query(None, description="Sort field: relevance (default with a query), created_at, rating, popularity, title, overlap or distance (with bbox)"),
+    sort_order: Optional[str] = Query(None, description="Sort order: asc or desc (default depends on sort_by)"),
+    page: int = Query(1, ge=1, description="Page number (ignored with a cursor)"),
     limit: int = Query(20, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
     current_user: Optional[User] = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """Search and filter layers"""
-    # Build query
-    query_builder = db.query(Layer)
+    # Build query: owner, rating aggregates and the caller's rating come in the same rows
+    query_builder = _layer_rows(db, current_user)
     
     # Apply filters
     if is_public:
         query_builder = query_builder.filter(Layer.is_public == True)
     
+    # Orderings that only exist with their filter: relevance, overlap, distance
+    orderings = {}
     if query:
-        search_term = f"%{query}%"
-        query_builder = query_builder.filter(
-            or_(
-                Layer.title.ilike(search_term),
-                Layer.description.ilike(search_term),
-                Layer.tags.any(lambda tag: tag.ilike(search_term))
-            )
-        )
+        query_builder, orderings["relevance"] = _text_search(query_builder, query)
+    
+    if bbox:
+        query_builder, viewport_orderings = _viewport_search(query_builder, bbox)
+        orderings.update(viewport_orderings)
     
     if category:
         query_builder = query_builder.filter(Layer.category == category)
@@ -154,74 +299,37 @@ async def search_layers(
             query_builder = query_builder.filter(Layer.tags.contains([tag]))
     
     if min_rating:
-        # This is a simplified version - in production you'd use a subquery
-        query_builder = query_builder.filter(Layer.id.in_(
-            db.query(LayerRating.layer_id)
-            .group_by(LayerRating.layer_id)
-            .having(func.avg(LayerRating.rating) >= min_rating)
-        ))
-    
-    # Apply sorting
-    if sort_by == "rating":
-        # Sort by average rating (simplified)
-        query_builder = query_builder.order_by(desc(Layer.id))
-    elif sort_by == "popularity":
-        query_builder = query_builder.order_by(desc(Layer.view_count))
-    elif sort_by == "title":
-        query_builder = query_builder.order_by(Layer.title)
-    else:  # created_at
-        query_builder = query_builder.order_by(desc(Layer.created_at))
-    
-    # Apply pagination
-    offset = (page - 1) * limit
-    layers = query_builder.offset(offset).limit(limit).all()
-    
-    # Add user rating if authenticated
-    result = []
-    for layer in layers:
-        layer_dict = {
-            "id": str(layer.id),
-            "title": layer.title,
-            "description": layer.description,
-            "tags": layer.tags,
-            "source_url": layer.source_url,
-            "license": layer.license,
-            "category": layer.category,
-            "is_public": layer.is_public,
-            "file_path": layer.file_path,
-            "file_size": layer.file_size,
-            "file_format": layer.file_format,
-            "processed_format": layer.processed_format,
-            "bbox": layer.bbox,
-            "center_lon": layer.center_lon,
-            "center_lat": layer.center_lat,
-            "zoom_level": layer.zoom_level,
-            "view_count": layer.view_count,
-            "download_count": layer.download_count,
-            "average_rating": layer.average_rating,
-            "rating_count": layer.rating_count,
-            "created_at": layer.created_at,
-            "updated_at": layer.updated_at,
-            "user": {
-                "id": str(layer.user.id),
-                "username": layer.user.username,
-                "full_name": layer.user.full_name,
-                "avatar_url": layer.user.avatar_url
-            }
-        }
-        
-        # Add user rating if authenticated
-        if current_user:
-            user_rating = db.query(LayerRating).filter(
-                and_(
-                    LayerRating.layer_id == layer.id,
-                    LayerRating.user_id == current_user.id
-                )
-            ).first()
-            layer_dict["user_rating"] = user_rating.rating if user_rating else None
-        
-        result.append(layer_dict)
-    
+        query_builder = query_builder.filter(Layer.average_rating >= min_rating)
+    
+    # Apply sorting; unknown orders, and filter orders without their filter, fall back to created_at
+    sort_by = sort_by or ("relevance" if query else "created_at")
+    orderings.update(SORT_ORDERINGS)
+    if sort_by not in orderings:
+        sort_by = "created_at"
+    sort_keys, descending = orderings[sort_by]
+    if sort_order in ("asc", "desc"):
+        descending = sort_order == "desc"
+    sort = f"{sort_by} {'desc' if descending else 'asc'}"
+    keys = [*sort_keys, Layer.id]
+    # Fixed orders are served by their (key, id) index, e.g. ix_layers_created_at_id
+    query_builder = query_builder.order_by(*(desc(key) if descending else key for key in keys))
+    query_builder = query_builder.add_columns(*sort_keys)
+    
+    # Apply pagination: a cursor seeks past the previous page instead of counting rows off
+    if cursor:
+        after = tuple_(*keys)
+        values = _decode_cursor(cursor, sort, keys)
+        values = tuple_(*(literal(value, key.type) for key, value in zip(keys, values)))
+        query_builder = query_builder.filter(after < values if descending else after > values)
+    else:
+        query_builder = query_builder.offset((page - 1) * limit)
+    # One row past the page tells whether there is a next one
+    rows = query_builder.limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(sort, [*last[3:], last[0].id])
+    result = [_layer_dict(*row[:3], include_user_rating=current_user is not None) for row in rows]
     return result
 
 @router.get("/{layer_id}", response_model=LayerResponse)
@@ -231,9 +339,10 @@ async def get_layer(
     db: Session = Depends(get_db)
 ):
     """Get a specific layer by ID"""
-    layer = db.query(Layer).filter(Layer.id == layer_id).first()
-    if not layer:
+    row = _layer_rows(db, current_user).filter(Layer.id == layer_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Layer not found")
+    layer = row[0]
     
     # Check if user can access private layer
     if not layer.is_public and (not current_user or layer.user_id != current_user.id):
@@ -243,49 +352,7 @@ async def get_layer(
     layer.view_count += 1
     db.commit()
     
-    # Build response
-    layer_dict = {
-        "id": str(layer.id),
-        "title": layer.title,
-        "description": layer.description,
-        "tags": layer.tags,
-        "source_url": layer.source_url,
-        "license": layer.license,
-        "category": layer.category,
-        "is_public": layer.is_public,
-        "file_path": layer.file_path,
-        "file_size": layer.file_size,
-        "file_format": layer.file_format,
-        "processed_format": layer.processed_format,
-        "bbox": layer.bbox,
-        "center_lon": layer.center_lon,
-        "center_lat": layer.center_lat,
-        "zoom_level": layer.zoom_level,
-        "view_count": layer.view_count,
-        "download_count": layer.download_count,
-        "average_rating": layer.average_rating,
-        "rating_count": layer.rating_count,
-        "created_at": layer.created_at,
-        "updated_at": layer.updated_at,
-        "user": {
-            "id": str(layer.user.id),
-            "username": layer.user.username,
-            "full_name": layer.user.full_name,
-            "avatar_url": layer.user.avatar_url
-        }
-    }
-    
-    # Add user rating if authenticated
-    if current_user:
-        user_rating = db.query(LayerRating).filter(
-            and_(
-                LayerRating.layer_id == layer.id,
-                LayerRating.user_id == current_user.id
-            )
-        ).first()
-        layer_dict["user_rating"] = user_rating.rating if user_rating else None
-    
-    return layer_dict
+    return _layer_dict(*row, include_user_rating=current_user is not None)
 
 @router.put("/{layer_id}", response_model=LayerResponse)
 async def update_layer(
@@ -339,6 +406,12 @@ async def delete_layer(
     return {"message": "Layer deleted successfully"}
 
 # Rating System
+def _update_rating_aggregates(layer: Layer, sum_delta: int, count_delta: int) -> None:
+    """Adjust the layer's rating aggregates in the same transaction as the rating change"""
+    # Relative updates stay correct even if the row was loaded before another commit
+    layer.rating_sum = Layer.rating_sum + sum_delta
+    layer.rating_count = Layer.rating_count + count_delta
+
 @router.post("/{layer_id}/rate")
 async def rate_layer(
     layer_id: str,
@@ -350,7 +423,8 @@ async def rate_layer(
     if not 1 <= rating_data.rating <= 5:
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
     
-    layer = db.query(Layer).filter(Layer.id == layer_id).first()
+    # Lock the layer row so concurrent ratings apply their aggregate changes one at a time
+    layer = db.query(Layer).filter(Layer.id == layer_id).with_for_update().first()
     if not layer:
         raise HTTPException(status_code=404, detail="Layer not found")
     
@@ -364,6 +438,7 @@ async def rate_layer(
     
     if existing_rating:
         # Update existing rating
+        _update_rating_aggregates(layer, rating_data.rating - existing_rating.rating, 0)
         existing_rating.rating = rating_data.rating
         existing_rating.comment = rating_data.comment
         existing_rating.updated_at = datetime.utcnow()
@@ -376,6 +451,7 @@ async def rate_layer(
             comment=rating_data.comment
         )
         db.add(new_rating)
+        _update_rating_aggregates(layer, rating_data.rating, 1)
     
     db.commit()
     
@@ -388,7 +464,7 @@ async def remove_rating(
     db: Session = Depends(get_db)
 ):
     """Remove user's rating for a layer"""
-    layer = db.query(Layer).filter(Layer.id == layer_id).first()
+    layer = db.query(Layer).filter(Layer.id == layer_id).with_for_update().first()
     if not layer:
         raise HTTPException(status_code=404, detail="Layer not found")
     
@@ -403,19 +479,16 @@ async def remove_rating(
         raise HTTPException(status_code=404, detail="Rating not found")
     
     db.delete(rating)
+    _update_rating_aggregates(layer, -rating.rating, -1)
     db.commit()
     
     return {"message": "Rating removed successfully"}
 
 # File Upload and Processing
-@router.post("/{layer_id}/upload")
-async def upload_layer_file(
-    layer_id: str,
-    file: UploadFile = File(...),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
-):
-    """Upload a file for a layer"""
+LAYER_FILE_EXTENSIONS = ['.geojson', '.shp', '.gpkg', '.kml', '.kmz', '.zip']
+MAX_LAYER_FILE_BYTES = int(os.getenv("MAX_FILE_SIZE", str(500 * 1024 * 1024)))
+
+def _editable_layer(layer_id: str, current_user: User, db: Session) -> Layer:
     layer = db.query(Layer).filter(Layer.id == layer_id).first()
     if not layer:
         raise HTTPException(status_code=404, detail="Layer not found")
@@ -423,26 +496,70 @@ async def upload_layer_file(
     # Check permissions
     if layer.user_id != current_user.id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Access denied")
-    
+    return layer
+
+def _layer_file_extension(filename: str) -> str:
     # Validate file format
-    allowed_extensions = ['.geojson', '.shp', '.gpkg', '.kml', '.kmz', '.zip']
-    file_ext = Path(file.filename).suffix.lower()
-    
-    if file_ext not in allowed_extensions:
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in LAYER_FILE_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Unsupported file format. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Unsupported file format. Allowed: {', '.join(LAYER_FILE_EXTENSIONS)}"
         )
-    
+    return file_ext
+
+def _layer_file_path(layer_id: str, filename: str) -> Path:
     # Create uploads directory if it doesn't exist
     uploads_dir = Path("uploads")
     uploads_dir.mkdir(exist_ok=True)
+    return uploads_dir / f"{layer_id}_{Path(filename).name}"
+
+@router.post("/{layer_id}/upload")
+async def upload_layer_file(
+    layer_id: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Upload a file for a layer"""
+    layer = _editable_layer(layer_id, current_user, db)
+    file_ext = _layer_file_extension(file.filename)
     
     # Save file
-    file_path = uploads_dir / f"{layer_id}_{file.filename}"
+    file_path = _layer_file_path(layer_id, file.filename)
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
+    return await _process_layer_file(layer, file_path, file_ext, db)
+
+@router.put("/{layer_id}/upload/{filename}")
+async def upload_layer_file_raw(
+    layer_id: str,
+    filename: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """Upload a layer file as the raw request body, without multipart parsing"""
+    layer = _editable_layer(layer_id, current_user, db)
+    file_ext = _layer_file_extension(filename)
+    content_length = request.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_LAYER_FILE_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    # Hash and write in one pass; the size limit is enforced while streaming
+    file_path = _layer_file_path(layer_id, filename)
+    try:
+        with open(file_path, "wb") as buffer:
+            digest, _ = await write_stream(request.stream(), buffer, MAX_LAYER_FILE_BYTES)
+    except UploadTooLarge:
+        file_path.unlink()
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    result = await _process_layer_file(layer, file_path, file_ext, db)
+    return {**result, "sha256": digest}
+
+async def _process_layer_file(layer: Layer, file_path: Path, file_ext: str, db: Session) -> Dict[str, Any]:
     # Process file and extract metadata
     try:
         metadata = await process_geospatial_file(file_path, file_ext)
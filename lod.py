@@ -0,0 +1,255 @@
+"""
+Level-of-detail generation for MyEarth.app
+Simplifies GLB meshes with vectorized quadric-error edge collapse and
+packages the levels as a 3D Tiles tileset that streams coarse levels first
+"""
+
+import copy
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from glb import (GLBRewriter, read_accessor_float, read_glb, scene_bounds, triangle_count,
+                 write_glb, MODE_TRIANGLES, TARGET_ARRAY_BUFFER, TARGET_ELEMENT_ARRAY_BUFFER)
+from glb_optimizer import can_optimize, optimize_glb
+import tiles3d
+
+# Fraction of the original triangles kept by each coarser level, finest first
+LOD_RATIOS = [0.5, 0.2, 0.05]
+
+# Models below this many triangles are served as a single GLB
+LOD_MIN_TRIANGLES = int(os.getenv("LOD_MIN_TRIANGLES", "100000"))
+
+# Boundary edges are held in place by planes weighted this much more than faces
+BOUNDARY_WEIGHT = 100.0
+
+MAX_PASSES = 50
+
+
+# --------------------
+# Quadric simplification
+# --------------------
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    lengths = np.linalg.norm(vectors, axis=1)
+    return vectors / np.where(lengths > 0, lengths, 1.0)[:, None]
+
+
+def _face_planes(positions: np.ndarray, triangles: np.ndarray):
+    """Unit face normals and plane offsets"""
+    v0, v1, v2 = (positions[triangles[:, i]] for i in range(3))
+    normals = _unit(np.cross(v1 - v0, v2 - v0))
+    return normals, -np.einsum("ij,ij->i", normals, v0)
+
+
+def _edge_keys(edges: np.ndarray, vertex_count: int) -> np.ndarray:
+    """One int64 per undirected edge, cheaper to sort than (a, b) rows"""
+    lo, hi = np.minimum(edges[:, 0], edges[:, 1]), np.maximum(edges[:, 0], edges[:, 1])
+    return lo * vertex_count + hi
+
+
+def _triangle_edges(triangles: np.ndarray) -> np.ndarray:
+    return np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+
+
+def _plane_quadrics(normals: np.ndarray, offsets: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    planes = np.concatenate([normals, offsets[:, None]], axis=1)
+    return np.einsum("i,ij,ik->ijk", weights, planes, planes)
+
+
+def vertex_quadrics(positions: np.ndarray, triangles: np.ndarray) -> np.ndarray:
+    """Per-vertex error quadrics (N, 4, 4), including boundary-preserving planes"""
+    quadrics = np.zeros((len(positions), 4, 4))
+    normals, offsets = _face_planes(positions, triangles)
+    face_quadrics = _plane_quadrics(normals, offsets, np.ones(len(triangles)))
+    for corner in range(3):
+        np.add.at(quadrics, triangles[:, corner], face_quadrics)
+
+    # Edges used by exactly one face are boundaries: add a plane through the edge, perpendicular to the face
+    edges = _triangle_edges(triangles)
+    faces = np.tile(np.arange(len(triangles)), 3)
+    _, inverse, counts = np.unique(_edge_keys(edges, len(positions)), return_inverse=True, return_counts=True)
+    boundary = counts[inverse] == 1
+    if boundary.any():
+        a, b = edges[boundary, 0], edges[boundary, 1]
+        side = _unit(np.cross(positions[b] - positions[a], normals[faces[boundary]]))
+        side_offsets = -np.einsum("ij,ij->i", side, positions[a])
+        boundary_quadrics = _plane_quadrics(side, side_offsets, np.full(len(side), BOUNDARY_WEIGHT))
+        np.add.at(quadrics, a, boundary_quadrics)
+        np.add.at(quadrics, b, boundary_quadrics)
+    return quadrics
+
+
+def _quadric_error(quadrics: np.ndarray, points: np.ndarray) -> np.ndarray:
+    homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    return np.maximum(np.einsum("ij,ijk,ik->i", homogeneous, quadrics, homogeneous), 0.0)
+
+
+def simplify(positions: np.ndarray, triangles: np.ndarray, target_triangles: int):
+    """Collapse edges until at most target_triangles remain.
+
+    Every pass scores all edges at once (endpoints and midpoint as candidate
+    positions), then collapses the cheapest edges that form an independent
+    set, so no vertex takes part in two collapses in the same pass.
+    Returns (kept vertex ids, new positions, new triangles, max error distance).
+    """
+    positions = positions.astype(np.float64).copy()
+    triangles = triangles.astype(np.int64).copy()
+    quadrics = vertex_quadrics(positions, triangles)
+    representative = np.arange(len(positions))
+    max_error = 0.0
+
+    for _ in range(MAX_PASSES):
+        if len(triangles) <= target_triangles:
+            break
+        keys = np.unique(_edge_keys(_triangle_edges(triangles), len(positions)))
+        a, b = keys // len(positions), keys % len(positions)
+        edge_quadrics = quadrics[a] + quadrics[b]
+
+        candidates = np.stack([positions[a], positions[b], (positions[a] + positions[b]) / 2], axis=1)
+        errors = np.stack([_quadric_error(edge_quadrics, candidates[:, i]) for i in range(3)], axis=1)
+        best = errors.argmin(axis=1)
+        cost = errors[np.arange(len(keys)), best]
+        target = candidates[np.arange(len(keys)), best]
+
+        # Each collapse removes about two triangles; only consider as many cheap edges as needed
+        needed = max(1, (len(triangles) - target_triangles) // 2)
+        ranked = np.argsort(cost, kind="stable")[:needed]
+
+        # Independent set: an edge wins if it is the cheapest candidate at both endpoints
+        rank = np.full(len(keys), np.iinfo(np.int64).max)
+        rank[ranked] = np.arange(len(ranked))
+        best_at_vertex = np.full(len(positions), np.iinfo(np.int64).max)
+        np.minimum.at(best_at_vertex, a[ranked], rank[ranked])
+        np.minimum.at(best_at_vertex, b[ranked], rank[ranked])
+        chosen = ranked[(best_at_vertex[a[ranked]] == rank[ranked]) & (best_at_vertex[b[ranked]] == rank[ranked])]
+        if not len(chosen):
+            break
+
+        keep, drop = a[chosen], b[chosen]
+        positions[keep] = target[chosen]
+        quadrics[keep] += quadrics[drop]
+        max_error = max(max_error, float(cost[chosen].max()))
+
+        remap = np.arange(len(positions))
+        remap[drop] = keep
+        representative = remap[representative]
+        triangles = remap[triangles]
+        triangles = triangles[
+            (triangles[:, 0] != triangles[:, 1])
+            & (triangles[:, 1] != triangles[:, 2])
+            & (triangles[:, 0] != triangles[:, 2])
+        ]
+
+    used = np.unique(triangles)
+    compact = np.zeros(len(positions), dtype=np.int64)
+    compact[used] = np.arange(len(used))
+    # The quadric error is a sum of squared plane distances; report it as a length
+    return used, positions[used], compact[triangles], float(np.sqrt(max_error))
+
+
+# --------------------
+# GLB levels
+# --------------------
+class _SimplifyingRewriter(GLBRewriter):
+    """Rewrites every indexed triangle primitive at a reduced triangle budget"""
+
+    def simplify_mesh(self, mesh: dict, ratio: float) -> float:
+        error = 0.0
+        for primitive in mesh["primitives"]:
+            attributes = primitive["attributes"]
+            if primitive.get("mode", MODE_TRIANGLES) != MODE_TRIANGLES or "indices" not in primitive:
+                primitive["attributes"] = {name: self.copy_accessor(i) for name, i in attributes.items()}
+                if "indices" in primitive:
+                    primitive["indices"] = self.copy_accessor(primitive["indices"])
+                continue
+
+            positions = read_accessor_float(self.src, self.binary, attributes["POSITION"])
+            triangles = self.accessor(primitive["indices"]).reshape(-1, 3).astype(np.int64)
+            target = max(1, int(len(triangles) * ratio))
+            kept, new_positions, new_triangles, primitive_error = simplify(positions, triangles, target)
+            error = max(error, primitive_error)
+
+            new_attributes = {}
+            for name, index in attributes.items():
+                if name == "POSITION":
+                    new_attributes[name] = self.builder.add_accessor(
+                        new_positions.astype(np.float32), TARGET_ARRAY_BUFFER, with_bounds=True)
+                else:
+                    acc = self.src["accessors"][index]
+                    # Surviving vertices keep their own normals, UVs and colours
+                    new_attributes[name] = self.builder.add_accessor(
+                        self.accessor(index)[kept], TARGET_ARRAY_BUFFER,
+                        normalized=acc.get("normalized", False), accessor_type=acc["type"])
+            primitive["attributes"] = new_attributes
+            index_dtype = np.uint16 if len(new_positions) < 65536 else np.uint32
+            primitive["indices"] = self.builder.add_accessor(
+                new_triangles.reshape(-1).astype(index_dtype), TARGET_ELEMENT_ARRAY_BUFFER)
+        return error
+
+
+def simplify_glb(gltf: dict, binary: bytes, ratio: float, output_path: Path) -> float:
+    """Write a simplified copy of a GLB; returns the largest geometric error introduced"""
+    simplified = copy.deepcopy(gltf)
+    rewriter = _SimplifyingRewriter(gltf, binary)
+    error = max([rewriter.simplify_mesh(mesh, ratio) for mesh in simplified.get("meshes", [])] or [0.0])
+    write_glb(output_path, simplified, rewriter.finish(simplified))
+    return error
+
+
+def _levels_supported(gltf: dict) -> bool:
+    if gltf.get("skins") or gltf.get("animations"):
+        return False
+    return not any("targets" in p for m in gltf.get("meshes", []) for p in m["primitives"])
+
+
+def generate_lod_tileset(glb_path: Path, output_dir: Path, name: str,
+                         ratios: List[float] = LOD_RATIOS) -> Optional[dict]:
+    """Build a REPLACE-refined tileset over simplified copies of glb_path.
+
+    glb_path should not be quantized yet (levels are simplified in model
+    units and optimized afterwards). The full-resolution GLB itself is the
+    leaf; coarser levels are written next to it as {name}_lod{n}.glb and the
+    tileset as {name}.json. Returns None when the model is too small or uses
+    unsupported features.
+    """
+    gltf, binary = read_glb(glb_path)
+    full_triangles = triangle_count(gltf)
+    if full_triangles < LOD_MIN_TRIANGLES or not can_optimize(gltf) or not _levels_supported(gltf):
+        return None
+
+    lower, upper = tiles3d.y_up_to_z_up(*scene_bounds(gltf, binary))
+    volume = tiles3d.box_volume(lower, upper)
+
+    levels: List[Tuple[str, int, float]] = []
+    error = 0.0
+    for level, ratio in enumerate(ratios, start=1):
+        level_path = output_dir / f"{name}_lod{level}.glb"
+        raw_path = output_dir / f"{name}_lod{level}.raw.glb"
+        error = max(error, simplify_glb(gltf, binary, ratio, raw_path))
+        if optimize_glb(raw_path, level_path) is None:
+            os.replace(raw_path, level_path)
+        elif raw_path.exists():
+            raw_path.unlink()
+        level_gltf, _ = read_glb(level_path)
+        levels.append((level_path.name, triangle_count(level_gltf), error))
+
+    # Finest tile first, then wrap it in ever coarser parents
+    root = tiles3d.tile(volume, 0.0, content_uri=glb_path.name)
+    for filename, _, level_error in levels:
+        # Cesium refines a tile while its screen-space error is too large, so
+        # each parent's error must cover everything its children add back
+        root = tiles3d.tile(volume, max(level_error, 1e-3), content_uri=filename,
+                            children=[root], refine="REPLACE")
+    root_error = max(levels[-1][2] * 2, tiles3d.diagonal(lower, upper) / 10)
+
+    tileset_path = output_dir / f"{name}.json"
+    tiles3d.write_tileset(tileset_path, root, geometric_error=root_error)
+    return {
+        "tileset": tileset_path.name,
+        "levels": [{"file": glb_path.name, "triangles": full_triangles, "geometric_error": 0.0}] + [
+            {"file": filename, "triangles": triangles, "geometric_error": level_error}
+            for filename, triangles, level_error in levels
+        ],
+    }
@@ -6,11 +6,12 @@ FastAPI server for MyEarth:
 - Replaces old Flask + custom HTTP server setup
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer
+from fastapi.concurrency import run_in_threadpool
 import psycopg2
 import os
 import shutil
@@ -18,11 +19,15 @@ from pathlib import Path
 import subprocess
 import tempfile
 import mimetypes
-import time
+import glob
 import json
+import re
+import asyncio
+import base64
 import requests
 import zipfile
-from typing import Optional
+from urllib.parse import quote
+from typing import Dict, Optional
 
 # --------------------
 # Import our modules
@@ -30,6 +35,22 @@ from typing import Optional
 from auth import get_current_active_user, get_db, create_access_token, verify_google_token, verify_github_token, verify_linkedin_token, get_or_create_user
 from layer_api import router as layer_router
 from models import User, Layer, LayerRating, LayerCategory, License
+from storage import StoredBlob, UploadTooLarge, store_stream, store_async_stream, link_blob, load_result, save_result
+from jobs import Job, job_queue, run_blocking
+from blender_pool import blender_pool
+from mesh_converter import NATIVE_MESH_FORMATS, convert_mesh_to_glb, is_mesh_ply
+from glb_optimizer import optimize_glb
+from lod import generate_lod_tileset
+from pointcloud import tile_las
+from splats import tile_splats
+from citygml import convert_citygml
+from kml import convert_kml
+from archives import Archive, plan_assets
+from validation import InvalidUpload, validate_upload
+from resumable import ResumableUploads, UploadConflict
+from bundles import BUNDLE_NAME, bundled_index, current_bundled_index
+from http_files import AssetCache, PrecompressedStaticFiles, precompress_tree, serve_file
+from tilesets import CONTAINER_SUFFIX, ROOT_TILESET, open_container, publish_tileset_directory, resolve_path, serve_container_entry
 
 # --------------------
 # Database configuration
@@ -215,11 +236,39 @@ for _s in _candidate_static_dirs:
         STATIC_DIR = _s.resolve()
         break
 
+# Scripts and styles served from the UI root by their own routes below
+UI_ASSET_FILES = ["CesiumModelImporter.js", "CesiumGizmo.js", "printService.js", "printStyles.css",
+                  "PrintOverlay.js", "printOverlayStyles.css"]
+
 INDEX_FILE = (UI_DIR / "index.html") if (UI_DIR / "index.html").exists() else None
 VERSION_FILE = (BASE_DIR / "version.json").resolve()
 
+# index.html, version.json and the root scripts are served from memory
+asset_cache = AssetCache()
+
+# Serve index.html with its inline and linked scripts/styles as content-hashed,
+# immutable bundles (built by bundles.py at startup or whenever a source changes)
+BUNDLE_FRONTEND = os.getenv("BUNDLE_FRONTEND", "true").lower() == "true"
+BUNDLE_DIR = BASE_DIR / "bundles"
+
 if STATIC_DIR is not None:
-    app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+    app.mount("/static", PrecompressedStaticFiles(directory=str(STATIC_DIR)), name="static")
+
+@app.on_event("startup")
+async def precompress_ui_assets():
+    """Write brotli/gzip variants of the UI once, so requests never compress on the fly"""
+    async def run():
+        assets = [path for path in _index_candidate_paths() if path.exists()]
+        assets += [STATIC_DIR] if STATIC_DIR is not None else []
+        assets += [UI_DIR / name for name in UI_ASSET_FILES if (UI_DIR / name).exists()]
+        count = await run_in_threadpool(precompress_tree, assets)
+        print(f"✅ Precompressed UI assets: {count} variants written")
+        # Warm the in-memory cache so the first page load does not read from disk
+        index_path = await _index_to_serve()
+        for path in [index_path, VERSION_FILE] + [UI_DIR / name for name in UI_ASSET_FILES]:
+            if path is not None and path.exists():
+                await asset_cache.get(path)
+    asyncio.create_task(run())
 
 # Root route → serves index.html directly (with fallback response)
 from fastapi.responses import RedirectResponse
@@ -231,14 +280,18 @@ def _index_candidate_paths():
         (BASE_DIR / "MyEarth" / "MyEarth" / "index.html"),  # double-nested safety
     ]
 
-@app.get("/")
-def serve_index():
-    """Serve index.html with robust runtime fallbacks.
+# Candidate mtimes -> chosen index.html, so candidates are only re-read when one changes
+_index_choice = {}
 
-    Order:
-    1) Local candidate files
-    2) Remote fallback from GitHub raw (outer repo then nested UI)
-    """
+def _best_index_path() -> Optional[Path]:
+    """Best local index.html candidate, or None when there is no real HTML file"""
+    key = tuple(p.stat().st_mtime_ns if p.exists() else None for p in _index_candidate_paths())
+    if key not in _index_choice:
+        _index_choice.clear()
+        _index_choice[key] = _score_index_candidates()
+    return _index_choice[key]
+
+def _score_index_candidates() -> Optional[Path]:
     # Choose the best local candidate by content (prefer real HTML over tiny pointer files)
     best_path = None
     best_score = -1
@@ -259,9 +312,33 @@ def serve_index():
         if score > best_score:
             best_score = score
             best_path = path
+    return best_path.resolve() if best_path and best_score >= 0 else None
+
+async def _index_to_serve() -> Optional[Path]:
+    """Chosen index.html, or its bundled rewrite when BUNDLE_FRONTEND is on"""
+    best_path = _best_index_path()
+    if best_path and BUNDLE_FRONTEND:
+        # Checking the sources' mtimes is cheap; only a (re)build leaves the event loop
+        bundled = current_bundled_index(best_path)
+        if bundled:
+            return bundled
+        try:
+            return await run_in_threadpool(bundled_index, best_path, BUNDLE_DIR, UI_DIR, STATIC_DIR)
+        except Exception as e:
+            print(f"Frontend bundling failed, serving index.html as is: {e}")
+    return best_path
+
+@app.get("/")
+async def serve_index(request: Request):
+    """Serve index.html with robust runtime fallbacks.
 
-    if best_path and best_score >= 0:
-        return FileResponse(str(best_path.resolve()))
+    Order:
+    1) Local candidate files
+    2) Remote fallback from GitHub raw (outer repo then nested UI)
+    """
+    best_path = await _index_to_serve()
+    if best_path:
+        return await asset_cache.serve(request, best_path)
     # Remote fallback to ensure site stays up even if files missing locally
     try:
         # Try outer repo root index first
@@ -289,44 +366,49 @@ def debug_index():
         })
     return {"base_dir": str(BASE_DIR.resolve()), "candidates": data}
 
+@app.get("/bundles/{name}")
+async def serve_bundle(name: str, request: Request):
+    """Serve a content-hashed frontend bundle; its name changes whenever its content does"""
+    if not BUNDLE_NAME.match(name) or not (BUNDLE_DIR / name).is_file():
+        raise HTTPException(status_code=404, detail="Bundle not found")
+    return await serve_file(request, BUNDLE_DIR / name, immutable=True)
+
 # Serve gizmo JavaScript files
 @app.get("/CesiumModelImporter.js")
-async def serve_model_importer():
+async def serve_model_importer(request: Request):
     """Serve the CesiumModelImporter.js file"""
-    return FileResponse(str(UI_DIR / "CesiumModelImporter.js"))
+    return await asset_cache.serve(request, UI_DIR / "CesiumModelImporter.js")
 
 @app.get("/CesiumGizmo.js")
-async def serve_gizmo():
+async def serve_gizmo(request: Request):
     """Serve the CesiumGizmo.js file"""
-    return FileResponse(str(UI_DIR / "CesiumGizmo.js"))
+    return await asset_cache.serve(request, UI_DIR / "CesiumGizmo.js")
 
 @app.get("/printService.js")
-async def serve_print_service():
+async def serve_print_service(request: Request):
     """Serve the printService.js file"""
-    return FileResponse(str(UI_DIR / "printService.js"))
+    return await asset_cache.serve(request, UI_DIR / "printService.js")
 
 @app.get("/printStyles.css")
-async def serve_print_styles():
+async def serve_print_styles(request: Request):
     """Serve the printStyles.css file"""
-    return FileResponse(str(UI_DIR / "printStyles.css"))
+    return await asset_cache.serve(request, UI_DIR / "printStyles.css")
 
 @app.get("/PrintOverlay.js")
-async def serve_print_overlay():
+async def serve_print_overlay(request: Request):
     """Serve the PrintOverlay.js file"""
-    return FileResponse(str(UI_DIR / "PrintOverlay.js"))
+    return await asset_cache.serve(request, UI_DIR / "PrintOverlay.js")
 
 @app.get("/printOverlayStyles.css")
-async def serve_print_overlay_styles():
+async def serve_print_overlay_styles(request: Request):
     """Serve the printOverlayStyles.css file"""
-    return FileResponse(str(UI_DIR / "printOverlayStyles.css"))
+    return await asset_cache.serve(request, UI_DIR / "printOverlayStyles.css")
 
 @app.get("/version.json")
-async def serve_version():
+async def serve_version(request: Request):
     """Serve the version.json file with current build information"""
     try:
-        with open(str(VERSION_FILE), "r") as f:
-            version_data = json.load(f)
-        return JSONResponse(content=version_data)
+        return await asset_cache.serve(request, VERSION_FILE)
     except FileNotFoundError:
         # Fallback if version.json doesn't exist
         return JSONResponse(content={
@@ -444,6 +526,10 @@ async def test_wms():
 UPLOADS_DIR = Path("uploads")
 UPLOADS_DIR.mkdir(exist_ok=True)
 
+# Chunked uploads that survive dropped connections
+TUS_VERSION = "1.0.0"
+resumable_uploads = ResumableUploads(UPLOADS_DIR)
+
 # Universal 3D model format support
 UNIVERSAL_3D_FORMATS = {
     # Cesium 3D Tiles
@@ -452,6 +538,7 @@ UNIVERSAL_3D_FORMATS = {
     '.b3dm': 'application/octet-stream',  # Batched 3D model tiles
     '.i3dm': 'application/octet-stream',  # Instanced 3D model tiles
     '.pnts': 'application/octet-stream',  # Point cloud tiles
+    '.3tz': 'application/zip',  # Packed tileset (tileset.json and tiles in one zip)
     
     # glTF formats
     '.gltf': 'model/gltf+json',
@@ -500,16 +587,29 @@ UNIVERSAL_3D_FORMATS = {
     '.dwg': 'application/dwg',
 }
 
+# Archive members that are processed as models of their own (.gltf and tilesets are grouped with their files)
+ARCHIVE_MODEL_FORMATS = [
+    ext for ext, mime in UNIVERSAL_3D_FORMATS.items()
+    if ext not in ['.zip', '.7z', '.rar', '.json', '.gltf'] and not mime.startswith('image/')
+]
+
 # Cesium ion configuration (you'll need to set these as environment variables)
 CESIUM_ION_ACCESS_TOKEN = os.getenv("CESIUM_ION_ACCESS_TOKEN", "")
 CESIUM_ION_API_URL = "https://api.cesium.com/v1"
 
-@app.post("/api/upload-model")
-async def upload_model(file: UploadFile = File(...)):
-    """Universal 3D model upload with Cesium ion integration and multi-format support"""
-    
+# Rewrite GLBs (quantization, reordering, dedup) before serving them
+OPTIMIZE_GLB = os.getenv("OPTIMIZE_GLB", "true").lower() == "true"
+
+# Package large meshes as a 3D Tiles LOD chain (thresholds live in lod.py)
+GENERATE_LOD = os.getenv("GENERATE_LOD", "true").lower() == "true"
+
+# Largest model upload accepted (increased to 500MB for large models)
+MAX_UPLOAD_BYTES = 500 * 1024 * 1024
+
+def check_upload(filename: str, size: Optional[int]) -> str:
+    """Check a model upload's format and size up front; returns its extension"""
     # Get file extension
-    file_ext = Path(file.filename).suffix.lower()
+    file_ext = Path(filename).suffix.lower()
     
     # Check if format is supported
     if file_ext not in UNIVERSAL_3D_FORMATS:
@@ -518,87 +618,295 @@ async def upload_model(file: UploadFile = File(...)):
             detail=f"Unsupported format: {file_ext}. Supported formats: {', '.join(list(UNIVERSAL_3D_FORMATS.keys())[:10])}... and more"
         )
     
-    # Check file size (increased to 500MB for large models)
-    if file.size > 500 * 1024 * 1024:  # 500MB
+    # Check file size
+    if size is not None and size > MAX_UPLOAD_BYTES:
         raise HTTPException(status_code=400, detail="File too large. Maximum size: 500MB")
+    return file_ext
+
+@app.post("/api/upload-model")
+async def upload_model(file: UploadFile = File(...)):
+    """Universal 3D model upload with Cesium ion integration and multi-format support"""
+    
+    file_ext = check_upload(file.filename, file.size)
     
+    # Reject files that are not what their extension claims before storing anything
     try:
-        # Save original file
-        original_filename = f"original_{int(time.time())}_{file.filename}"
-        original_path = UPLOADS_DIR / original_filename
-        
-        with open(original_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Determine processing strategy based on file type
-        processing_result = await process_3d_model(original_path, file_ext, file.filename)
-        
-        return JSONResponse({
-            "success": True,
-            "filename": processing_result["filename"],
-            "url": processing_result["url"],
-            "size": processing_result["size"],
-            "original_format": file_ext,
-            "processing_type": processing_result["processing_type"],
-            "cesium_ion_asset_id": processing_result.get("cesium_ion_asset_id"),
-            "message": processing_result["message"]
-        })
-        
+        await run_in_threadpool(validate_upload, file.file, file_ext)
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {file_ext} file: {e}")
+    
+    try:
+        # Hash the upload while it streams to disk; identical files are stored once
+        blob = await run_in_threadpool(store_stream, file.file, UPLOADS_DIR, file_ext)
+        return JSONResponse(queue_upload(blob, file.filename, file_ext))
     except Exception as e:
-        # Clean up on error
-        if original_path and original_path.exists():
-            original_path.unlink()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-async def process_3d_model(file_path: Path, file_ext: str, original_filename: str) -> dict:
-    """Process 3D model based on format type"""
+@app.put("/api/upload-model/{filename}")
+async def upload_model_raw(filename: str, request: Request):
+    """Upload a model as the raw request body (no multipart): hashed and written in one pass"""
+    content_length = request.headers.get("Content-Length")
+    file_ext = check_upload(filename, int(content_length) if content_length and content_length.isdigit() else None)
+    
+    try:
+        # The limit is enforced while streaming, so oversized bodies are cut off early
+        blob = await store_async_stream(request.stream(), UPLOADS_DIR, file_ext, max_bytes=MAX_UPLOAD_BYTES,
+                                        validate=lambda f: validate_upload(f, file_ext))
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large. Maximum size: 500MB")
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=f"Invalid {file_ext} file: {e}")
+    return JSONResponse(queue_upload(blob, Path(filename).name, file_ext))
+
+# --------------------
+# Resumable uploads (tus-style: create, append at offset, query offset, finish)
+# --------------------
+@app.post("/api/uploads")
+async def create_resumable_upload(request: Request):
+    """Start a resumable upload; headers: Upload-Length and X-Filename (or tus Upload-Metadata)"""
+    filename = request.headers.get("X-Filename") or _tus_metadata(request.headers.get("Upload-Metadata", "")).get("filename")
+    if not filename:
+        raise HTTPException(status_code=400, detail="Missing filename")
+    try:
+        length = int(request.headers["Upload-Length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Length")
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="File is empty")
+    check_upload(filename, length)
+    
+    upload = resumable_uploads.create(Path(filename).name, length)
+    upload_url = f"/api/uploads/{upload.id}"
+    return JSONResponse(
+        {"upload_id": upload.id, "upload_url": upload_url, "offset": 0, "length": length},
+        status_code=201,
+        headers={"Location": upload_url, "Upload-Offset": "0", "Tus-Resumable": TUS_VERSION},
+    )
+
+@app.head("/api/uploads/{upload_id}")
+async def resumable_upload_offset(upload_id: str):
+    """Report how many bytes of an upload have arrived"""
+    upload = _get_resumable_upload(upload_id)
+    return Response(headers={
+        "Upload-Offset": str(resumable_uploads.offset(upload)),
+        "Upload-Length": str(upload.length),
+        "Cache-Control": "no-store",
+        "Tus-Resumable": TUS_VERSION,
+    })
+
+@app.patch("/api/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request):
+    """Append the request body at the Upload-Offset header"""
+    upload = _get_resumable_upload(upload_id)
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Offset")
+    
+    lock = resumable_uploads.lock(upload)
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Another chunk of this upload is in progress")
+    async with lock:
+        try:
+            new_offset = await resumable_uploads.append(upload, offset, request.stream())
+        except UploadConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return Response(status_code=204, headers={"Upload-Offset": str(new_offset), "Tus-Resumable": TUS_VERSION})
+
+@app.post("/api/uploads/{upload_id}/finish")
+async def finish_resumable_upload(upload_id: str):
+    """Validate a complete upload, move it into the store and queue its conversion"""
+    upload = _get_resumable_upload(upload_id)
+    file_ext = Path(upload.filename).suffix.lower()
+    async with resumable_uploads.lock(upload):
+        if resumable_uploads.offset(upload) != upload.length:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete: {resumable_uploads.offset(upload)} of {upload.length} bytes")
+        try:
+            with open(upload.data_path(resumable_uploads.root), "rb") as f:
+                await run_in_threadpool(validate_upload, f, file_ext)
+        except InvalidUpload as e:
+            resumable_uploads.delete(upload)
+            raise HTTPException(status_code=400, detail=f"Invalid {file_ext} file: {e}")
+        blob = await run_in_threadpool(resumable_uploads.finish, upload, file_ext)
+    return JSONResponse(queue_upload(blob, upload.filename, file_ext))
+
+@app.delete("/api/uploads/{upload_id}")
+async def cancel_resumable_upload(upload_id: str):
+    """Abandon an upload and delete its data"""
+    resumable_uploads.delete(_get_resumable_upload(upload_id))
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
+def _get_resumable_upload(upload_id: str):
+    upload = resumable_uploads.get(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+def _tus_metadata(header: str) -> dict:
+    """Decode a tus Upload-Metadata header ("key base64value, ...")"""
+    metadata = {}
+    for pair in header.split(","):
+        parts = pair.strip().split(" ", 1)
+        if parts[0]:
+            try:
+                metadata[parts[0]] = base64.b64decode(parts[1]).decode("utf-8") if len(parts) > 1 else ""
+            except (ValueError, UnicodeDecodeError):
+                continue
+    return metadata
+
+# Hex digits of the upload's SHA-256 in output names
+OUTPUT_DIGEST_LENGTH = 16
+
+def output_name(kind: str, digest: str, name: str) -> str:
+    """Name of a file produced from an upload ("gltf_<digest>_model.glb").
+
+    The upload's content digest makes the name unique to its bytes, so
+    concurrent jobs never share paths and the file can be cached as immutable.
+    """
+    return f"{kind}_{digest[:OUTPUT_DIGEST_LENGTH]}_{name}"
+
+# Upload digest -> job converting it; equal uploads in flight share one job (and its output names)
+converting_jobs: Dict[str, Job] = {}
+
+def queue_upload(blob: StoredBlob, filename: str, file_ext: str) -> dict:
+    """Start (or reuse) processing of a stored upload; returns the upload response body"""
+    # Repeat upload of an already processed file: reuse the earlier result
+    cached_result = load_result(UPLOADS_DIR, blob.digest)
+    job = converting_jobs.get(blob.digest)
+    deduplicated = cached_result is not None or job is not None
+
+    if cached_result is not None:
+        job = job_queue.completed(filename, _upload_result(cached_result, file_ext))
+    elif job is None:
+        # Give the handlers their own cheap reference to the stored blob
+        original_path = link_blob(blob.path, UPLOADS_DIR / output_name("original", blob.digest, filename))
+
+        async def convert(path=original_path, filename=filename, digest=blob.digest):
+            try:
+                # Determine processing strategy based on file type
+                processing_result = await process_3d_model(path, file_ext, filename, digest)
+                await run_blocking(precompress_outputs, processing_result)
+                save_result(UPLOADS_DIR, digest, processing_result)
+                return _upload_result(processing_result, file_ext)
+            finally:
+                converting_jobs.pop(digest, None)
+
+        def cleanup(path=original_path):
+            if path.exists():
+                path.unlink()
+
+        # Conversion runs in the background; the client polls /api/jobs/{job_id}
+        job = job_queue.submit(filename, convert, on_error=cleanup)
+        converting_jobs[blob.digest] = job
+
+    response = {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "original_format": file_ext,
+        "sha256": blob.digest,
+        "deduplicated": deduplicated,
+    }
+    if job.result:
+        response.update(job.result)
+    return response
+
+def precompress_outputs(processing_result: dict) -> int:
+    """Write brotli/gzip variants of a result's text files (tilesets, glTF, GeoJSON tiles)"""
+    paths = []
+    for result in processing_result.get("models") or [processing_result]:
+        filename = result["filename"]
+        if "/" in filename:
+            # Extracted archive directory
+            paths.append(UPLOADS_DIR / filename.split("/", 1)[0])
+        else:
+            # Converters name every file of an output after it ({name}.json, {name}_r0.geojson, ...)
+            paths.extend(UPLOADS_DIR.glob(f"{glob.escape(Path(filename).stem)}*"))
+    return precompress_tree(paths)
+
+def _upload_result(processing_result: dict, file_ext: str) -> dict:
+    """Shape a processing result the way upload clients expect it"""
+    return {
+        "filename": processing_result["filename"],
+        "url": processing_result["url"],
+        "size": processing_result["size"],
+        "original_format": file_ext,
+        "processing_type": processing_result["processing_type"],
+        "cesium_ion_asset_id": processing_result.get("cesium_ion_asset_id"),
+        "optimization": processing_result.get("optimization"),
+        "lod": processing_result.get("lod"),
+        "models": processing_result.get("models"),
+        "message": processing_result["message"]
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Report the state of a background conversion job (queued, running, done or failed)"""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+async def process_3d_model(file_path: Path, file_ext: str, original_filename: str, digest: str) -> dict:
+    """Process 3D model based on format type; digest (of the upload) names the outputs"""
     
     # Strategy 1: Cesium 3D Tiles (direct support)
-    if file_ext in ['.json', '.cmpt', '.b3dm', '.i3dm', '.pnts']:
-        return await handle_3d_tiles(file_path, original_filename)
+    if file_ext in ['.json', '.cmpt', '.b3dm', '.i3dm', '.pnts', '.3tz']:
+        return await handle_3d_tiles(file_path, original_filename, digest)
     
     # Strategy 2: glTF formats (direct CesiumJS support)
     elif file_ext in ['.gltf', '.glb']:
-        return await handle_gltf(file_path, original_filename)
+        return await handle_gltf(file_path, original_filename, digest)
     
     # Strategy 3: Point clouds (LAS/LAZ)
     elif file_ext in ['.las', '.laz']:
-        return await handle_point_cloud(file_path, original_filename)
+        return await handle_point_cloud(file_path, original_filename, digest)
     
-    # Strategy 4: Gaussian Splatting
-    elif file_ext in ['.splat', '.ply']:
-        return await handle_gaussian_splats(file_path, original_filename)
+    # Strategy 4: Gaussian Splatting (PLY files with faces are ordinary meshes)
+    elif file_ext == '.splat' or (file_ext == '.ply' and not is_mesh_ply(file_path)):
+        return await handle_gaussian_splats(file_path, original_filename, digest)
     
     # Strategy 5: Traditional 3D formats (convert to glTF)
     elif file_ext in ['.obj', '.fbx', '.dae', '.3ds', '.stl', '.ply']:
-        return await handle_traditional_3d(file_path, original_filename)
+        return await handle_traditional_3d(file_path, original_filename, digest)
     
     # Strategy 6: Geospatial formats
     elif file_ext in ['.kml', '.kmz', '.citygml', '.gml']:
-        return await handle_geospatial(file_path, original_filename)
+        return await handle_geospatial(file_path, original_filename, digest)
     
     # Strategy 7: Archive formats
     elif file_ext in ['.zip', '.7z', '.rar']:
-        return await handle_archive(file_path, original_filename)
+        return await handle_archive(file_path, original_filename, digest)
     
     # Strategy 8: Image formats (photogrammetry)
     elif file_ext in ['.jpg', '.jpeg', '.png', '.tiff', '.tif']:
-        return await handle_photogrammetry(file_path, original_filename)
+        return await handle_photogrammetry(file_path, original_filename, digest)
     
     # Strategy 9: BIM formats
     elif file_ext in ['.ifc', '.rvt', '.dwg']:
-        return await handle_bim(file_path, original_filename)
+        return await handle_bim(file_path, original_filename, digest)
     
     # Fallback: Try Cesium ion conversion
     else:
-        return await handle_cesium_ion_conversion(file_path, original_filename)
+        return await handle_cesium_ion_conversion(file_path, original_filename, digest)
 
-async def handle_3d_tiles(file_path: Path, original_filename: str) -> dict:
+async def handle_3d_tiles(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle Cesium 3D Tiles formats"""
-    filename = f"3dtiles_{int(time.time())}_{original_filename}"
+    filename = output_name("3dtiles", digest, original_filename)
     new_path = UPLOADS_DIR / filename
     shutil.move(str(file_path), str(new_path))
     
+    if new_path.suffix.lower() == CONTAINER_SUFFIX:
+        # Tiles are read out of the container by the tileset route, never extracted
+        return {
+            "filename": filename,
+            "url": f"/tilesets/{quote(filename)}/{ROOT_TILESET}",
+            "size": new_path.stat().st_size,
+            "processing_type": "3d_tiles",
+            "message": "Packed 3D Tiles ready for CesiumJS"
+        }
+    
     return {
         "filename": filename,
         "url": f"/uploads/{filename}",
@@ -607,27 +915,34 @@ async def handle_3d_tiles(file_path: Path, original_filename: str) -> dict:
         "message": "3D Tiles file ready for CesiumJS"
     }
 
-async def handle_gltf(file_path: Path, original_filename: str) -> dict:
+async def handle_gltf(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle glTF formats"""
-    filename = f"gltf_{int(time.time())}_{original_filename}"
+    filename = output_name("gltf", digest, original_filename)
     new_path = UPLOADS_DIR / filename
     shutil.move(str(file_path), str(new_path))
+    lod = await build_lod_tileset(new_path)
+    optimization = await optimize_model(new_path)
+    if lod:
+        return lod_result(lod, optimization, "glTF model")
     
     return {
         "filename": filename,
         "url": f"/uploads/{filename}",
         "size": new_path.stat().st_size,
         "processing_type": "gltf",
+        "optimization": optimization,
         "message": "glTF file ready for CesiumJS"
     }
 
-async def handle_point_cloud(file_path: Path, original_filename: str) -> dict:
+async def handle_point_cloud(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle point cloud formats (LAS/LAZ)"""
     try:
-        # Try to convert to 3D Tiles using PotreeConverter
-        if await convert_point_cloud_to_3dtiles(file_path):
-            filename = f"pointcloud_{int(time.time())}_{Path(original_filename).stem}.json"
+        # Try to convert to 3D Tiles (built-in LAS tiler, then PotreeConverter)
+        name = output_name("pointcloud", digest, Path(original_filename).stem)
+        if await convert_point_cloud_to_3dtiles(file_path, name):
+            filename = f"{name}.json"
             tileset_path = UPLOADS_DIR / filename
+            file_path.unlink()
             
             return {
                 "filename": filename,
@@ -638,7 +953,7 @@ async def handle_point_cloud(file_path: Path, original_filename: str) -> dict:
             }
         else:
             # Fallback: serve original file
-            filename = f"pointcloud_{int(time.time())}_{original_filename}"
+            filename = output_name("pointcloud", digest, original_filename)
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -652,7 +967,7 @@ async def handle_point_cloud(file_path: Path, original_filename: str) -> dict:
     except Exception as e:
         print(f"Point cloud processing error: {e}")
         # Fallback to original file
-        filename = f"pointcloud_{int(time.time())}_{original_filename}"
+        filename = output_name("pointcloud", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -664,13 +979,15 @@ async def handle_point_cloud(file_path: Path, original_filename: str) -> dict:
             "message": "Point cloud file (processing failed)"
         }
 
-async def handle_gaussian_splats(file_path: Path, original_filename: str) -> dict:
+async def handle_gaussian_splats(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle Gaussian Splatting formats"""
     try:
         # Try to convert to 3D Tiles with splat support
-        if await convert_splats_to_3dtiles(file_path):
-            filename = f"splats_{int(time.time())}_{Path(original_filename).stem}.json"
+        name = output_name("splats", digest, Path(original_filename).stem)
+        if await convert_splats_to_3dtiles(file_path, name):
+            filename = f"{name}.json"
             tileset_path = UPLOADS_DIR / filename
+            file_path.unlink()
             
             return {
                 "filename": filename,
@@ -681,7 +998,7 @@ async def handle_gaussian_splats(file_path: Path, original_filename: str) -> dic
             }
         else:
             # Fallback: serve original file
-            filename = f"splats_{int(time.time())}_{original_filename}"
+            filename = output_name("splats", digest, original_filename)
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -695,7 +1012,7 @@ async def handle_gaussian_splats(file_path: Path, original_filename: str) -> dic
     except Exception as e:
         print(f"Gaussian splats processing error: {e}")
         # Fallback to original file
-        filename = f"splats_{int(time.time())}_{original_filename}"
+        filename = output_name("splats", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -707,29 +1024,34 @@ async def handle_gaussian_splats(file_path: Path, original_filename: str) -> dic
             "message": "Gaussian splats file (processing failed)"
         }
 
-async def handle_traditional_3d(file_path: Path, original_filename: str) -> dict:
+async def handle_traditional_3d(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle traditional 3D formats by converting to glTF"""
     try:
         # Try conversion to glTF
         gltf_path = await convert_to_gltf(file_path)
         if gltf_path and gltf_path.exists():
-            filename = f"converted_{int(time.time())}_{Path(original_filename).stem}.glb"
+            filename = output_name("converted", digest, f"{Path(original_filename).stem}.glb")
             new_path = UPLOADS_DIR / filename
             shutil.move(str(gltf_path), str(new_path))
+            lod = await build_lod_tileset(new_path)
+            optimization = await optimize_model(new_path)
             
             # Clean up original
             file_path.unlink()
+            if lod:
+                return lod_result(lod, optimization, f"Converted {Path(original_filename).suffix} model")
             
             return {
                 "filename": filename,
                 "url": f"/uploads/{filename}",
                 "size": new_path.stat().st_size,
                 "processing_type": "converted_gltf",
+                "optimization": optimization,
                 "message": f"Converted {Path(original_filename).suffix} to GLB"
             }
         else:
             # Fallback: serve original file
-            filename = f"traditional_{int(time.time())}_{original_filename}"
+            filename = output_name("traditional", digest, original_filename)
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -743,7 +1065,7 @@ async def handle_traditional_3d(file_path: Path, original_filename: str) -> dict
     except Exception as e:
         print(f"Traditional 3D conversion error: {e}")
         # Fallback to original file
-        filename = f"traditional_{int(time.time())}_{original_filename}"
+        filename = output_name("traditional", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -755,13 +1077,27 @@ async def handle_traditional_3d(file_path: Path, original_filename: str) -> dict
             "message": f"Original {Path(original_filename).suffix} file (conversion failed)"
         }
 
-async def handle_geospatial(file_path: Path, original_filename: str) -> dict:
+async def handle_geospatial(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle geospatial formats"""
     try:
         # Try to convert to 3D Tiles
-        if await convert_geospatial_to_3dtiles(file_path):
-            filename = f"geospatial_{int(time.time())}_{Path(original_filename).stem}.json"
+        name = output_name("geospatial", digest, Path(original_filename).stem)
+        if file_path.suffix.lower() in ['.kml', '.kmz'] and await convert_kml_to_geojson_tiles(file_path, name):
+            filename = f"{name}.json"
+            index_path = UPLOADS_DIR / filename
+            file_path.unlink()
+            
+            return {
+                "filename": filename,
+                "url": f"/uploads/{filename}",
+                "size": index_path.stat().st_size,
+                "processing_type": "geospatial_geojson_tiles",
+                "message": "KML converted to tiled GeoJSON"
+            }
+        elif await convert_geospatial_to_3dtiles(file_path, name):
+            filename = f"{name}.json"
             tileset_path = UPLOADS_DIR / filename
+            file_path.unlink()
             
             return {
                 "filename": filename,
@@ -772,7 +1108,7 @@ async def handle_geospatial(file_path: Path, original_filename: str) -> dict:
             }
         else:
             # Fallback: serve original file
-            filename = f"geospatial_{int(time.time())}_{original_filename}"
+            filename = output_name("geospatial", digest, original_filename)
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -786,7 +1122,7 @@ async def handle_geospatial(file_path: Path, original_filename: str) -> dict:
     except Exception as e:
         print(f"Geospatial processing error: {e}")
         # Fallback to original file
-        filename = f"geospatial_{int(time.time())}_{original_filename}"
+        filename = output_name("geospatial", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -798,57 +1134,59 @@ async def handle_geospatial(file_path: Path, original_filename: str) -> dict:
             "message": "Geospatial file (processing failed)"
         }
 
-async def handle_archive(file_path: Path, original_filename: str) -> dict:
-    """Handle archive formats by extracting and processing contents"""
+async def handle_archive(file_path: Path, original_filename: str, digest: str) -> dict:
+    """Handle archive formats: extract only the members that form models and process them all"""
     try:
-        # Extract archive
-        extract_dir = UPLOADS_DIR / f"extracted_{int(time.time())}_{Path(original_filename).stem}"
-        extract_dir.mkdir(exist_ok=True)
+        name = output_name("archive", digest, Path(original_filename).stem)
+        archive_dir = UPLOADS_DIR / name
+        assets = await run_blocking(plan_archive, file_path, archive_dir)
         
-        if file_path.suffix.lower() == '.zip':
-            with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
+        if assets:
+            work_dir = archive_dir / ".work"
+            try:
+                # Every model converts at the same time; the job pools bound the actual work
+                results = await asyncio.gather(*(
+                    process_archive_asset(asset, archive_dir, work_dir, index, digest)
+                    for index, asset in enumerate(assets)
+                ), return_exceptions=True)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            
+            models = []
+            for asset, result in zip(assets, results):
+                if isinstance(result, Exception):
+                    print(f"Archive member {asset.entry} failed: {result}")
+                else:
+                    models.append(result)
+            if models:
+                file_path.unlink()
+                if len(models) == 1:
+                    return {**models[0], "message": f"{models[0]['message']} (from archive)"}
+                return {
+                    **models[0],
+                    "size": sum(model["size"] for model in models),
+                    "processing_type": "archive_models",
+                    "models": models,
+                    "message": f"Extracted {len(models)} models from archive"
+                }
         
-        # Find main files in extracted directory
-        main_files = []
-        for ext in ['.gltf', '.glb', '.obj', '.fbx', '.dae', '.json', '.cmpt', '.b3dm']:
-            main_files.extend(extract_dir.glob(f"**/*{ext}"))
+        # No models found, serve as-is
+        shutil.rmtree(archive_dir, ignore_errors=True)
+        filename = output_name("archive", digest, original_filename)
+        new_path = UPLOADS_DIR / filename
+        shutil.move(str(file_path), str(new_path))
         
-        if main_files:
-            # Use the first main file found
-            main_file = main_files[0]
-            filename = f"archive_{int(time.time())}_{main_file.name}"
-            new_path = UPLOADS_DIR / filename
-            shutil.move(str(main_file), str(new_path))
-            
-            # Clean up
-            shutil.rmtree(extract_dir)
-            file_path.unlink()
-            
-            return {
-                "filename": filename,
-                "url": f"/uploads/{filename}",
-                "size": new_path.stat().st_size,
-                "processing_type": "archive_extracted",
-                "message": f"Extracted {main_file.name} from archive"
-            }
-        else:
-            # No main files found, serve as-is
-            filename = f"archive_{int(time.time())}_{original_filename}"
-            new_path = UPLOADS_DIR / filename
-            shutil.move(str(file_path), str(new_path))
-            
-            return {
-                "filename": filename,
-                "url": f"/uploads/{filename}",
-                "size": new_path.stat().st_size,
-                "processing_type": "archive_raw",
-                "message": "Archive file (no supported formats found inside)"
-            }
+        return {
+            "filename": filename,
+            "url": f"/uploads/{filename}",
+            "size": new_path.stat().st_size,
+            "processing_type": "archive_raw",
+            "message": "Archive file (no supported formats found inside)"
+        }
     except Exception as e:
         print(f"Archive processing error: {e}")
         # Fallback to original file
-        filename = f"archive_{int(time.time())}_{original_filename}"
+        filename = output_name("archive", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -860,11 +1198,44 @@ async def handle_archive(file_path: Path, original_filename: str) -> dict:
             "message": "Archive file (extraction failed)"
         }
 
-async def handle_photogrammetry(file_path: Path, original_filename: str) -> dict:
+def plan_archive(archive_path: Path, archive_dir: Path) -> list:
+    """Read the archive directory and extract only the members its models need.
+
+    Tilesets and glTF files keep their directory layout under archive_dir;
+    standalone models go to archive_dir/.work for the regular handlers.
+    """
+    with Archive(archive_path) as archive:
+        assets = plan_assets(archive, ARCHIVE_MODEL_FORMATS)
+        grouped = [m for asset in assets if asset.kind != "model" for m in asset.members]
+        standalone = [asset.entry for asset in assets if asset.kind == "model"]
+        archive.extract(grouped + standalone, archive_dir / ".work")
+        for member in grouped:
+            target = archive_dir / member
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(archive_dir / ".work" / member, target)
+    return assets
+
+async def process_archive_asset(asset, archive_dir: Path, work_dir: Path, index: int, digest: str) -> dict:
+    """Processing result for one asset extracted from an archive"""
+    if asset.kind == "model":
+        member_path = work_dir / asset.entry
+        # The index keeps same-named members in different folders apart
+        return await process_3d_model(member_path, member_path.suffix.lower(), f"{index}_{member_path.name}", digest)
+    
+    filename = f"{archive_dir.name}/{asset.entry}"
+    return {
+        "filename": filename,
+        "url": f"/tilesets/{quote(filename)}" if asset.kind == "tileset" else f"/uploads/{quote(filename)}",
+        "size": sum((archive_dir / member).stat().st_size for member in asset.members),
+        "processing_type": "3d_tiles" if asset.kind == "tileset" else "gltf",
+        "message": f"{asset.entry} extracted with {len(asset.members) - 1} related files"
+    }
+
+async def handle_photogrammetry(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle image formats for photogrammetry"""
     try:
         # For now, serve as-is (would need photogrammetry processing)
-        filename = f"photogrammetry_{int(time.time())}_{original_filename}"
+        filename = output_name("photogrammetry", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -878,7 +1249,7 @@ async def handle_photogrammetry(file_path: Path, original_filename: str) -> dict
     except Exception as e:
         print(f"Photogrammetry processing error: {e}")
         # Fallback to original file
-        filename = f"photogrammetry_{int(time.time())}_{original_filename}"
+        filename = output_name("photogrammetry", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -890,12 +1261,12 @@ async def handle_photogrammetry(file_path: Path, original_filename: str) -> dict
             "message": "Image file (processing failed)"
         }
 
-async def handle_bim(file_path: Path, original_filename: str) -> dict:
+async def handle_bim(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle BIM formats"""
     try:
         # Try to convert to glTF using IFC.js or similar
         if await convert_bim_to_gltf(file_path):
-            filename = f"bim_{int(time.time())}_{Path(original_filename).stem}.glb"
+            filename = output_name("bim", digest, f"{Path(original_filename).stem}.glb")
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -908,7 +1279,7 @@ async def handle_bim(file_path: Path, original_filename: str) -> dict:
             }
         else:
             # Fallback: serve original file
-            filename = f"bim_{int(time.time())}_{original_filename}"
+            filename = output_name("bim", digest, original_filename)
             new_path = UPLOADS_DIR / filename
             shutil.move(str(file_path), str(new_path))
             
@@ -922,7 +1293,7 @@ async def handle_bim(file_path: Path, original_filename: str) -> dict:
     except Exception as e:
         print(f"BIM processing error: {e}")
         # Fallback to original file
-        filename = f"bim_{int(time.time())}_{original_filename}"
+        filename = output_name("bim", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -934,11 +1305,11 @@ async def handle_bim(file_path: Path, original_filename: str) -> dict:
             "message": f"BIM file (processing failed)"
         }
 
-async def handle_cesium_ion_conversion(file_path: Path, original_filename: str) -> dict:
+async def handle_cesium_ion_conversion(file_path: Path, original_filename: str, digest: str) -> dict:
     """Handle unknown formats by uploading to Cesium ion for conversion"""
     if not CESIUM_ION_ACCESS_TOKEN:
         # No Cesium ion token, serve as-is
-        filename = f"unknown_{int(time.time())}_{original_filename}"
+        filename = output_name("unknown", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -965,7 +1336,7 @@ async def handle_cesium_ion_conversion(file_path: Path, original_filename: str)
     except Exception as e:
         print(f"Cesium ion upload error: {e}")
         # Fallback to original file
-        filename = f"unknown_{int(time.time())}_{original_filename}"
+        filename = output_name("unknown", digest, original_filename)
         new_path = UPLOADS_DIR / filename
         shutil.move(str(file_path), str(new_path))
         
@@ -978,126 +1349,141 @@ async def handle_cesium_ion_conversion(file_path: Path, original_filename: str)
         }
 
 # Conversion helper functions
+async def optimize_model(glb_path: Path) -> Optional[dict]:
+    """Optimize a GLB in place; returns before/after size and triangle counts"""
+    if not OPTIMIZE_GLB or glb_path.suffix.lower() != '.glb':
+        return None
+    optimized_path = glb_path.with_name(f"optimizing_{glb_path.name}")
+    try:
+        stats = await run_blocking(optimize_glb, glb_path, optimized_path)
+        if stats is None:
+            return None
+        # Tiny models can grow from quantization padding; keep whichever is smaller
+        stats["applied"] = stats["optimized_size"] < stats["original_size"]
+        if stats["applied"]:
+            # Replace the directory entry; the content-addressed original stays intact
+            os.replace(optimized_path, glb_path)
+        return stats
+    except Exception as e:
+        print(f"GLB optimization failed: {e}")
+        return None
+    finally:
+        if optimized_path.exists():
+            optimized_path.unlink()
+
+async def build_lod_tileset(glb_path: Path) -> Optional[dict]:
+    """Generate simplified levels of a large GLB and a tileset that refines between them"""
+    if not GENERATE_LOD or glb_path.suffix.lower() != '.glb':
+        return None
+    try:
+        lod = await run_blocking(generate_lod_tileset, glb_path, UPLOADS_DIR, f"lod_{glb_path.stem}")
+        if lod:
+            print(f"✅ LOD tileset: {[level['triangles'] for level in lod['levels']]} triangles")
+        return lod
+    except Exception as e:
+        print(f"LOD generation failed: {e}")
+        return None
+
+def lod_result(lod: dict, optimization: Optional[dict], description: str) -> dict:
+    """Processing result pointing clients at an LOD tileset"""
+    tileset_path = UPLOADS_DIR / lod["tileset"]
+    return {
+        "filename": lod["tileset"],
+        "url": f"/uploads/{lod['tileset']}",
+        "size": sum((UPLOADS_DIR / level["file"]).stat().st_size for level in lod["levels"]) + tileset_path.stat().st_size,
+        "processing_type": "gltf_lod_3dtiles",
+        "optimization": optimization,
+        "lod": lod,
+        "message": f"{description} packaged as a {len(lod['levels'])}-level 3D Tiles LOD chain"
+    }
+
 async def convert_to_gltf(input_path: Path) -> Path:
-    """Convert various formats to glTF using Blender"""
+    """Convert various formats to glTF (native for OBJ/STL/PLY, Blender for the rest)"""
     try:
         output_path = input_path.with_suffix('.glb')
-        
-        # Create Blender conversion script
-        blender_script = f"""
-import bpy
-import sys
-
-# Clear scene
-bpy.ops.object.select_all(action='SELECT')
-bpy.ops.object.delete(use_global=False)
-
-# Import the model
-filepath = r"{input_path.absolute()}"
-file_ext = "{input_path.suffix.lower()}"
-
-if file_ext == '.obj':
-    bpy.ops.import_scene.obj(filepath=filepath)
-elif file_ext == '.fbx':
-    bpy.ops.import_scene.fbx(filepath=filepath)
-elif file_ext == '.dae':
-    bpy.ops.wm.collada_import(filepath=filepath)
-elif file_ext == '.3ds':
-    bpy.ops.import_scene.autodesk_3ds(filepath=filepath)
-elif file_ext == '.stl':
-    bpy.ops.import_mesh.stl(filepath=filepath)
-elif file_ext == '.ply':
-    bpy.ops.import_mesh.ply(filepath=filepath)
-
-# Apply all modifiers
-for obj in bpy.context.scene.objects:
-    if obj.type == 'MESH':
-        bpy.context.view_layer.objects.active = obj
-        for modifier in obj.modifiers:
-            bpy.ops.object.modifier_apply(modifier=modifier.name)
-
-# Export as GLB
-bpy.ops.export_scene.gltf(
-    filepath=r"{output_path.absolute()}",
-    export_format='GLB',
-    export_animations=False,
-    export_apply=True
-)
-"""
-        
-        # Write script to temporary file
-        script_path = UPLOADS_DIR / "temp_conversion_script.py"
-        with open(script_path, "w") as f:
-            f.write(blender_script)
-        
-        # Run Blender
-        result = subprocess.run([
-            "blender", "--background", "--python", str(script_path)
-        ], capture_output=True, timeout=120)
-        
-        # Clean up script
-        script_path.unlink()
-        
-        if result.returncode == 0 and output_path.exists():
-            return output_path
-        else:
-            return None
-            
+
+        if input_path.suffix.lower() in NATIVE_MESH_FORMATS:
+            try:
+                stats = await run_blocking(convert_mesh_to_glb, input_path, output_path)
+                print(f"✅ Native conversion: {stats['triangle_count']} triangles, {stats['size']} bytes")
+                return output_path
+            except Exception as e:
+                # Unusual files (e.g. odd PLY layouts) still get a chance in Blender
+                print(f"Native mesh conversion failed, falling back to Blender: {e}")
+
+        return await blender_pool.convert(input_path, output_path)
     except Exception as e:
         print(f"Blender conversion failed: {e}")
         return None
 
-async def convert_point_cloud_to_3dtiles(input_path: Path) -> bool:
-    """Convert point cloud to 3D Tiles using PotreeConverter"""
+async def convert_point_cloud_to_3dtiles(input_path: Path, name: str) -> bool:
+    """Convert point cloud to 3D Tiles as UPLOADS_DIR/{name}.json"""
+    if input_path.suffix.lower() == '.las':
+        try:
+            stats = await run_blocking(tile_las, input_path, UPLOADS_DIR, name)
+            print(f"✅ Point cloud tiled: {stats['point_count']} points in {stats['tile_count']} tiles")
+            return True
+        except Exception as e:
+            print(f"Built-in LAS tiler failed, trying PotreeConverter: {e}")
+
     try:
-        output_dir = UPLOADS_DIR / f"pointcloud_tiles_{int(time.time())}"
+        output_dir = UPLOADS_DIR / f"{name}_potree"
         output_dir.mkdir(exist_ok=True)
         
         # Try using PotreeConverter
-        result = subprocess.run([
+        result = await run_blocking(subprocess.run, [
             "PotreeConverter", str(input_path), "-o", str(output_dir)
         ], capture_output=True, timeout=300)
         
-        if result.returncode == 0:
-            # Find the tileset.json file
-            tileset_file = output_dir / "tileset.json"
-            if tileset_file.exists():
-                # Move to uploads directory
-                final_tileset = UPLOADS_DIR / f"pointcloud_{int(time.time())}.json"
-                shutil.move(str(tileset_file), str(final_tileset))
-                
-                # Clean up temporary directory
-                shutil.rmtree(output_dir)
-                return True
+        if result.returncode == 0 and (output_dir / ROOT_TILESET).exists():
+            # Keep the whole tree: tileset.json refers to child tiles in sub-directories
+            await run_blocking(publish_tileset_directory, output_dir, UPLOADS_DIR, name)
+            return True
         
+        shutil.rmtree(output_dir, ignore_errors=True)
         return False
         
     except Exception as e:
         print(f"Point cloud conversion failed: {e}")
         return False
 
-async def convert_splats_to_3dtiles(input_path: Path) -> bool:
-    """Convert Gaussian splats to 3D Tiles"""
+async def convert_splats_to_3dtiles(input_path: Path, name: str) -> bool:
+    """Convert Gaussian splats to chunked 3D Tiles as UPLOADS_DIR/{name}.json"""
     try:
-        # This would require specialized splat processing
-        # For now, return False to use fallback
-        return False
+        stats = await run_blocking(tile_splats, input_path, UPLOADS_DIR, name)
+        print(f"✅ Splats tiled: {stats['splat_count']} splats in {stats['tile_count']} tiles, "
+              f"{input_path.stat().st_size} -> {stats['size']} bytes")
+        return True
         
     except Exception as e:
         print(f"Splats conversion failed: {e}")
         return False
 
-async def convert_geospatial_to_3dtiles(input_path: Path) -> bool:
-    """Convert geospatial formats to 3D Tiles"""
+async def convert_geospatial_to_3dtiles(input_path: Path, name: str) -> bool:
+    """Convert geospatial formats to 3D Tiles as UPLOADS_DIR/{name}.json (CityGML buildings)"""
     try:
-        # This would require specialized geospatial processing
-        # For now, return False to use fallback
-        return False
+        if input_path.suffix.lower() not in ['.citygml', '.gml']:
+            return False
+        stats = await run_blocking(convert_citygml, input_path, UPLOADS_DIR, name)
+        print(f"✅ CityGML tiled: {stats['building_count']} buildings, "
+              f"{stats['triangle_count']} triangles in {stats['tile_count']} tiles")
+        return True
         
     except Exception as e:
         print(f"Geospatial conversion failed: {e}")
         return False
 
+async def convert_kml_to_geojson_tiles(input_path: Path, name: str) -> bool:
+    """Convert KML/KMZ (with NetworkLinks) to tiled GeoJSON indexed by UPLOADS_DIR/{name}.json"""
+    try:
+        stats = await run_blocking(convert_kml, input_path, UPLOADS_DIR, name, UPLOADS_DIR / ".cache" / "kml")
+        print(f"✅ KML tiled: {stats['feature_count']} features in {stats['tile_count']} tiles")
+        return True
+        
+    except Exception as e:
+        print(f"KML conversion failed: {e}")
+        return False
+
 async def convert_bim_to_gltf(input_path: Path) -> bool:
     """Convert BIM formats to glTF"""
     try:
@@ -1120,13 +1506,64 @@ async def upload_to_cesium_ion(file_path: Path, filename: str) -> str:
         print(f"Cesium ion upload failed: {e}")
         raise e
 
-@app.get("/uploads/{filename}")
-async def serve_uploaded_file(filename: str):
-    """Serve uploaded files"""
-    file_path = UPLOADS_DIR / filename
-    if not file_path.exists():
+@app.on_event("shutdown")
+async def stop_blender_workers():
+    """Stop the warm Blender workers with the server"""
+    await blender_pool.shutdown()
+
+# Internal nginx location mapped to UPLOADS_DIR (e.g. /_uploads). When set, upload and
+# tileset routes only check the request and let nginx send the file (X-Accel-Redirect);
+# leave empty to serve files from Python, e.g. in development
+X_ACCEL_UPLOADS_PREFIX = os.getenv("X_ACCEL_UPLOADS_PREFIX", "").rstrip("/")
+
+def _accel_uri(file_path: Path) -> Optional[str]:
+    """Internal nginx URI of a file below UPLOADS_DIR, when X-Accel-Redirect is enabled"""
+    if not X_ACCEL_UPLOADS_PREFIX:
+        return None
+    return f"{X_ACCEL_UPLOADS_PREFIX}/{file_path.relative_to(UPLOADS_DIR.resolve()).as_posix()}"
+
+# Output names carrying the upload's content digest (see output_name: "gltf_3f2a9c0d1b7e4a65_model.glb",
+# "archive_3f2a9c0d1b7e4a65_city/tileset.json") always hold the same bytes
+IMMUTABLE_UPLOAD = re.compile(rf"^[a-z0-9_]+_[0-9a-f]{{{OUTPUT_DIGEST_LENGTH}}}_")
+
+@app.api_route("/uploads/{filename:path}", methods=["GET", "HEAD"])
+async def serve_uploaded_file(filename: str, request: Request):
+    """Serve uploaded files, including files inside extracted tileset directories"""
+    file_path = (UPLOADS_DIR / filename).resolve()
+    # Stay inside uploads and keep internal directories (.store, .cache) private
+    if (not file_path.is_relative_to(UPLOADS_DIR.resolve())
+            or any(part.startswith('.') for part in Path(filename).parts)):
+        raise HTTPException(status_code=404, detail="File not found")
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    return await serve_file(request, file_path, immutable=bool(IMMUTABLE_UPLOAD.match(filename)),
+                            accel_uri=_accel_uri(file_path))
+
+@app.api_route("/tilesets/{tileset}/{path:path}", methods=["GET", "HEAD"])
+async def serve_tileset_file(tileset: str, path: str, request: Request):
+    """Serve tileset.json, child tilesets and tiles of a tileset directory or .3tz container"""
+    root = resolve_path(UPLOADS_DIR, tileset)
+    if root is None or not root.exists():
+        raise HTTPException(status_code=404, detail="Tileset not found")
+    # Published tilesets never change, so every file in them can be cached for good
+    immutable = bool(IMMUTABLE_UPLOAD.match(tileset))
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    
+    # Tiles inside a container are served from Python: nginx cannot address a zip member
+    if root.is_file() and root.suffix.lower() == CONTAINER_SUFFIX:
+        try:
+            container = await run_in_threadpool(open_container, root)
+            entry = await run_in_threadpool(container.entry, path)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=404, detail="Tileset not found")
+        if entry is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return serve_container_entry(request, container, entry, media_type, immutable)
+    
+    file_path = resolve_path(root, path) if root.is_dir() else None
+    if file_path is None or not file_path.is_file():
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+    return await serve_file(request, file_path, immutable=immutable, accel_uri=_accel_uri(file_path))
 
 # --------------------
 # Server startup
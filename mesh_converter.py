@@ -0,0 +1,337 @@
+"""
+Native mesh converter for MyEarth.app
+Converts OBJ, STL and PLY meshes to binary glTF in-process with NumPy,
+so the common formats no longer need Blender
+"""
+
+import struct
+from array import array
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from glb import Mesh, write_mesh_glb
+
+# Formats handled here; everything else still goes through Blender
+NATIVE_MESH_FORMATS = ['.obj', '.stl', '.ply']
+
+GENERATOR = "MyEarth mesh converter"
+
+STL_HEADER_SIZE = 84
+STL_TRIANGLE_DTYPE = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attributes", "<u2"),
+])
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8",
+}
+
+
+# --------------------
+# Shared helpers
+# --------------------
+def _weld(corners: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Collapse identical corner rows into unique vertices; returns (unique rows, triangle indices)"""
+    unique, inverse = np.unique(corners, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1).astype(np.uint32).reshape(-1, 3)
+
+
+def _drop_degenerate(indices: np.ndarray) -> np.ndarray:
+    """Remove triangles that reference the same vertex twice"""
+    keep = (
+        (indices[:, 0] != indices[:, 1])
+        & (indices[:, 1] != indices[:, 2])
+        & (indices[:, 0] != indices[:, 2])
+    )
+    return indices[keep]
+
+
+def _fan(polygon: List, out: array) -> None:
+    """Triangulate a convex polygon as a fan into out"""
+    for i in range(1, len(polygon) - 1):
+        out.extend(polygon[0])
+        out.extend(polygon[i])
+        out.extend(polygon[i + 1])
+
+
+# --------------------
+# OBJ
+# --------------------
+def parse_obj(path: Path) -> Mesh:
+    """Parse a Wavefront OBJ line by line into an indexed mesh"""
+    positions = array("f")
+    texcoords = array("f")
+    normals = array("f")
+    corners = array("q")  # (v, vt, vn) per triangle corner, -1 when absent
+
+    def resolve(token: bytes, count: int) -> int:
+        index = int(token)
+        return index - 1 if index > 0 else count + index
+
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"v "):
+                positions.extend(map(float, line.split()[1:4]))
+            elif line.startswith(b"vt "):
+                texcoords.extend(map(float, line.split()[1:3]))
+            elif line.startswith(b"vn "):
+                normals.extend(map(float, line.split()[1:4]))
+            elif line.startswith(b"f "):
+                polygon = []
+                for token in line.split()[1:]:
+                    fields = token.split(b"/")
+                    v = resolve(fields[0], len(positions) // 3)
+                    vt = resolve(fields[1], len(texcoords) // 2) if len(fields) > 1 and fields[1] else -1
+                    vn = resolve(fields[2], len(normals) // 3) if len(fields) > 2 and fields[2] else -1
+                    polygon.append((v, vt, vn))
+                _fan(polygon, corners)
+
+    if not corners:
+        raise ValueError("OBJ file has no faces")
+
+    corner_array = np.array(corners, dtype=np.int64).reshape(-1, 3)
+    use_uvs = bool(texcoords) and bool((corner_array[:, 1] >= 0).all())
+    use_normals = bool(normals) and bool((corner_array[:, 2] >= 0).all())
+    if not use_uvs:
+        corner_array[:, 1] = -1
+    if not use_normals:
+        corner_array[:, 2] = -1
+
+    unique, indices = _weld(corner_array)
+    position_array = np.frombuffer(positions, dtype=np.float32).reshape(-1, 3)
+    mesh = Mesh(positions=position_array[unique[:, 0]], indices=_drop_degenerate(indices))
+    if use_uvs:
+        uvs = np.frombuffer(texcoords, dtype=np.float32).reshape(-1, 2)[unique[:, 1]].copy()
+        uvs[:, 1] = 1.0 - uvs[:, 1]  # OBJ v points up, glTF v points down
+        mesh.uvs = uvs
+    if use_normals:
+        mesh.normals = np.frombuffer(normals, dtype=np.float32).reshape(-1, 3)[unique[:, 2]]
+    return mesh
+
+
+# --------------------
+# STL
+# --------------------
+def parse_stl(path: Path) -> Mesh:
+    """Parse binary or ASCII STL and weld shared corners into indexed vertices"""
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        header = f.read(STL_HEADER_SIZE)
+
+    triangles = None
+    if len(header) == STL_HEADER_SIZE:
+        (count,) = struct.unpack_from("<I", header, 80)
+        if STL_HEADER_SIZE + count * STL_TRIANGLE_DTYPE.itemsize == size:
+            records = np.memmap(path, dtype=STL_TRIANGLE_DTYPE, mode="r",
+                                offset=STL_HEADER_SIZE, shape=(count,))
+            triangles = np.array(records["vertices"], dtype=np.float32)
+
+    if triangles is None:
+        if not header.lstrip().lower().startswith(b"solid"):
+            raise ValueError("Not a valid STL file")
+        coords = array("f")
+        with open(path, "rb") as f:
+            for line in f:
+                stripped = line.strip()
+                if stripped.startswith(b"vertex"):
+                    coords.extend(map(float, stripped.split()[1:4]))
+        triangles = np.frombuffer(coords, dtype=np.float32).reshape(-1, 3, 3)
+
+    if not len(triangles):
+        raise ValueError("STL file has no triangles")
+
+    # Normals are left out: glTF clients render flat normals, which is what STL means
+    positions, indices = _weld(triangles.reshape(-1, 3))
+    return Mesh(positions=positions.astype(np.float32), indices=_drop_degenerate(indices))
+
+
+# --------------------
+# PLY
+# --------------------
+def read_ply_header(path: Path) -> Tuple[str, List[Tuple[str, int, list]], int]:
+    """Return (format, elements, header length); elements are (name, count, properties)"""
+    elements: List[Tuple[str, int, list]] = []
+    fmt = None
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError("Not a PLY file")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError("PLY header has no end_header")
+            parts = line.decode("ascii", errors="ignore").split()
+            if not parts or parts[0] in ("comment", "obj_info"):
+                continue
+            if parts[0] == "format":
+                fmt = parts[1]
+            elif parts[0] == "element":
+                elements.append((parts[1], int(parts[2]), []))
+            elif parts[0] == "property" and elements:
+                if parts[1] == "list":
+                    elements[-1][2].append((parts[4], ("list", PLY_TYPES[parts[2]], PLY_TYPES[parts[3]])))
+                else:
+                    elements[-1][2].append((parts[2], PLY_TYPES[parts[1]]))
+            elif parts[0] == "end_header":
+                return fmt, elements, f.tell()
+
+
+def is_mesh_ply(path: Path) -> bool:
+    """True for PLY files with faces (meshes); Gaussian splat PLYs only carry vertices"""
+    try:
+        _, elements, _ = read_ply_header(path)
+    except (OSError, ValueError, KeyError, IndexError):
+        return False
+    return any(name == "face" and count > 0 for name, count, _ in elements)
+
+
+def _read_binary_element(data: memoryview, offset: int, count: int, props: list, endian: str):
+    """Read one binary PLY element; returns (fields, faces, new offset)"""
+    list_props = [p for p in props if isinstance(p[1], tuple)]
+    if not list_props:
+        dtype = np.dtype([(name, endian + t) for name, t in props])
+        fields = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return fields, None, offset + dtype.itemsize * count
+
+    if len(props) == 1:
+        # Common case: faces with one vertex list and a fixed vertex count per face
+        _, (_, count_type, item_type) = props[0]
+        first = int(np.frombuffer(data, dtype=endian + count_type, count=1, offset=offset)[0])
+        dtype = np.dtype([("n", endian + count_type), ("idx", endian + item_type, (first,))])
+        if offset + dtype.itemsize * count <= len(data):
+            records = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            if (records["n"] == first).all():
+                return None, [records["idx"]], offset + dtype.itemsize * count
+
+    # Mixed polygons or extra per-face properties: walk records one by one
+    faces = []
+    for _ in range(count):
+        for name, t in props:
+            if isinstance(t, tuple):
+                _, count_type, item_type = t
+                n = int(np.frombuffer(data, dtype=endian + count_type, count=1, offset=offset)[0])
+                offset += np.dtype(count_type).itemsize
+                items = np.frombuffer(data, dtype=endian + item_type, count=n, offset=offset)
+                offset += np.dtype(item_type).itemsize * n
+                if name in ("vertex_indices", "vertex_index"):
+                    faces.append(items)
+            else:
+                offset += np.dtype(t).itemsize
+    return None, faces, offset
+
+
+def _read_ascii_elements(path: Path, header_length: int, elements: list):
+    vertices, faces = None, []
+    with open(path, "rb") as f:
+        f.seek(header_length)
+        for name, count, props in elements:
+            if name == "vertex":
+                dtype = np.dtype([(pname, t) for pname, t in props if not isinstance(t, tuple)])
+                rows = [tuple(map(float, f.readline().split()[:len(dtype.names)])) for _ in range(count)]
+                vertices = np.array(rows, dtype=dtype)
+            elif name == "face":
+                for _ in range(count):
+                    values = f.readline().split()
+                    n = int(values[0])
+                    faces.append(np.array(values[1:1 + n], dtype=np.int64))
+            else:
+                for _ in range(count):
+                    f.readline()
+    return vertices, faces
+
+
+def parse_ply(path: Path) -> Mesh:
+    """Parse ASCII or binary PLY meshes with optional normals, colours and UVs"""
+    fmt, elements, header_length = read_ply_header(path)
+
+    if fmt == "ascii":
+        vertices, faces = _read_ascii_elements(path, header_length, elements)
+    elif fmt in ("binary_little_endian", "binary_big_endian"):
+        endian = "<" if fmt == "binary_little_endian" else ">"
+        data = memoryview(np.memmap(path, dtype=np.uint8, mode="r"))
+        offset = header_length
+        vertices, faces = None, []
+        for name, count, props in elements:
+            fields, element_faces, offset = _read_binary_element(data, offset, count, props, endian)
+            if name == "vertex":
+                vertices = fields
+            elif name == "face":
+                faces = element_faces or []
+    else:
+        raise ValueError(f"Unsupported PLY format: {fmt}")
+
+    if vertices is None or not faces:
+        raise ValueError("PLY file has no mesh faces")
+
+    names = vertices.dtype.names
+    positions = np.stack([vertices["x"], vertices["y"], vertices["z"]], axis=1).astype(np.float32)
+
+    blocks = []
+    polygons = array("q")
+    for face in faces:
+        face = np.asarray(face, dtype=np.int64)
+        if face.ndim == 2:
+            # A block of equally sized polygons, fanned without a Python loop per face
+            for i in range(1, face.shape[1] - 1):
+                blocks.append(np.stack([face[:, 0], face[:, i], face[:, i + 1]], axis=1))
+        elif len(face) >= 3:
+            _fan([[int(i)] for i in face], polygons)
+    blocks.append(np.array(polygons, dtype=np.int64).reshape(-1, 3))
+    indices = np.concatenate(blocks)
+    if indices.size and (indices.min() < 0 or indices.max() >= len(positions)):
+        raise ValueError("PLY face references a missing vertex")
+
+    mesh = Mesh(positions=positions, indices=_drop_degenerate(indices.astype(np.uint32)))
+    if {"nx", "ny", "nz"} <= set(names):
+        mesh.normals = np.stack([vertices["nx"], vertices["ny"], vertices["nz"]], axis=1).astype(np.float32)
+    for u_name, v_name in (("s", "t"), ("u", "v"), ("texture_u", "texture_v")):
+        if u_name in names and v_name in names:
+            mesh.uvs = np.stack([vertices[u_name], 1.0 - vertices[v_name]], axis=1).astype(np.float32)
+            break
+    if {"red", "green", "blue"} <= set(names):
+        channels = ["red", "green", "blue"] + (["alpha"] if "alpha" in names else [])
+        colors = np.stack([vertices[c] for c in channels], axis=1).astype(np.float32)
+        if vertices["red"].dtype.kind in "ui":
+            colors /= 255.0
+        mesh.colors = colors
+    return mesh
+
+
+# --------------------
+# Entry point
+# --------------------
+PARSERS = {
+    '.obj': parse_obj,
+    '.stl': parse_stl,
+    '.ply': parse_ply,
+}
+
+
+def load_mesh(input_path: Path) -> Mesh:
+    parser = PARSERS.get(input_path.suffix.lower())
+    if parser is None:
+        raise ValueError(f"Unsupported mesh format: {input_path.suffix}")
+    mesh = parser(input_path)
+    if not mesh.triangle_count:
+        raise ValueError("Mesh has no triangles")
+    return mesh
+
+
+def convert_mesh_to_glb(input_path: Path, output_path: Path) -> Dict[str, int]:
+    """Convert an OBJ/STL/PLY mesh to GLB; returns basic mesh statistics"""
+    mesh = load_mesh(input_path)
+    size = write_mesh_glb(output_path, mesh, generator=GENERATOR)
+    return {
+        "vertex_count": mesh.vertex_count,
+        "triangle_count": mesh.triangle_count,
+        "size": size,
+    }
@@ -3,9 +3,11 @@ Database models for MyEarth application
 Defines SQLAlchemy ORM models for users, layers, ratings, categories, and licenses
 """
 
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, ARRAY, Float
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, ARRAY, Float, Index, cast, Computed, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 import uuid
 from datetime import datetime
@@ -57,31 +59,95 @@ class Layer(Base):
     center_lon = Column(Float, nullable=True)
     center_lat = Column(Float, nullable=True)
     zoom_level = Column(Integer, nullable=True)
+    # Envelope of bbox for viewport queries, generated by PostgreSQL. A bbox crossing
+    # the antimeridian (min_lon > max_lon) gets max_lon + 360, so west <= east always
+    min_lon = Column(Float, Computed("bbox[1]", persisted=True))
+    min_lat = Column(Float, Computed("bbox[2]", persisted=True))
+    max_lon = Column(Float, Computed("CASE WHEN bbox[3] < bbox[1] THEN bbox[3] + 360 ELSE bbox[3] END",
+                                     persisted=True))
+    max_lat = Column(Float, Computed("bbox[4]", persisted=True))
     
     # Statistics
-    view_count = Column(Integer, default=0)
+    view_count = Column(Integer, nullable=False, default=0, server_default="0")
     download_count = Column(Integer, default=0)
     
+    # Rating aggregates, updated with each rating change (see layer_api.rate_layer)
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    
+    # Full-text search document, weighted title > tags > description (set by a trigger)
+    search_vector = deferred(Column(TSVECTOR, nullable=True))
+    
     # Timestamps
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, nullable=False, default=func.now(), server_default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # Relationships
     user = relationship("User", back_populates="layers")
     ratings = relationship("LayerRating", back_populates="layer", cascade="all, delete-orphan")
     
-    @property
+    @hybrid_property
     def average_rating(self):
-        """Calculate average rating for this layer"""
-        if not self.ratings:
+        """Average rating for this layer"""
+        if not self.rating_count:
             return 0.0
-        total = sum(rating.rating for rating in self.ratings)
-        return round(total / len(self.ratings), 1)
+        return round(self.rating_sum / self.rating_count, 1)
+    
+    @average_rating.expression
+    def average_rating(cls):
+        """SQL form of average_rating, matching ix_layers_average_rating_id for sorting and filtering"""
+        return func.coalesce(cast(cls.rating_sum, Float) / func.nullif(cls.rating_count, 0), 0.0)
+
+    @hybrid_property
+    def envelope(self):
+        """(west, south, east, north) of bbox, east past 180 when it crosses the antimeridian"""
+        if self.min_lon is None:
+            return None
+        return (self.min_lon, self.min_lat, self.max_lon, self.max_lat)
     
-    @property
-    def rating_count(self):
-        """Get number of ratings for this layer"""
-        return len(self.ratings)
+    @envelope.expression
+    def envelope(cls):
+        """SQL box of the envelope, matching ix_layers_envelope for && and # against viewports"""
+        return func.box(func.point(cls.min_lon, cls.min_lat), func.point(cls.max_lon, cls.max_lat))
+
+# Keyset pagination: one (sort key, id) index per fixed search order
+Index("ix_layers_created_at_id", Layer.created_at, Layer.id)
+Index("ix_layers_average_rating_id", Layer.average_rating, Layer.id)
+Index("ix_layers_view_count_id", Layer.view_count, Layer.id)
+Index("ix_layers_title_id", Layer.title, Layer.id)
+Index("ix_layers_envelope", Layer.envelope, postgresql_using="gist")
+Index("ix_layers_search_vector", Layer.search_vector, postgresql_using="gin")
+# Typo-tolerant title matching (pg_trgm word similarity)
+Index("ix_layers_title_trgm", Layer.title, postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"})
+
+# Text search configuration for layer documents and queries
+SEARCH_CONFIG = "english"
+
+SEARCH_EXTENSION_DDL = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+SEARCH_TRIGGER_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION layers_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(array_to_string(NEW.tags, ' '), '')), 'B') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS layers_search_vector_trigger ON layers",
+    """
+    CREATE TRIGGER layers_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, tags, description ON layers
+    FOR EACH ROW EXECUTE PROCEDURE layers_search_vector_update()
+    """,
+]
+
+# New databases get the extension before the trigram index and the trigger after the table
+event.listen(Layer.__table__, "before_create", DDL(SEARCH_EXTENSION_DDL).execute_if(dialect="postgresql"))
+for _statement in SEARCH_TRIGGER_DDL:
+    event.listen(Layer.__table__, "after_create", DDL(_statement).execute_if(dialect="postgresql"))
 
 class LayerRating(Base):
     """Rating model for layer ratings"""
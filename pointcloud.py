@@ -0,0 +1,339 @@
+"""
+LAS point cloud tiling for MyEarth.app
+Turns LAS files into a 3D Tiles point cloud (octree of pnts tiles) without
+external tools. Point records are read through numpy.memmap one chunk at a
+time, so memory stays bounded however large the file is, and tiles are
+written in parallel on a long-lived pool of worker processes.
+"""
+
+import multiprocessing
+import multiprocessing.pool
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from spatial import MORTON_BITS, morton_codes
+import tiles3d
+
+LAS_MAGIC = b"LASF"
+LAS_HEADER_READ = 375  # bytes covering every header version
+
+CHUNK_POINTS = 1_000_000  # points read from the memory map at a time
+MAX_TILE_POINTS = 100_000  # octree nodes holding more points are split
+SUBSAMPLE_GRID = 128  # cells per axis when thinning points promoted to a parent
+# Points a node passes up to its parent; eight children fill at most one parent tile
+MAX_PROMOTED_POINTS = MAX_TILE_POINTS // 8
+TILER_WORKERS = int(os.getenv("TILER_WORKERS", str(os.cpu_count() or 1)))
+
+# Byte offset of the RGB triplet within each point data record format
+RGB_OFFSETS = {2: 20, 3: 28, 5: 28, 7: 30, 8: 30, 10: 30}
+
+# Packed local-frame record used for the on-disk buckets between passes
+BUCKET_DTYPE = np.dtype([("position", "<f4", (3,)), ("rgb", "u1", (3,))])
+
+
+@dataclass
+class LASHeader:
+    version: Tuple[int, int]
+    point_format: int
+    record_length: int
+    point_count: int
+    data_offset: int
+    scale: np.ndarray
+    offset: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+    @property
+    def has_color(self) -> bool:
+        return self.point_format in RGB_OFFSETS
+
+
+# --------------------
+# LAS reading
+# --------------------
+def read_las_header(path: Path) -> LASHeader:
+    """Parse the public header block of a LAS 1.0-1.4 file"""
+    with open(path, "rb") as f:
+        data = f.read(LAS_HEADER_READ)
+    return parse_las_header(data, os.path.getsize(path))
+
+
+def parse_las_header(data: bytes, file_size: int) -> LASHeader:
+    """Parse the first LAS_HEADER_READ bytes of a LAS file of file_size bytes"""
+    if len(data) < 227 or data[:4] != LAS_MAGIC:
+        raise ValueError("Not a LAS file")
+    version = (data[24], data[25])
+    data_offset, = struct.unpack_from("<I", data, 96)
+    point_format, record_length, point_count = struct.unpack_from("<BHI", data, 104)
+    if point_format & 0xC0:
+        raise ValueError("Compressed (LAZ) point records are not supported")
+    if version >= (1, 4) and len(data) >= 255:
+        point_count, = struct.unpack_from("<Q", data, 247)
+    xs, ys, zs, xo, yo, zo, max_x, min_x, max_y, min_y, max_z, min_z = struct.unpack_from("<12d", data, 131)
+
+    # Never map past the end of a truncated file
+    if record_length == 0 or data_offset > file_size:
+        raise ValueError("Invalid LAS point record layout")
+    available = (file_size - data_offset) // record_length
+    return LASHeader(
+        version=version,
+        point_format=point_format,
+        record_length=record_length,
+        point_count=int(min(point_count, max(available, 0))),
+        data_offset=data_offset,
+        scale=np.array([xs, ys, zs]),
+        offset=np.array([xo, yo, zo]),
+        lower=np.array([min_x, min_y, min_z]),
+        upper=np.array([max_x, max_y, max_z]),
+    )
+
+
+def read_points(path: Path, header: LASHeader) -> np.memmap:
+    """Memory-map the point records; only X/Y/Z and RGB fields are exposed"""
+    names, formats, offsets = ["X", "Y", "Z"], ["<i4"] * 3, [0, 4, 8]
+    if header.has_color:
+        rgb = RGB_OFFSETS[header.point_format]
+        names += ["red", "green", "blue"]
+        formats += ["<u2"] * 3
+        offsets += [rgb, rgb + 2, rgb + 4]
+    dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": header.record_length})
+    return np.memmap(path, dtype=dtype, mode="r", offset=header.data_offset, shape=(header.point_count,))
+
+
+def _chunks(points: np.memmap, header: LASHeader, origin: np.ndarray, color_shift: int) -> Iterator[np.ndarray]:
+    """Yield BUCKET_DTYPE records in the tileset's local frame, CHUNK_POINTS at a time"""
+    for start in range(0, len(points), CHUNK_POINTS):
+        chunk = points[start:start + CHUNK_POINTS]
+        records = np.empty(len(chunk), dtype=BUCKET_DTYPE)
+        xyz = np.stack([chunk["X"], chunk["Y"], chunk["Z"]], axis=1) * header.scale + header.offset
+        records["position"] = xyz - origin
+        if header.has_color:
+            rgb = np.stack([chunk["red"], chunk["green"], chunk["blue"]], axis=1)
+            records["rgb"] = rgb >> color_shift
+        else:
+            records["rgb"] = 255
+        yield records
+
+
+# --------------------
+# Octree
+# --------------------
+def _count_cells(chunks: Iterator[np.ndarray], lower: np.ndarray, grid_upper: np.ndarray):
+    """Sparse point counts per finest-level octree cell (sorted Morton codes, counts)"""
+    codes = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    for records in chunks:
+        chunk_codes, chunk_counts = np.unique(
+            morton_codes(records["position"], lower, grid_upper).astype(np.int64), return_counts=True)
+        codes, inverse = np.unique(np.concatenate([codes, chunk_codes]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts, chunk_counts])).astype(np.int64)
+    return codes, counts
+
+
+def _build_octree(codes: np.ndarray, counts: np.ndarray, lower: np.ndarray, size: float):
+    """Split cells into nodes of at most MAX_TILE_POINTS; returns (root, leaves in Morton order)"""
+    totals = np.concatenate([[0], np.cumsum(counts)])
+    leaves = []
+
+    def build(key: str, prefix: int, depth: int, node_lower: np.ndarray, node_size: float) -> dict:
+        shift = 3 * (MORTON_BITS - depth)
+        first, last = np.searchsorted(codes, [prefix << shift, (prefix + 1) << shift])
+        node = {"key": key, "lower": node_lower, "size": node_size, "children": []}
+        if totals[last] - totals[first] <= MAX_TILE_POINTS or depth == MORTON_BITS:
+            node["first_code"] = prefix << shift
+            leaves.append(node)
+            return node
+        for octant in range(8):
+            child = prefix * 8 + octant
+            child_shift = shift - 3
+            start, end = np.searchsorted(codes, [child << child_shift, (child + 1) << child_shift])
+            if start == end:
+                continue
+            # Morton codes interleave x in bit 0, y in bit 1 and z in bit 2
+            step = np.array([octant & 1, (octant >> 1) & 1, (octant >> 2) & 1]) * node_size / 2
+            node["children"].append(build(key + str(octant), child, depth + 1, node_lower + step, node_size / 2))
+        return node
+
+    return build("r", 0, 0, lower, size), leaves
+
+
+def _nodes_by_depth(root: dict) -> List[List[dict]]:
+    levels: List[List[dict]] = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        depth = len(node["key"]) - 1
+        while len(levels) <= depth:
+            levels.append([])
+        levels[depth].append(node)
+        stack.extend(node["children"])
+    return levels
+
+
+# --------------------
+# Tile writing
+# --------------------
+def _write_node(task: tuple) -> int:
+    """Write one octree node's pnts tile; runs in a worker process.
+
+    A node's points are its leaf bucket or the points promoted by its
+    children. One point per subsample cell, at most MAX_PROMOTED_POINTS,
+    is promoted further up (the root keeps everything), the rest become
+    this tile (ADD refinement). Every tile, the root included, therefore
+    holds at most MAX_TILE_POINTS points.
+    """
+    key, lower, size, children, work_dir, tile_path, has_color = task
+    work = Path(work_dir)
+    sources = [work / f"up_{child}.bin" for child in children] if children else [work / f"leaf_{key}.bin"]
+    points = np.concatenate(
+        [np.fromfile(p, dtype=BUCKET_DTYPE) for p in sources if p.exists()] or [np.empty(0, dtype=BUCKET_DTYPE)])
+    for p in sources:
+        if p.exists():
+            p.unlink()
+
+    if key != "r" and len(points):
+        cells = np.clip(((points["position"] - lower) / size * SUBSAMPLE_GRID).astype(np.int64), 0, SUBSAMPLE_GRID - 1)
+        cell_ids = (cells[:, 0] * SUBSAMPLE_GRID + cells[:, 1]) * SUBSAMPLE_GRID + cells[:, 2]
+        _, first = np.unique(cell_ids, return_index=True)
+        if len(first) > MAX_PROMOTED_POINTS:
+            # Evenly spaced over the cells (sorted by cell id) rather than the first ones
+            first = first[np.linspace(0, len(first) - 1, MAX_PROMOTED_POINTS).astype(np.int64)]
+        promoted = np.zeros(len(points), dtype=bool)
+        promoted[first] = True
+        points[promoted].tofile(work / f"up_{key}.bin")
+        points = points[~promoted]
+
+    if len(points):
+        tiles3d.write_pnts(tile_path, points["position"], lower, lower + size,
+                           points["rgb"] if has_color else None)
+    return len(points)
+
+
+_pools: Dict[int, multiprocessing.pool.Pool] = {}
+_pools_lock = threading.Lock()
+
+
+@contextmanager
+def _entry_module(module):
+    """Make worker processes started inside the block import module as __main__.
+
+    Spawned and forkserver children re-import the parent's __main__, which
+    under `python main.py` is the whole server (app, database engine).
+    """
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = module
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def _worker_pool(workers: int) -> multiprocessing.pool.Pool:
+    """Shared pool of `workers` tile writers, started once per process"""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # forkserver avoids forking a multi-threaded server; its children load only this module
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            with _entry_module(sys.modules[__name__]):
+                pool = _pools[workers] = context.Pool(workers)
+        return pool
+
+
+def _tile(node: dict, counts: Dict[str, int], name: str, data_lower: np.ndarray, data_upper: np.ndarray) -> dict:
+    children = [_tile(child, counts, name, data_lower, data_upper) for child in node["children"]]
+    # Octree cells are cubes; clip them to the data so flat terrain gets flat boxes
+    lower = np.maximum(node["lower"], data_lower)
+    upper = np.minimum(node["lower"] + node["size"], data_upper)
+    return tiles3d.tile(
+        tiles3d.box_volume(lower, upper),
+        node["size"] / SUBSAMPLE_GRID if children else 0.0,
+        content_uri=f"{name}_{node['key']}.pnts" if counts.get(node["key"]) else None,
+        children=children,
+        refine="ADD" if node["key"] == "r" else None,
+    )
+
+
+def tile_las(las_path: Path, output_dir: Path, name: str, workers: int = TILER_WORKERS) -> dict:
+    """Convert a LAS file into {name}.json plus {name}_r*.pnts tiles in output_dir
+
+    Coordinates are taken as metres (projected CRS). Tiles use a local
+    frame whose origin is the bottom centre of the cloud, which the viewer
+    places on the globe. Returns point and tile counts.
+    """
+    header = read_las_header(las_path)
+    if header.point_count == 0:
+        raise ValueError("LAS file contains no points")
+    points = read_points(las_path, header)
+
+    origin = np.array([
+        (header.lower[0] + header.upper[0]) / 2,
+        (header.lower[1] + header.upper[1]) / 2,
+        header.lower[2],
+    ])
+    color_shift = 0
+    if header.has_color:
+        # 16-bit colour is the norm, but some writers store 8-bit values
+        peak = max(int(points[s:s + CHUNK_POINTS][c].max())
+                   for s in range(0, len(points), CHUNK_POINTS) for c in ("red", "green", "blue"))
+        color_shift = 8 if peak > 255 else 0
+
+    # Cubic octree around the header bounds; the grid upper bound makes Morton
+    # cell boundaries land exactly on octant boundaries
+    lower = header.lower - origin
+    size = float(max((header.upper - header.lower).max(), 1e-6)) * 1.0001
+    cells = 1 << MORTON_BITS
+    grid_upper = lower + size * (cells - 1) / cells
+
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{name}_", dir=output_dir))
+    try:
+        # Pass 1: count points per finest cell and derive the octree
+        codes, counts = _count_cells(_chunks(points, header, origin, color_shift), lower, grid_upper)
+        root, leaves = _build_octree(codes, counts, lower, size)
+        leaf_starts = np.array([leaf["first_code"] for leaf in leaves], dtype=np.int64)
+
+        # Pass 2: spill points into one bucket file per leaf
+        for records in _chunks(points, header, origin, color_shift):
+            codes = morton_codes(records["position"], lower, grid_upper).astype(np.int64)
+            leaf_ids = np.searchsorted(leaf_starts, codes, side="right") - 1
+            order = np.argsort(leaf_ids, kind="stable")
+            records, leaf_ids = records[order], leaf_ids[order]
+            present, starts = np.unique(leaf_ids, return_index=True)
+            ends = np.append(starts[1:], len(records))
+            for leaf_id, start, end in zip(present, starts, ends):
+                with open(work_dir / f"leaf_{leaves[leaf_id]['key']}.bin", "ab") as f:
+                    records[start:end].tofile(f)
+
+        # Pass 3: write tiles bottom-up, one octree level at a time
+        tile_counts: Dict[str, int] = {}
+        pool = _worker_pool(workers) if workers > 1 else None
+        for level in reversed(_nodes_by_depth(root)):
+            tasks = [
+                (node["key"], node["lower"], node["size"], [c["key"] for c in node["children"]],
+                 str(work_dir), str(output_dir / f"{name}_{node['key']}.pnts"), header.has_color)
+                for node in level
+            ]
+            results = pool.map(_write_node, tasks) if pool and len(tasks) > 1 else map(_write_node, tasks)
+            tile_counts.update(zip((t[0] for t in tasks), results))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    tileset_path = output_dir / f"{name}.json"
+    tiles3d.write_tileset(tileset_path, _tile(root, tile_counts, name, lower, header.upper - origin),
+                           geometric_error=size)
+    return {
+        "tileset": tileset_path.name,
+        "point_count": int(sum(tile_counts.values())),
+        "tile_count": sum(1 for count in tile_counts.values() if count),
+    }
@@ -0,0 +1,155 @@
+"""
+Resumable uploads for MyEarth.app
+tus-style protocol: create an upload with its total length, append chunks at
+the current offset, ask for the offset after a dropped connection, then
+finish. Chunks go straight into the content store's incoming area and are
+hashed as they arrive, so finishing is a rename rather than another copy.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from storage import CHUNK_SIZE, StoredBlob, adopt_file, store_dir
+
+# Unfinished uploads are deleted after this many seconds without a new chunk
+UPLOAD_TTL_SECONDS = int(os.getenv("RESUMABLE_UPLOAD_TTL_SECONDS", "86400"))
+
+INCOMING_DIRNAME = "resumable"
+
+
+class UploadConflict(ValueError):
+    """A chunk does not start at the current offset or would pass the declared length"""
+
+
+@dataclass
+class ResumableUpload:
+    """An upload in progress; its offset is the size of the data written so far"""
+    id: str
+    filename: str
+    length: int
+    created_at: float
+
+    def data_path(self, root: Path) -> Path:
+        return root / f"{self.id}.part"
+
+    def info_path(self, root: Path) -> Path:
+        return root / f"{self.id}.json"
+
+
+class ResumableUploads:
+    """Registry of resumable uploads, persisted next to their data so restarts keep them"""
+
+    def __init__(self, uploads_dir: Path):
+        self.uploads_dir = uploads_dir
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Running hash per upload: (sha256 object, bytes hashed so far)
+        self._hashers: Dict[str, Tuple["hashlib._Hash", int]] = {}
+
+    @property
+    def root(self) -> Path:
+        path = store_dir(self.uploads_dir) / INCOMING_DIRNAME
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def create(self, filename: str, length: int) -> ResumableUpload:
+        self._prune()
+        upload = ResumableUpload(id=uuid.uuid4().hex, filename=filename, length=length, created_at=time.time())
+        upload.data_path(self.root).touch()
+        upload.info_path(self.root).write_text(json.dumps(asdict(upload)))
+        self._hashers[upload.id] = (hashlib.sha256(), 0)
+        return upload
+
+    def get(self, upload_id: str) -> Optional[ResumableUpload]:
+        if not upload_id.isalnum():
+            return None
+        try:
+            return ResumableUpload(**json.loads((self.root / f"{upload_id}.json").read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def offset(self, upload: ResumableUpload) -> int:
+        return upload.data_path(self.root).stat().st_size
+
+    def lock(self, upload: ResumableUpload) -> asyncio.Lock:
+        return self._locks.setdefault(upload.id, asyncio.Lock())
+
+    async def append(self, upload: ResumableUpload, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Write a request body at offset; returns the new offset.
+
+        Bytes received before a dropped connection are kept, so the client
+        resumes from wherever the data actually ended.
+        """
+        path = upload.data_path(self.root)
+        current = self.offset(upload)
+        if offset != current:
+            raise UploadConflict(f"Upload is at offset {current}, not {offset}")
+
+        hasher, hashed = self._hashers.get(upload.id, (None, -1))
+        if hashed != current:
+            # State lost (e.g. restart); the digest is computed when finishing
+            hasher = None
+        pending = []
+        pending_size = 0
+        with open(path, "ab") as out:
+            try:
+                async for chunk in chunks:
+                    if current + pending_size + len(chunk) > upload.length:
+                        raise UploadConflict(f"Chunk passes the declared length of {upload.length} bytes")
+                    pending.append(chunk)
+                    pending_size += len(chunk)
+                    if pending_size >= CHUNK_SIZE:
+                        current = self._write(out, hasher, pending, current)
+                        pending, pending_size = [], 0
+            finally:
+                current = self._write(out, hasher, pending, current)
+                if hasher is not None:
+                    self._hashers[upload.id] = (hasher, current)
+        return current
+
+    @staticmethod
+    def _write(out, hasher, pending: list, current: int) -> int:
+        data = b"".join(pending)
+        out.write(data)
+        out.flush()
+        if hasher is not None:
+            hasher.update(data)
+        return current + len(data)
+
+    def finish(self, upload: ResumableUpload, suffix: str) -> StoredBlob:
+        """Move a complete upload into the content store under its digest"""
+        path = upload.data_path(self.root)
+        if self.offset(upload) != upload.length:
+            raise UploadConflict(f"Upload has {self.offset(upload)} of {upload.length} bytes")
+        hasher, hashed = self._hashers.pop(upload.id, (None, -1))
+        if hashed != upload.length:
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    hasher.update(block)
+        blob = adopt_file(path, self.uploads_dir, hasher.hexdigest(), suffix)
+        self.delete(upload)
+        return blob
+
+    def delete(self, upload: ResumableUpload) -> None:
+        for path in (upload.data_path(self.root), upload.info_path(self.root)):
+            if path.exists():
+                path.unlink()
+        self._hashers.pop(upload.id, None)
+        self._locks.pop(upload.id, None)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - UPLOAD_TTL_SECONDS
+        for info in self.root.glob("*.json"):
+            data = info.with_suffix(".part")
+            last_write = max(info.stat().st_mtime, data.stat().st_mtime if data.exists() else 0)
+            if last_write < cutoff:
+                upload = self.get(info.stem)
+                if upload:
+                    self.delete(upload)
@@ -0,0 +1,44 @@
+"""
+Spatial ordering helpers for MyEarth.app
+Vectorized Morton (Z-order) codes used to lay out triangles, points and
+splats so that things close in space end up close in memory
+"""
+
+import numpy as np
+
+MORTON_BITS = 10  # bits per axis; 30-bit codes fit comfortably in uint64
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Insert two zero bits between each of the low 10 bits of values"""
+    v = values.astype(np.uint64) & np.uint64(0x3FF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x030000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x0300F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x030C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x09249249)
+    return v
+
+
+def quantize_to_grid(points: np.ndarray, bits: int = MORTON_BITS,
+                     lower: np.ndarray = None, upper: np.ndarray = None) -> np.ndarray:
+    """Map (N, 3) points onto an integer grid of 2**bits cells per axis"""
+    lower = points.min(axis=0) if lower is None else lower
+    upper = points.max(axis=0) if upper is None else upper
+    extent = np.where(upper - lower > 0, upper - lower, 1.0)
+    cells = (1 << bits) - 1
+    return np.clip(((points - lower) / extent * cells).astype(np.int64), 0, cells)
+
+
+def morton_codes(points: np.ndarray, lower: np.ndarray = None, upper: np.ndarray = None) -> np.ndarray:
+    """30-bit Morton codes for (N, 3) points inside [lower, upper]"""
+    grid = quantize_to_grid(np.asarray(points, dtype=np.float64), MORTON_BITS, lower, upper)
+    return (
+        _spread_bits(grid[:, 0])
+        | (_spread_bits(grid[:, 1]) << np.uint64(1))
+        | (_spread_bits(grid[:, 2]) << np.uint64(2))
+    )
+
+
+def morton_order(points: np.ndarray) -> np.ndarray:
+    """Permutation that sorts points along the Z-order curve"""
+    return np.argsort(morton_codes(points), kind="stable")
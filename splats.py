@@ -0,0 +1,197 @@
+"""
+Gaussian splat tiling for MyEarth.app
+Reads .splat and 3DGS .ply captures with NumPy, orders the splats along a
+Morton curve and writes them as a 3D Tiles tileset of quantized glTF point
+chunks (KHR_gaussian_splatting), so viewers only fetch visible chunks.
+Viewers without splat support draw the same chunks as coloured points.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from glb import GLBBuilder, MODE_POINTS, TARGET_ARRAY_BUFFER
+from glb_optimizer import QUANTIZATION_EXTENSION, quantize_unit
+from mesh_converter import read_ply_header
+from spatial import morton_order
+import tiles3d
+
+SPLAT_EXTENSION = "KHR_gaussian_splatting"
+
+CHUNK_SPLATS = 65536  # splats per leaf tile
+NODE_SPLATS = 16384  # most prominent splats kept by each inner tile
+BRANCHING = 4  # children per inner tile
+
+# Zeroth-order spherical harmonic constant used to turn f_dc_* into colours
+SH_C0 = 0.28209479177387814
+
+# antimatter15 .splat record: position, linear scale, RGBA, quaternion (w, x, y, z) as bytes
+SPLAT_DTYPE = np.dtype([
+    ("position", "<f4", (3,)),
+    ("scale", "<f4", (3,)),
+    ("color", "u1", (4,)),
+    ("rotation", "u1", (4,)),
+])
+
+
+@dataclass
+class Splats:
+    positions: np.ndarray  # (N, 3) float32
+    scales: np.ndarray  # (N, 3) float32, linear
+    rotations: np.ndarray  # (N, 4) float32 unit quaternions, glTF (x, y, z, w) order
+    colors: np.ndarray  # (N, 4) uint8 RGBA, alpha is opacity
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def take(self, indices: np.ndarray) -> "Splats":
+        return Splats(self.positions[indices], self.scales[indices], self.rotations[indices], self.colors[indices])
+
+
+def _normalize(quaternions: np.ndarray) -> np.ndarray:
+    lengths = np.linalg.norm(quaternions, axis=1, keepdims=True)
+    return (quaternions / np.where(lengths > 0, lengths, 1.0)).astype(np.float32)
+
+
+# --------------------
+# Parsing
+# --------------------
+def parse_splat(path: Path) -> Splats:
+    """Parse a .splat file (32-byte records)"""
+    records = np.memmap(path, dtype=SPLAT_DTYPE, mode="r")
+    wxyz = records["rotation"].astype(np.float32) - 128.0
+    return Splats(
+        positions=np.array(records["position"], dtype=np.float32),
+        scales=np.array(records["scale"], dtype=np.float32),
+        rotations=_normalize(wxyz[:, [1, 2, 3, 0]]),
+        colors=np.array(records["color"]),
+    )
+
+
+def parse_splat_ply(path: Path) -> Splats:
+    """Parse a binary 3DGS PLY; higher-order spherical harmonics are dropped"""
+    fmt, elements, header_length = read_ply_header(path)
+    if fmt not in ("binary_little_endian", "binary_big_endian"):
+        raise ValueError(f"Unsupported splat PLY format: {fmt}")
+    name, count, props = elements[0]
+    if name != "vertex" or any(isinstance(kind, tuple) for _, kind in props):
+        raise ValueError("Splat PLY must start with a plain vertex element")
+    endian = "<" if fmt == "binary_little_endian" else ">"
+    vertices = np.memmap(path, dtype=np.dtype([(p, endian + kind) for p, kind in props]),
+                         mode="r", offset=header_length, shape=(count,))
+
+    def columns(*names: str) -> np.ndarray:
+        return np.stack([vertices[n] for n in names], axis=1).astype(np.float32)
+
+    rgb = 0.5 + SH_C0 * columns("f_dc_0", "f_dc_1", "f_dc_2")
+    alpha = 1.0 / (1.0 + np.exp(-columns("opacity")))
+    colors = np.round(np.clip(np.concatenate([rgb, alpha], axis=1), 0.0, 1.0) * 255).astype(np.uint8)
+    return Splats(
+        positions=columns("x", "y", "z"),
+        scales=np.exp(columns("scale_0", "scale_1", "scale_2")),
+        rotations=_normalize(columns("rot_1", "rot_2", "rot_3", "rot_0")),
+        colors=colors,
+    )
+
+
+def load_splats(path: Path) -> Splats:
+    if path.suffix.lower() == ".splat":
+        return parse_splat(path)
+    return parse_splat_ply(path)
+
+
+# --------------------
+# Tiles
+# --------------------
+def splat_bounds(splats: Splats):
+    """Bounds of the splat centres grown by three standard deviations"""
+    reach = 3.0 * splats.scales.max(axis=1, keepdims=True)
+    return (splats.positions - reach).min(axis=0), (splats.positions + reach).max(axis=0)
+
+
+def _scale_accessor(builder: GLBBuilder, scales: np.ndarray) -> int:
+    """Linear scales in node space: normalized uint16 when all fit in [0, 1], else float32"""
+    # uint16 gives scales the same absolute precision as the quantized positions
+    if scales.max() <= 1.0:
+        return builder.add_accessor(quantize_unit(scales, np.uint16), TARGET_ARRAY_BUFFER, normalized=True)
+    return builder.add_accessor(scales.astype(np.float32), TARGET_ARRAY_BUFFER)
+
+
+def write_splat_glb(path: Path, splats: Splats) -> int:
+    """Write splats as one quantized POINTS primitive; returns the file size"""
+    lower = splats.positions.min(axis=0).astype(np.float64)
+    extent = float(max((splats.positions.max(axis=0) - lower).max(), 1e-9))
+
+    builder = GLBBuilder()
+    # Positions are uint16 under a node carrying offset and uniform scale;
+    # splat scales live in the same node space, so they shrink by that scale too
+    attributes = {
+        "POSITION": builder.add_accessor(
+            quantize_unit((splats.positions - lower) / extent, np.uint16),
+            TARGET_ARRAY_BUFFER, normalized=True, with_bounds=True),
+        "COLOR_0": builder.add_accessor(splats.colors, TARGET_ARRAY_BUFFER, normalized=True),
+        f"{SPLAT_EXTENSION}:ROTATION": builder.add_accessor(
+            quantize_unit(splats.rotations, np.int8), TARGET_ARRAY_BUFFER, normalized=True),
+        f"{SPLAT_EXTENSION}:SCALE": _scale_accessor(builder, splats.scales / extent),
+    }
+    builder.gltf["meshes"] = [{"primitives": [{
+        "attributes": attributes,
+        "mode": MODE_POINTS,
+        "extensions": {SPLAT_EXTENSION: {"kernel": "ellipse", "colorSpace": "srgb_rec709_display"}},
+    }]}]
+    builder.gltf["nodes"] = [{"mesh": 0, "translation": lower.tolist(), "scale": [extent] * 3}]
+    builder.gltf["scenes"] = [{"nodes": [0]}]
+    builder.gltf["scene"] = 0
+    builder.gltf["extensionsUsed"] = [QUANTIZATION_EXTENSION, SPLAT_EXTENSION]
+    builder.gltf["extensionsRequired"] = [QUANTIZATION_EXTENSION]
+    return builder.write(path)
+
+
+def _build_tile(splats: Splats, indices: np.ndarray, importance: np.ndarray, key: str,
+                name: str, output_dir: Path, files: List[Path]) -> dict:
+    """Tile for Morton-ordered indices: inner tiles keep the most prominent splats (ADD refinement)"""
+    lower, upper = splat_bounds(splats.take(indices))
+    children = []
+    content = indices
+    if len(indices) > CHUNK_SPLATS:
+        prominent = np.zeros(len(indices), dtype=bool)
+        prominent[np.argpartition(-importance[indices], NODE_SPLATS)[:NODE_SPLATS]] = True
+        content = indices[prominent]
+        # The remaining splats stay in Morton order, so equal slices are spatially compact
+        for part, child_indices in enumerate(np.array_split(indices[~prominent], BRANCHING)):
+            children.append(_build_tile(splats, child_indices, importance, key + str(part),
+                                        name, output_dir, files))
+
+    tile_path = output_dir / f"{name}_{key}.glb"
+    write_splat_glb(tile_path, splats.take(content))
+    files.append(tile_path)
+    # Without children drawn, detail is lost down to roughly the spacing of this tile's splats
+    error = tiles3d.diagonal(lower, upper) / np.sqrt(len(content)) if children else 0.0
+    return tiles3d.tile(tiles3d.box_volume(*tiles3d.y_up_to_z_up(lower, upper)), error,
+                        content_uri=tile_path.name, children=children,
+                        refine="ADD" if key == "r" else None)
+
+
+def tile_splats(input_path: Path, output_dir: Path, name: str) -> dict:
+    """Convert a splat capture into {name}.json plus {name}_r*.glb chunks in output_dir"""
+    splats = load_splats(input_path)
+    if not len(splats):
+        raise ValueError("No splats found")
+
+    order = morton_order(splats.positions)
+    # Large, opaque splats carry the most of the picture from far away
+    importance = splats.colors[:, 3].astype(np.float32) * splats.scales.max(axis=1) ** 2
+
+    files: List[Path] = []
+    root = _build_tile(splats, order, importance, "r", name, output_dir, files)
+    lower, upper = splat_bounds(splats)
+    tileset_path = output_dir / f"{name}.json"
+    tiles3d.write_tileset(tileset_path, root, geometric_error=tiles3d.diagonal(lower, upper))
+    return {
+        "tileset": tileset_path.name,
+        "splat_count": len(splats),
+        "tile_count": len(files),
+        "size": sum(p.stat().st_size for p in files),
+    }
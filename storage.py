@@ -0,0 +1,189 @@
+"""
+Content-addressed upload storage for MyEarth.app
+Hashes uploads while they stream to disk, keeps each distinct file once
+under its SHA-256 digest and hands out cheap references to it
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+# Read uploads in 1 MiB chunks so large models never sit in memory
+CHUNK_SIZE = 1024 * 1024
+
+STORE_DIRNAME = ".store"
+
+
+@dataclass
+class StoredBlob:
+    """A file kept once in the content-addressed store"""
+    digest: str
+    path: Path
+    size: int
+    existed: bool  # True when an identical upload was already stored
+
+
+def store_dir(uploads_dir: Path) -> Path:
+    """Return (and create) the content-addressed store inside uploads_dir"""
+    path = uploads_dir / STORE_DIRNAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def blob_path(uploads_dir: Path, digest: str, suffix: str = "") -> Path:
+    """Location of a blob; sharded by the first two hex digits of its digest"""
+    return store_dir(uploads_dir) / digest[:2] / f"{digest}{suffix}"
+
+
+def store_stream(fileobj: BinaryIO, uploads_dir: Path, suffix: str = "") -> StoredBlob:
+    """Stream fileobj to disk while hashing it and store it under its digest.
+
+    The data is written once to a temporary file next to the store; if a blob
+    with the same digest already exists the temporary copy is discarded,
+    otherwise it is atomically renamed into place.
+    """
+    root = store_dir(uploads_dir)
+    hasher = hashlib.sha256()
+    size = 0
+
+    fd, tmp_name = tempfile.mkstemp(dir=str(root), prefix="incoming_")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        return adopt_file(Path(tmp_name), uploads_dir, hasher.hexdigest(), suffix)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+class UploadTooLarge(ValueError):
+    """A streamed upload passed its size limit"""
+
+
+async def write_stream(chunks: AsyncIterator[bytes], out: BinaryIO, max_bytes: Optional[int] = None) -> tuple:
+    """Write an async byte stream to out, hashing it in the same pass; returns (digest, size).
+
+    Raises UploadTooLarge as soon as more than max_bytes have arrived.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    pending = []
+    pending_size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        hasher.update(chunk)
+        pending.append(chunk)
+        pending_size += len(chunk)
+        # Network chunks are small; write in CHUNK_SIZE batches
+        if pending_size >= CHUNK_SIZE:
+            out.write(b"".join(pending))
+            pending, pending_size = [], 0
+    out.write(b"".join(pending))
+    return hasher.hexdigest(), size
+
+
+async def store_async_stream(chunks: AsyncIterator[bytes], uploads_dir: Path, suffix: str = "",
+                             max_bytes: Optional[int] = None,
+                             validate: Optional[Callable[[BinaryIO], None]] = None) -> StoredBlob:
+    """store_stream for async byte streams (e.g. a raw request body).
+
+    validate, if given, inspects the written file (in the threadpool) before it
+    enters the store; whatever it raises propagates and the partial file is removed.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=str(store_dir(uploads_dir)), prefix="incoming_")
+    try:
+        with os.fdopen(fd, "w+b") as out:
+            digest, _ = await write_stream(chunks, out, max_bytes)
+            out.flush()
+            if validate is not None:
+                await run_in_threadpool(validate, out)
+        return adopt_file(Path(tmp_name), uploads_dir, digest, suffix)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def adopt_file(path: Path, uploads_dir: Path, digest: str, suffix: str = "") -> StoredBlob:
+    """Move a complete file with a known digest into the store.
+
+    path must live on the same filesystem as the store (e.g. inside it), so
+    this is a rename; if the blob already exists the file is discarded.
+    """
+    size = path.stat().st_size
+    # Temporary files are created 0600; stored uploads are served (possibly by nginx) to everyone
+    os.chmod(path, 0o644)
+    final_path = blob_path(uploads_dir, digest, suffix)
+    if final_path.exists():
+        os.unlink(path)
+        return StoredBlob(digest=digest, path=final_path, size=size, existed=True)
+
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, final_path)
+    return StoredBlob(digest=digest, path=final_path, size=size, existed=False)
+
+
+def link_blob(blob: Path, dest: Path) -> Path:
+    """Create a cheap reference to a stored blob at dest.
+
+    Hard links share the blob's data on disk; when the filesystem does not
+    support them we fall back to a regular copy.
+    """
+    if dest.exists():
+        dest.unlink()
+    try:
+        os.link(blob, dest)
+    except OSError:
+        shutil.copy2(blob, dest)
+    return dest
+
+
+def _result_path(uploads_dir: Path, digest: str) -> Path:
+    return blob_path(uploads_dir, digest, ".result.json")
+
+
+def load_result(uploads_dir: Path, digest: str) -> Optional[dict]:
+    """Return the cached processing result for a digest if its output still exists"""
+    path = _result_path(uploads_dir, digest)
+    if not path.exists():
+        return None
+    try:
+        result = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+    filename = result.get("filename")
+    if not filename or not (uploads_dir / filename).exists():
+        return None
+    return result
+
+
+def save_result(uploads_dir: Path, digest: str, result: dict) -> None:
+    """Remember the processing result for a digest so repeat uploads can reuse it"""
+    # Only results served from our own uploads directory can be reused
+    if not str(result.get("url", "")).startswith("/uploads/"):
+        return
+    # Failed conversions are retried on the next upload rather than remembered
+    if str(result.get("processing_type", "")).endswith(("_fallback", "_error")):
+        return
+    path = _result_path(uploads_dir, digest)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(result))
+    os.replace(tmp_path, path)
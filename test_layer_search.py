@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Query-count test for layer search: a page of layers must come from one statement
+Runs against the database in DATABASE_URL; everything it writes is rolled back
+"""
+
+import asyncio
+
+import pytest
+from fastapi import Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import auth
+from layer_api import search_layers
+from models import Base, Layer, LayerRating, User
+
+PAGE_SIZE = 100
+# Statements one search may run; more means something is loading per row again
+SEARCH_QUERY_BUDGET = 1
+
+# auth leaves engine as None when it cannot reach the database
+pytestmark = pytest.mark.skipif(auth.engine is None, reason="needs a PostgreSQL database")
+
+
+class QueryCounter:
+    """Counts the ORM statements (lazy loads included) a session runs inside a with block"""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.count = 0
+
+    def _count(self, orm_execute_state):
+        self.count += 1
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self.db, "do_orm_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.db, "do_orm_execute", self._count)
+
+
+def _populate(db: Session) -> User:
+    """More than a page of rated layers from several owners; returns a user who rated some of them"""
+    users = [User(email=f"search-test-{i}@example.com", username=f"search-test-{i}",
+                  oauth_provider="test", oauth_id=f"search-test-{i}") for i in range(5)]
+    db.add_all(users)
+    db.flush()
+    layers = [Layer(user_id=users[i % 5].id, title=f"Search test layer {i}", tags=[], license="CC BY 4.0",
+                    category="general", is_public=True) for i in range(PAGE_SIZE + 20)]
+    db.add_all(layers)
+    db.flush()
+    for i, layer in enumerate(layers[:PAGE_SIZE // 2]):
+        for user in users[:i % 5 + 1]:
+            db.add(LayerRating(layer_id=layer.id, user_id=user.id, rating=i % 5 + 1))
+    db.flush()
+    # Start the search from an empty identity map, as a request does
+    caller_id = users[0].id
+    db.expunge_all()
+    return db.get(User, caller_id)
+
+
+def _search(db: Session, current_user) -> tuple:
+    """Run one search page; returns (layers, statements)"""
+    with QueryCounter(db) as queries:
+        layers = asyncio.run(search_layers(
+            response=Response(), query=None, category=None, license=None, tags=None, min_rating=None,
+            is_public=True, bbox=None, sort_by=None, sort_order=None, page=1, limit=PAGE_SIZE,
+            cursor=None, current_user=current_user, db=db,
+        ))
+    return layers, queries.count
+
+
+def _check_search(with_caller: bool) -> None:
+    connection = auth.engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        Base.metadata.create_all(connection)
+        caller = _populate(db)
+        layers, statements = _search(db, caller if with_caller else None)
+        assert len(layers) == PAGE_SIZE, f"expected a full page, got {len(layers)} layers"
+        assert statements <= SEARCH_QUERY_BUDGET, (
+            f"search ran {statements} statements for {len(layers)} layers (budget {SEARCH_QUERY_BUDGET})")
+        print(f"✅ {len(layers)} layers in {statements} statement(s) {'with' if with_caller else 'without'} a caller")
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+
+def test_search_page_without_caller():
+    _check_search(with_caller=False)
+
+
+def test_search_page_with_caller():
+    _check_search(with_caller=True)
+
+
+if __name__ == "__main__":
+    if auth.engine is None:
+        print("⚠️  Skipped: needs a PostgreSQL database (DATABASE_URL)")
+    else:
+        test_search_page_without_caller()
+        test_search_page_with_caller()
@@ -6,8 +6,21 @@ Test script for the universal 3D model upload system
 import requests
 import json
 import os
+import time
 from pathlib import Path
 
+def wait_for_job(base_url, upload_result, timeout=300):
+    """Poll the conversion job started by an upload until it finishes"""
+    result = upload_result
+    deadline = time.time() + timeout
+    while result.get("status") in ("queued", "running") and time.time() < deadline:
+        time.sleep(1)
+        job = requests.get(f"{base_url}{upload_result['status_url']}").json()
+        if job["status"] == "failed":
+            raise RuntimeError(f"Conversion job failed: {job['error']}")
+        result = {**upload_result, **(job.get("result") or {}), "status": job["status"]}
+    return result
+
 def test_upload_endpoint():
     """Test the universal upload endpoint with different file types"""
     
@@ -51,13 +64,10 @@ def test_upload_endpoint():
         response = requests.post(f"{base_url}/api/upload-model", files=files)
         
         print(f"Response: {response.status_code}")
-        if response.status_code == 200:
-            result = response.json()
-            print(f"✅ Upload successful: {result['message']}")
-            print(f"   Processing type: {result['processing_type']}")
-            print(f"   File size: {result['size']} bytes")
+        if response.status_code == 400:
+            print(f"✅ Correctly rejected fake GLB: {response.json()['detail']}")
         else:
-            print(f"❌ Upload failed: {response.text}")
+            print(f"❌ Unexpected response: {response.text}")
     except Exception as e:
         print(f"❌ Test failed: {e}")
     
@@ -76,7 +86,7 @@ f 1 2 3
         
         print(f"Response: {response.status_code}")
         if response.status_code == 200:
-            result = response.json()
+            result = wait_for_job(base_url, response.json())
             print(f"✅ Upload successful: {result['message']}")
             print(f"   Processing type: {result['processing_type']}")
             print(f"   File size: {result['size']} bytes")
@@ -103,7 +113,7 @@ f 1 2 3
         
         print(f"Response: {response.status_code}")
         if response.status_code == 200:
-            result = response.json()
+            result = wait_for_job(base_url, response.json())
             print(f"✅ Upload successful: {result['message']}")
             print(f"   Processing type: {result['processing_type']}")
             print(f"   File size: {result['size']} bytes")
@@ -112,6 +122,70 @@ f 1 2 3
     except Exception as e:
         print(f"❌ Test failed: {e}")
 
+    # Test 6: Resumable chunked upload
+    print("\n🧪 Test 6: Resumable chunked upload")
+    try:
+        obj_data = b"v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n" * 1000
+        response = requests.post(f"{base_url}/api/uploads",
+                                 headers={"Upload-Length": str(len(obj_data)), "X-Filename": "chunked.obj"})
+        upload_url = f"{base_url}{response.json()['upload_url']}"
+        
+        # Send the first half, then resume from the offset the server reports
+        requests.patch(upload_url, headers={"Upload-Offset": "0"}, data=obj_data[:len(obj_data) // 2])
+        offset = int(requests.head(upload_url).headers["Upload-Offset"])
+        requests.patch(upload_url, headers={"Upload-Offset": str(offset)}, data=obj_data[offset:])
+        
+        response = requests.post(f"{upload_url}/finish")
+        print(f"Response: {response.status_code}")
+        if response.status_code == 200:
+            result = wait_for_job(base_url, response.json())
+            print(f"✅ Resumed at {offset} bytes, upload successful: {result['message']}")
+        else:
+            print(f"❌ Upload failed: {response.text}")
+    except Exception as e:
+        print(f"❌ Test failed: {e}")
+
+    # Test 7: Raw-body upload (no multipart)
+    print("\n🧪 Test 7: Raw-body upload")
+    try:
+        obj_data = b"v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 3\n"
+        response = requests.put(f"{base_url}/api/upload-model/raw_model.obj", data=obj_data)
+        
+        print(f"Response: {response.status_code}")
+        if response.status_code == 200:
+            result = wait_for_job(base_url, response.json())
+            print(f"✅ Upload successful: {result['message']}")
+        else:
+            print(f"❌ Upload failed: {response.text}")
+    except Exception as e:
+        print(f"❌ Test failed: {e}")
+
+    # Test 8: Packed tileset served tile by tile
+    print("\n🧪 Test 8: Packed .3tz tileset")
+    try:
+        import io
+        import zipfile
+        tileset = {"asset": {"version": "1.1"}, "geometricError": 100,
+                   "root": {"boundingVolume": {"box": [0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1]},
+                            "geometricError": 0, "content": {"uri": "tiles/0/0.json"}}}
+        child = dict(tileset, root={k: v for k, v in tileset["root"].items() if k != "content"})
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as container:
+            container.writestr("tileset.json", json.dumps(tileset))
+            container.writestr("tiles/0/0.json", json.dumps(child))
+        response = requests.put(f"{base_url}/api/upload-model/packed.3tz", data=buffer.getvalue())
+        
+        print(f"Response: {response.status_code}")
+        if response.status_code == 200:
+            result = wait_for_job(base_url, response.json())
+            tile_url = result["url"].rsplit("/", 1)[0] + "/tiles/0/0.json"
+            tile = requests.get(f"{base_url}{tile_url}")
+            print(f"✅ Child tile served from the container: {tile.status_code}")
+        else:
+            print(f"❌ Upload failed: {response.text}")
+    except Exception as e:
+        print(f"❌ Test failed: {e}")
+
 if __name__ == "__main__":
     print("🚀 Testing Universal 3D Model Upload System")
     print("=" * 50)
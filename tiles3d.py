@@ -0,0 +1,139 @@
+"""
+3D Tiles helpers for MyEarth.app
+Bounding volumes and tileset.json writing shared by the tiling converters
+"""
+
+import json
+import struct
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+TILES_VERSION = "1.1"
+
+PNTS_MAGIC = b"pnts"
+B3DM_MAGIC = b"b3dm"
+TILE_HEADER_SIZE = 28
+
+
+def box_volume(lower: np.ndarray, upper: np.ndarray) -> dict:
+    """3D Tiles oriented box for an axis-aligned [lower, upper] range"""
+    center = (np.asarray(lower, dtype=np.float64) + np.asarray(upper, dtype=np.float64)) / 2
+    half = np.maximum((np.asarray(upper, dtype=np.float64) - np.asarray(lower, dtype=np.float64)) / 2, 1e-6)
+    return {"box": [
+        float(center[0]), float(center[1]), float(center[2]),
+        float(half[0]), 0.0, 0.0,
+        0.0, float(half[1]), 0.0,
+        0.0, 0.0, float(half[2]),
+    ]}
+
+
+def region_volume(west: float, south: float, east: float, north: float,
+                  min_height: float, max_height: float) -> dict:
+    """3D Tiles region from bounds in degrees and metres"""
+    return {"region": [
+        float(np.radians(west)), float(np.radians(south)),
+        float(np.radians(east)), float(np.radians(north)),
+        float(min_height), float(max_height),
+    ]}
+
+
+def y_up_to_z_up(lower: np.ndarray, upper: np.ndarray):
+    """Convert glTF (y-up) bounds to the z-up frame tiles are placed in"""
+    return (
+        np.array([lower[0], -upper[2], lower[1]]),
+        np.array([upper[0], -lower[2], upper[1]]),
+    )
+
+
+def diagonal(lower: np.ndarray, upper: np.ndarray) -> float:
+    return float(np.linalg.norm(np.asarray(upper) - np.asarray(lower)))
+
+
+def tile(bounding_volume: dict, geometric_error: float, content_uri: Optional[str] = None,
+         children: Optional[List[dict]] = None, refine: Optional[str] = None) -> dict:
+    """Build a tile dictionary"""
+    result = {"boundingVolume": bounding_volume, "geometricError": float(geometric_error)}
+    if refine:
+        result["refine"] = refine
+    if content_uri:
+        result["content"] = {"uri": content_uri}
+    if children:
+        result["children"] = children
+    return result
+
+
+def write_tileset(path: Path, root: dict, geometric_error: Optional[float] = None,
+                  extras: Optional[dict] = None) -> int:
+    """Write tileset.json; returns its size in bytes"""
+    tileset = {
+        "asset": {"version": TILES_VERSION, "generator": "MyEarth"},
+        "geometricError": float(root["geometricError"] if geometric_error is None else geometric_error),
+        "root": root,
+    }
+    if extras:
+        tileset["extras"] = extras
+    data = json.dumps(tileset, separators=(",", ":")).encode("utf-8")
+    Path(path).write_bytes(data)
+    return len(data)
+
+
+# --------------------
+# Tile formats
+# --------------------
+def _padded_json(data: dict, offset: int) -> bytes:
+    """JSON padded with spaces so the next section starts 8-byte aligned"""
+    encoded = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return encoded + b" " * (-(offset + len(encoded)) % 8)
+
+
+def _padded_binary(data: bytes) -> bytes:
+    return data + b"\x00" * (-len(data) % 8)
+
+
+def write_pnts(path: Path, positions: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+               colors: np.ndarray = None) -> int:
+    """Write a point cloud tile with uint16-quantized positions inside [lower, upper]
+
+    colors are optional (N, 3) uint8 RGB values. Returns the tile size in bytes.
+    """
+    lower = np.asarray(lower, dtype=np.float64)
+    extent = np.maximum(np.asarray(upper, dtype=np.float64) - lower, 1e-9)
+    quantized = np.clip(np.round((positions - lower) / extent * 65535), 0, 65535).astype("<u2")
+
+    body = quantized.tobytes()
+    feature_table = {
+        "POINTS_LENGTH": len(positions),
+        "QUANTIZED_VOLUME_OFFSET": lower.tolist(),
+        "QUANTIZED_VOLUME_SCALE": extent.tolist(),
+        "POSITION_QUANTIZED": {"byteOffset": 0},
+    }
+    if colors is not None:
+        body += b"\x00" * (-len(body) % 4)
+        feature_table["RGB"] = {"byteOffset": len(body)}
+        body += np.ascontiguousarray(colors, dtype=np.uint8).tobytes()
+
+    table_json = _padded_json(feature_table, TILE_HEADER_SIZE)
+    table_binary = _padded_binary(body)
+    length = TILE_HEADER_SIZE + len(table_json) + len(table_binary)
+    header = struct.pack("<4sIIIIII", PNTS_MAGIC, 1, length, len(table_json), len(table_binary), 0, 0)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(table_json)
+        f.write(table_binary)
+    return length
+
+
+def write_b3dm(path: Path, glb: bytes, batch_length: int, batch_table: Optional[dict] = None) -> int:
+    """Write a batched 3D model tile around a GLB whose vertices carry _BATCHID; returns its size"""
+    table_json = _padded_json({"BATCH_LENGTH": batch_length}, TILE_HEADER_SIZE)
+    batch_json = _padded_json(batch_table, TILE_HEADER_SIZE + len(table_json)) if batch_table else b""
+    length = TILE_HEADER_SIZE + len(table_json) + len(batch_json) + len(glb)
+    header = struct.pack("<4sIIIIII", B3DM_MAGIC, 1, length, len(table_json), 0, len(batch_json), 0)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(table_json)
+        f.write(batch_json)
+        f.write(glb)
+    return length
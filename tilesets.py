@@ -0,0 +1,221 @@
+"""
+Tileset serving for MyEarth.app
+Resolves tile paths inside multi-file tilesets (tileset.json, external child
+tilesets and tiles in sub-directories) and reads tiles straight out of packed
+.3tz containers by offset, sharing one open file handle per container
+"""
+
+import json
+import os
+import shutil
+import struct
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from fastapi.concurrency import iterate_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+import tiles3d
+from archives import safe_member_name
+from http_files import (
+    IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, accepts_encoding, is_not_modified, parse_range,
+)
+
+CONTAINER_SUFFIX = ".3tz"
+ROOT_TILESET = "tileset.json"
+READ_SIZE = 256 * 1024
+MAX_OPEN_CONTAINERS = 64
+
+LOCAL_HEADER = struct.Struct("<4s22xHH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+# gzip member header for a deflate stream: no name, mtime 0, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def resolve_path(root: Path, relative: str) -> Optional[Path]:
+    """relative below root, or None when it escapes root or names a hidden file"""
+    name = safe_member_name(relative)
+    if name is None:
+        return None
+    path = (root / name).resolve()
+    return path if path.is_relative_to(root.resolve()) else None
+
+
+def publish_tileset_directory(source_dir: Path, uploads_dir: Path, name: str) -> Path:
+    """Move a converter's output tree to uploads_dir/name, keeping every child tile.
+
+    uploads_dir/{name}.json is written as an external tileset that points at
+    the tree's own tileset.json, so callers publish it like a flat tileset.
+    """
+    tileset = json.loads((source_dir / ROOT_TILESET).read_text())
+    target = uploads_dir / name
+    shutil.move(str(source_dir), str(target))
+    root = tileset["root"]
+    stub = tiles3d.tile(root["boundingVolume"], tileset.get("geometricError", root["geometricError"]),
+                        content_uri=f"{name}/{ROOT_TILESET}", refine=root.get("refine"))
+    stub_path = uploads_dir / f"{name}.json"
+    tiles3d.write_tileset(stub_path, stub)
+    return stub_path
+
+
+# --------------------
+# .3tz containers
+# --------------------
+@dataclass
+class ContainerEntry:
+    name: str
+    offset: int  # first byte of the stored data in the container
+    size: int
+    compressed_size: int
+    deflated: bool
+    crc: int
+
+
+class TileContainer:
+    """Read-only .3tz (zip) tileset: the central directory is read once, tiles by offset.
+
+    Reads use os.pread on a single descriptor, so concurrent requests share
+    it without seeking each other around.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.stat = path.stat()
+        with zipfile.ZipFile(path) as archive:
+            self.infos = {}
+            for info in archive.infolist():
+                name = None if info.is_dir() else safe_member_name(info.filename)
+                if name and info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    self.infos[name] = info
+        self.fd = os.open(path, os.O_RDONLY)
+        self._entries: Dict[str, ContainerEntry] = {}
+
+    def __del__(self):
+        # Responses still streaming keep the container alive after it leaves the cache
+        if getattr(self, "fd", None) is not None:
+            os.close(self.fd)
+
+    def entry(self, name: str) -> Optional[ContainerEntry]:
+        entry = self._entries.get(name)
+        if entry is None:
+            info = self.infos.get(name)
+            if info is None:
+                return None
+            # Data starts after the local header, whose extra field may differ from the central one
+            signature, name_length, extra_length = LOCAL_HEADER.unpack(
+                os.pread(self.fd, LOCAL_HEADER.size, info.header_offset))
+            if signature != LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad local header for {name}")
+            entry = ContainerEntry(name, info.header_offset + LOCAL_HEADER.size + name_length + extra_length,
+                                   info.file_size, info.compress_size,
+                                   info.compress_type == zipfile.ZIP_DEFLATED, info.CRC)
+            self._entries[name] = entry
+        return entry
+
+    def raw_chunks(self, entry: ContainerEntry, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes start..end (inclusive) of the entry as stored in the container"""
+        position = entry.offset + start
+        stop = entry.offset + (entry.compressed_size - 1 if end is None else end) + 1
+        while position < stop:
+            chunk = os.pread(self.fd, min(READ_SIZE, stop - position), position)
+            if not chunk:
+                raise zipfile.BadZipFile(f"{entry.name} is truncated")
+            position += len(chunk)
+            yield chunk
+
+    def chunks(self, entry: ContainerEntry) -> Iterator[bytes]:
+        """The entry's uncompressed bytes"""
+        if not entry.deflated:
+            yield from self.raw_chunks(entry)
+            return
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        for chunk in self.raw_chunks(entry):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        yield decompressor.flush()
+
+    def gzip_chunks(self, entry: ContainerEntry) -> Iterator[bytes]:
+        """A deflated entry as a gzip stream, without recompressing it"""
+        yield GZIP_HEADER
+        yield from self.raw_chunks(entry)
+        yield struct.pack("<II", entry.crc, entry.size & 0xFFFFFFFF)
+
+
+_containers: "OrderedDict[tuple, TileContainer]" = OrderedDict()
+_containers_lock = threading.Lock()
+
+
+def open_container(path: Path) -> TileContainer:
+    """Shared TileContainer for path, reopened when the file changes"""
+    stat_result = path.stat()
+    key = (str(path), stat_result.st_ino, stat_result.st_mtime_ns)
+    with _containers_lock:
+        container = _containers.get(key)
+        if container is not None:
+            _containers.move_to_end(key)
+            return container
+    container = TileContainer(path)
+    with _containers_lock:
+        container = _containers.setdefault(key, container)
+        if len(_containers) > MAX_OPEN_CONTAINERS:
+            _containers.popitem(last=False)
+    return container
+
+
+def serve_container_entry(request: Request, container: TileContainer, entry: ContainerEntry,
+                          media_type: Optional[str] = None, immutable: bool = False) -> Response:
+    """Serve one tile of a container with validators, 304s and byte ranges of stored entries"""
+    stat_result = container.stat
+    gzipped = entry.deflated and accepts_encoding(request.headers.get("accept-encoding", ""), "gzip")
+    etag = (f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{entry.crc:08x}-{entry.size:x}'
+            f'{"-gz" if gzipped else ""}"')
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
+    if entry.deflated:
+        headers["vary"] = "Accept-Encoding"
+    else:
+        headers["accept-ranges"] = "bytes"
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    status_code = 200
+    if gzipped:
+        headers["content-encoding"] = "gzip"
+        # gzip header and trailer around the stored deflate stream
+        headers["content-length"] = str(len(GZIP_HEADER) + entry.compressed_size + 8)
+        body = container.gzip_chunks(entry)
+    elif entry.deflated:
+        headers["content-length"] = str(entry.size)
+        body = container.chunks(entry)
+    else:
+        start, end = 0, entry.size - 1
+        range_header = request.headers.get("range")
+        if range_header and request.headers.get("if-range", etag).strip() == etag:
+            try:
+                byte_range = parse_range(range_header, entry.size)
+            except ValueError:
+                byte_range = ()
+            if byte_range is None:
+                return Response(status_code=416, headers={**headers, "content-range": f"bytes */{entry.size}"})
+            if byte_range:
+                start, end = byte_range
+                status_code = 206
+                headers["content-range"] = f"bytes {start}-{end}/{entry.size}"
+        headers["content-length"] = str(end - start + 1)
+        body = container.raw_chunks(entry, start, end) if end >= start else iter(())
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(iterate_in_threadpool(body), status_code=status_code, headers=headers,
+                             media_type=media_type)
@@ -0,0 +1,257 @@
+"""
+Upload validation for MyEarth.app
+Checks that an upload really is the format its extension claims by reading
+headers only (magic bytes, GLB chunk table, glTF/tileset JSON essentials,
+LAS header, zip central directory), before it is stored or converted
+"""
+
+import json
+import os
+import struct
+import zipfile
+from typing import BinaryIO, Callable, Dict
+
+from pointcloud import LAS_HEADER_READ, parse_las_header
+
+GLB_MAGIC = b"glTF"
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+TILE_MAGICS = {".b3dm": b"b3dm", ".i3dm": b"i3dm", ".pnts": b"pnts", ".cmpt": b"cmpt"}
+
+# Whole-document checks (.gltf, tileset .json) are skipped above this size
+MAX_JSON_VALIDATE_BYTES = 64 * 1024 * 1024
+HEAD_BYTES = 4096
+
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+# Formats recognised by their leading bytes alone
+MAGIC_PREFIXES = {
+    ".7z": [b"7z\xbc\xaf\x27\x1c"],
+    ".rar": [b"Rar!\x1a\x07"],
+    ".blend": [b"BLENDER"],
+    ".ply": [b"ply\n", b"ply\r\n"],
+    ".jpg": [b"\xff\xd8\xff"],
+    ".jpeg": [b"\xff\xd8\xff"],
+    ".png": [b"\x89PNG\r\n\x1a\n"],
+    ".tif": [b"II*\x00", b"MM\x00*"],
+    ".tiff": [b"II*\x00", b"MM\x00*"],
+    ".ifc": [b"ISO-10303-21"],
+    ".dwg": [b"AC10"],
+    ".mb": [b"FOR4", b"FOR8"],
+    ".max": [OLE_MAGIC],
+    ".rvt": [OLE_MAGIC],
+    ".3ds": [b"\x4d\x4d"],
+}
+XML_FORMATS = {".kml", ".gml", ".citygml", ".dae"}
+TEXT_FORMATS = {".obj", ".ma"}
+
+
+class InvalidUpload(ValueError):
+    """The upload does not match the format its extension claims"""
+
+
+def _size(f: BinaryIO) -> int:
+    f.seek(0, os.SEEK_END)
+    return f.tell()
+
+
+def _head(f: BinaryIO, length: int = HEAD_BYTES) -> bytes:
+    f.seek(0)
+    return f.read(length)
+
+
+def _is_text(data: bytes) -> bool:
+    return b"\x00" not in data
+
+
+def _load_json(f: BinaryIO, what: str):
+    if _size(f) > MAX_JSON_VALIDATE_BYTES:
+        return None
+    try:
+        data = json.loads(_head(f, MAX_JSON_VALIDATE_BYTES))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidUpload(f"{what} is not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise InvalidUpload(f"{what} must be a JSON object")
+    return data
+
+
+# --------------------
+# Format checks
+# --------------------
+def _check_gltf_json(gltf: dict, what: str) -> None:
+    version = str(gltf.get("asset", {}).get("version", "")) if isinstance(gltf.get("asset"), dict) else ""
+    if not version.startswith("2."):
+        raise InvalidUpload(f"{what} needs asset.version 2.x")
+    for key in ("accessors", "bufferViews", "buffers", "meshes", "nodes", "materials", "images"):
+        if not isinstance(gltf.get(key, []), list):
+            raise InvalidUpload(f"{what} '{key}' must be an array")
+    for mesh in gltf.get("meshes", []):
+        if not isinstance(mesh, dict) or not isinstance(mesh.get("primitives"), list) or not mesh["primitives"]:
+            raise InvalidUpload(f"{what} meshes need primitives")
+    for accessor in gltf.get("accessors", []):
+        if not isinstance(accessor, dict) or not all(k in accessor for k in ("componentType", "count", "type")):
+            raise InvalidUpload(f"{what} accessors need componentType, count and type")
+
+
+def check_glb(f: BinaryIO) -> None:
+    size = _size(f)
+    header = _head(f, 20)
+    if len(header) < 20 or header[:4] != GLB_MAGIC:
+        raise InvalidUpload("Not a GLB file (missing glTF header)")
+    version, length, json_length, json_type = struct.unpack_from("<IIII", header, 4)
+    if version != 2:
+        raise InvalidUpload(f"Unsupported GLB version {version}")
+    if length != size:
+        raise InvalidUpload(f"GLB header length {length} does not match file size {size}")
+    if json_type != GLB_CHUNK_JSON or json_length == 0 or 20 + json_length > size:
+        raise InvalidUpload("GLB JSON chunk is missing or truncated")
+
+    # Walk the remaining chunk headers without reading their payloads
+    offset = 20 + json_length
+    while offset < size:
+        f.seek(offset)
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise InvalidUpload("GLB chunk header is truncated")
+        chunk_length, _ = struct.unpack("<II", chunk)
+        offset += 8 + chunk_length
+        if offset > size:
+            raise InvalidUpload("GLB chunk is truncated")
+
+    if json_length <= MAX_JSON_VALIDATE_BYTES:
+        f.seek(20)
+        try:
+            gltf = json.loads(f.read(json_length))
+        except (ValueError, UnicodeDecodeError) as e:
+            raise InvalidUpload(f"GLB JSON chunk is not valid JSON: {e}")
+        if not isinstance(gltf, dict):
+            raise InvalidUpload("GLB JSON chunk must be a JSON object")
+        _check_gltf_json(gltf, "GLB")
+
+
+def check_gltf(f: BinaryIO) -> None:
+    gltf = _load_json(f, "glTF")
+    if gltf is not None:
+        _check_gltf_json(gltf, "glTF")
+
+
+def check_tileset(f: BinaryIO) -> None:
+    tileset = _load_json(f, "Tileset")
+    if tileset is None:
+        return
+    root = tileset.get("root")
+    if not isinstance(tileset.get("asset"), dict) or not isinstance(root, dict):
+        raise InvalidUpload("Tileset JSON needs 'asset' and 'root'")
+    if "boundingVolume" not in root or "geometricError" not in tileset:
+        raise InvalidUpload("Tileset root needs a boundingVolume and the tileset a geometricError")
+
+
+def check_tile(f: BinaryIO, magic: bytes) -> None:
+    header = _head(f, 12)
+    if len(header) < 12 or header[:4] != magic:
+        raise InvalidUpload(f"Not a {magic.decode()} tile")
+    byte_length, = struct.unpack_from("<I", header, 8)
+    if byte_length != _size(f):
+        raise InvalidUpload(f"{magic.decode()} byteLength does not match file size")
+
+
+def check_las(f: BinaryIO) -> None:
+    data = _head(f, LAS_HEADER_READ)
+    if data[:4] != b"LASF":
+        raise InvalidUpload("Not a LAS/LAZ file (missing LASF signature)")
+    # Compressed (LAZ) records are handed to PotreeConverter, which reads them itself
+    if len(data) > 104 and data[104] & 0xC0:
+        return
+    try:
+        parse_las_header(data, _size(f))
+    except (ValueError, struct.error) as e:
+        raise InvalidUpload(f"Invalid LAS header: {e}")
+
+
+def check_zip(f: BinaryIO) -> None:
+    # ZipFile reads the end record and central directory only
+    f.seek(0)
+    try:
+        with zipfile.ZipFile(f) as archive:
+            if not archive.infolist():
+                raise InvalidUpload("Archive is empty")
+    except zipfile.BadZipFile as e:
+        raise InvalidUpload(f"Invalid zip archive: {e}")
+
+
+def check_tile_container(f: BinaryIO) -> None:
+    f.seek(0)
+    try:
+        with zipfile.ZipFile(f) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile as e:
+        raise InvalidUpload(f"Invalid .3tz container: {e}")
+    if "tileset.json" not in names:
+        raise InvalidUpload(".3tz container has no tileset.json at its root")
+
+
+def check_splat(f: BinaryIO) -> None:
+    size = _size(f)
+    if size == 0 or size % 32:
+        raise InvalidUpload(".splat files are a whole number of 32-byte records")
+
+
+def check_stl(f: BinaryIO) -> None:
+    size = _size(f)
+    header = _head(f, 84)
+    if len(header) == 84 and 84 + 50 * struct.unpack_from("<I", header, 80)[0] == size:
+        return
+    if header.lstrip()[:5].lower() == b"solid" and _is_text(_head(f)):
+        return
+    raise InvalidUpload("Not an STL file (neither binary layout nor ASCII 'solid')")
+
+
+def check_fbx(f: BinaryIO) -> None:
+    head = _head(f)
+    if not (head.startswith(b"Kaydara FBX Binary") or (_is_text(head) and head.strip())):
+        raise InvalidUpload("Not an FBX file")
+
+
+def check_xml(f: BinaryIO) -> None:
+    head = _head(f).lstrip(b"\xef\xbb\xbf").lstrip()
+    if not head.startswith(b"<"):
+        raise InvalidUpload("Not an XML document")
+
+
+def check_text(f: BinaryIO) -> None:
+    head = _head(f)
+    if not head.strip() or not _is_text(head):
+        raise InvalidUpload("Expected a text file")
+
+
+CHECKS: Dict[str, Callable[[BinaryIO], None]] = {
+    ".glb": check_glb,
+    ".gltf": check_gltf,
+    ".json": check_tileset,
+    ".las": check_las,
+    ".laz": check_las,
+    ".zip": check_zip,
+    ".kmz": check_zip,
+    ".3tz": check_tile_container,
+    ".splat": check_splat,
+    ".stl": check_stl,
+    ".fbx": check_fbx,
+    **{ext: (lambda f, magic=magic: check_tile(f, magic)) for ext, magic in TILE_MAGICS.items()},
+    **{ext: check_xml for ext in XML_FORMATS},
+    **{ext: check_text for ext in TEXT_FORMATS},
+}
+
+
+def validate_upload(f: BinaryIO, extension: str) -> None:
+    """Raise InvalidUpload unless the seekable file f looks like a valid extension file"""
+    try:
+        if _size(f) == 0:
+            raise InvalidUpload("File is empty")
+        if extension in CHECKS:
+            CHECKS[extension](f)
+        elif extension in MAGIC_PREFIXES:
+            head = _head(f, 16)
+            if not any(head.startswith(prefix) for prefix in MAGIC_PREFIXES[extension]):
+                raise InvalidUpload(f"File content does not match the {extension} format")
+    finally:
+        f.seek(0)